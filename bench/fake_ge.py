@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Stand-in for the Grid Engine commands used by node_search (qstat, qconf and qhost) for the benchmark.
+bench/bin/qstat, bench/bin/qconf and bench/bin/qhost are links to this file, which replays the output of
+the command it was called as from the fixture directory in $NS_BENCH_FIXTURE and appends the command line
+to $NS_BENCH_LOG, so the benchmark can count how many commands a mode runs.
+Fixture directory layout:
+    <command with spaces replaced by '_'>  output of that command, i.e. 'qconf_-shgrp_tree_@corke'
+    jobs/<job id>                            'qstat -j <job id>' of one job, joined for 'qstat -j id1,id2'
+    xymon/<node>.html                        xymon cpu page of a node, served by stub_xymon.py
+The text %BENCH_USER% in any fixture is replaced by $NS_BENCH_USER, so the recorded jobs belong to a user
+which exists on the machine running the benchmark.
+Exit codes follow the real commands: 0 on success, 1 when there is no fixture for the command."""
+
+import os, sys
+
+USER_TOKEN = '%BENCH_USER%'
+
+def read_fixture(path):
+    """Returns the content of a fixture file with the bench user filled in, None if there is no such file."""
+    try:
+        with open(path) as fixture:
+            content = fixture.read()
+    except OSError:
+        return None
+    return content.replace(USER_TOKEN, os.environ.get('NS_BENCH_USER', USER_TOKEN))
+#^----------------------------------------------------------------------------- read_fixture(path)
+
+def replay(fixture_dir, prog, args):
+    """Returns the output of 'prog args' from fixture_dir, None if the fixture has no such command."""
+
+    if prog == 'qstat' and args[:1] == ['-j'] and len(args) == 2:
+        jobs = [read_fixture(os.path.join(fixture_dir, 'jobs', job_id)) for job_id in args[1].split(',')]
+        return '\n'.join(job.rstrip('\n') for job in jobs if job is not None) + '\n'
+    if prog == 'qconf' and args[:1] == ['-su'] and len(args) == 2 and ',' in args[1]:
+        user_lists = [read_fixture(os.path.join(fixture_dir, 'qconf_-su_' + ul)) for ul in args[1].split(',')]
+        if None in user_lists:
+            return None
+        return ''.join(user_lists)
+    if prog == 'qhost' and args[:1] == ['-h'] and len(args) == 2:
+        qhost = read_fixture(os.path.join(fixture_dir, 'qhost'))
+        if qhost is None:
+            return None
+        wanted = set(args[1].split(','))
+        lines = qhost.split('\n')
+        return '\n'.join(lines[:3] + [line for line in lines[3:] if line.split()[:1] and line.split()[0] in wanted]) + '\n'
+    return read_fixture(os.path.join(fixture_dir, '_'.join([prog] + args)))
+#^----------------------------------------------------------------------------- replay(fixture_dir, prog, args)
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    log = os.environ.get('NS_BENCH_LOG')
+    if log:
+        with open(log, 'a') as log_file:
+            log_file.write(' '.join([prog] + args) + '\n')
+    output = replay(os.environ['NS_BENCH_FIXTURE'], prog, args)
+    if output is None:
+        sys.stderr.write('error: no fixture for "{0}"\n'.format(' '.join([prog] + args)))
+        sys.exit(1)
+    sys.stdout.write(output)
+    sys.exit(0)
+#^----------------------------------------------------------------------------- main()
+
+if __name__ == '__main__':
+    main()
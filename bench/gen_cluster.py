@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""Generator of synthetic Grid Engine clusters for scale testing node_search. It writes a fixture directory in
+the layout replayed by fake_ge.py and stub_xymon.py, with output that agrees across every command:
+    qstat -f and qstat -f -xml          queue instances, running jobs (some spanning nodes) and pending jobs
+    qstat -f -r -xml                    the same, with the queue each pending job asked for
+    qstat -j <id>                       owner, start time and usage of every running job
+    qhost                               load of every host, '-' for hosts which are down
+    qconf -shgrpl, -shgrp_tree @g,      host-groups, optionally nested under department host-groups and
+          -shgrp_resolved @g            overlapping their neighbours
+    qconf -sul, -su <ul>, -sq <queue>   user-lists and queue ACLs, optionally with several user-lists per host-group
+    xymon/<node>.html                   top listing of the processes of every job on the node
+One of the users is %BENCH_USER%, the heaviest one, so run_bench.py can look at a user with many jobs.
+usage: gen_cluster.py out_dir [--nodes N] [--cores N] [--jobs-per-node N] [--pending N] ... [--recording file.json]"""
+
+import argparse, bisect, json, os, random, shutil, sys, tempfile
+
+USER_TOKEN = '%BENCH_USER%'
+SEPARATOR = '-' * 81 # between queue instances in qstat -f
+PENDING_MARKER = '#' * 79
+JOB_SIZES = (1, 1, 1, 2, 4, 4, 8, 16) # slots of a job, whole-node jobs are added separately
+PENDING_QUEUES = ('long', 'long', 'hpc', 'gpu', None) # queue asked for by a pending job, by job id, None for any
+
+class Cluster:
+    """Class holding the generated cluster: hosts, host-groups, user-lists, queue ACLs, running and pending
+    jobs. Everything is drawn from one seeded random.Random, so the same options give the same cluster."""
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.hosts = ['d{0:02d}chas{1:03d}.{2}'.format(10 + i // 1000, i % 1000, options.domain)
+                      for i in range(options.nodes)]
+        self.users = [USER_TOKEN] + ['user{0:04d}'.format(i) for i in range(1, options.users)]
+        # a few users own most of the jobs, like on the real cluster
+        weights = [1.0 / (rank + 1) for rank in range(len(self.users))]
+        self.user_weights = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.user_weights.append(total)
+        self.next_id = 1000000
+        self.node_jobs = {} # host -> [(job id, user, slots), ...]
+        self.job_info = {} # job id -> (user, start, maxvmem in GB, [host, ...])
+        self.states = {} # host -> queue instance state ('' when fine)
+        self.loads = {} # host -> load average
+        self.pending = [] # (job id, user, state, date, slots)
+        self.hostgroups = {} # host-group -> list of members, hosts or other host-groups
+        self.user_lists = {} # user-list -> [user, ...]
+        self.group_acls = {} # host-group -> [user-list, ...] allowed on it in the long queue
+        self.make_hostgroups()
+        self.make_user_lists()
+        self.make_jobs()
+
+    def pick_user(self):
+        point = self.random.random() * self.user_weights[-1]
+        return self.users[min(bisect.bisect(self.user_weights, point), len(self.users) - 1)]
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def make_hostgroups(self):
+        """Splits the hosts into @general_access (with @debug_d12chas inside it) and faculty host-groups of
+        consecutive hosts. Faculty groups overlap their next neighbour by --overlap hosts, and every --nested
+        of them are members of a department host-group."""
+        options = self.options
+        general = self.hosts[:max(2, int(len(self.hosts) * options.general_share))]
+        self.hostgroups['@general_access'] = list(general)
+        self.hostgroups['@debug_d12chas'] = general[:2]
+        faculty_hosts = self.hosts[len(general):]
+        count = max(1, min(options.hostgroups, len(faculty_hosts)))
+        size = max(1, len(faculty_hosts) // count)
+        faculty = []
+        for i in range(count):
+            start = i * size
+            end = len(faculty_hosts) if i == count - 1 else start + size
+            members = faculty_hosts[start:min(len(faculty_hosts), end + options.overlap)]
+            if members:
+                name = '@fac_{0:03d}'.format(i)
+                self.hostgroups[name] = members
+                faculty.append(name)
+        if options.nested > 1:
+            for i in range(0, len(faculty), options.nested):
+                self.hostgroups['@dept_{0:02d}'.format(i // options.nested)] = faculty[i:i + options.nested]
+
+    def resolve(self, group):
+        """Returns every host of a host-group, following nested host-groups."""
+        hosts = []
+        for member in self.hostgroups[group]:
+            for host in (self.resolve(member) if member.startswith('@') else [member]):
+                if host not in hosts:
+                    hosts.append(host)
+        return hosts
+
+    def tree(self, group, depth=0):
+        """Returns the 'qconf -shgrp_tree' lines of a host-group, nested host-groups indented further."""
+        lines = [' ' * 3 * depth + group]
+        for member in self.hostgroups[group]:
+            if member.startswith('@'):
+                lines.extend(self.tree(member, depth + 1))
+            else:
+                lines.append(' ' * 3 * (depth + 1) + member)
+        return lines
+
+    def make_user_lists(self):
+        """arusers holds every user, each faculty host-group gets --acls-per-group user-lists of --acl-size
+        random users. The lists of a group share users with the lists of other groups, and the bench user is
+        in the lists of the first two faculty groups."""
+        options = self.options
+        self.user_lists['arusers'] = list(self.users)
+        self.user_lists['defaultdepartment'] = ['nobody']
+        self.group_acls['@general_access'] = ['arusers']
+        self.group_acls['@debug_d12chas'] = ['arusers']
+        faculty = sorted(group for group in self.hostgroups if group.startswith('@fac_'))
+        for i, group in enumerate(faculty):
+            self.group_acls[group] = []
+            for j in range(options.acls_per_group):
+                name = '{0}_users{1}'.format(group[1:], '' if j == 0 else j)
+                members = self.random.sample(self.users, min(options.acl_size, len(self.users)))
+                if i < 2 and USER_TOKEN not in members:
+                    members[0] = USER_TOKEN
+                self.user_lists[name] = members
+                self.group_acls[group].append(name)
+
+    def make_jobs(self):
+        """Fills the hosts with running jobs, about --jobs-per-node per host, --mpi-share of them spanning
+        several hosts. --down of the hosts are disabled or unreachable and --idle of the busy ones have a
+        load near 0, the low efficiency nodes. Then --pending jobs are queued."""
+        options = self.options
+        cores = options.cores
+        carried = [] # (job id, user, slots, hosts left) of jobs spanning several hosts
+        for host in self.hosts:
+            draw = self.random.random()
+            if draw < options.down / 2:
+                self.states[host] = 'au' # host is unreachable
+            elif draw < options.down:
+                self.states[host] = 'd' # disabled by an admin
+            else:
+                self.states[host] = ''
+            jobs = []
+            used = 0
+            if self.states[host] != 'au':
+                still_carried = []
+                for job_id, user, slots, left in carried:
+                    jobs.append((job_id, user, slots))
+                    self.job_info[job_id][3].append(host)
+                    used += slots
+                    if left > 1:
+                        still_carried.append((job_id, user, slots, left - 1))
+                carried = still_carried
+                wanted = self.random.randint(0, 2 * options.jobs_per_node)
+                while len(jobs) < wanted and used < cores and not self.states[host]:
+                    if self.random.random() < options.whole_node_share:
+                        slots = cores
+                    else:
+                        slots = self.random.choice(JOB_SIZES)
+                    if used + slots > cores:
+                        break
+                    job_id = self.new_id()
+                    user = self.pick_user()
+                    start = '{0:02d}/{1:02d}/2018 {2:02d}:{3:02d}:{4:02d}'.format(
+                        self.random.randint(6, 7), self.random.randint(1, 28), self.random.randint(0, 23),
+                        self.random.randint(0, 59), self.random.randint(0, 59))
+                    self.job_info[job_id] = (user, start, round(self.random.uniform(0.1, 4.0) * slots, 3), [host])
+                    jobs.append((job_id, user, slots))
+                    used += slots
+                    if self.random.random() < options.mpi_share:
+                        carried.append((job_id, user, slots, self.random.randint(1, 3)))
+            self.node_jobs[host] = jobs
+            if self.states[host] == 'au':
+                self.loads[host] = None
+            elif used and self.random.random() < options.idle:
+                self.loads[host] = round(self.random.uniform(0.0, 0.04), 2)
+            else:
+                self.loads[host] = round(used * self.random.uniform(0.85, 1.02), 2)
+        for k in range(options.pending):
+            state = self.random.choice(('qw', 'qw', 'qw', 'hqw', 'Eqw', 'hRqw'))
+            date = '07/{0:02d}/2018 {1:02d}:{2:02d}:{3:02d}'.format(
+                self.random.randint(1, 28), self.random.randint(0, 23), self.random.randint(0, 59), self.random.randint(0, 59))
+            self.pending.append((self.new_id(), self.pick_user(), state, date,
+                                 self.random.choice(JOB_SIZES + (options.cores,))))
+#^--------------------------------------------------------- class Cluster
+
+def xml_date(date):
+    """07/20/2018 10:00:00 -> 2018-07-20T10:00:00, the date format of qstat -xml."""
+    day, clock = date.split()
+    month, mday, year = day.split('/')
+    return '{0}-{1}-{2}T{3}'.format(year, month, mday, clock)
+#^----------------------------------------------------------------------------- xml_date(date)
+
+def write_qstat(cluster, out):
+    """Writes qstat -f, qstat -f -xml and one qstat -j file per running job."""
+    cores = cluster.options.cores
+    with open(os.path.join(out, 'qstat_-f'), 'w') as text, open(os.path.join(out, 'qstat_-f_-xml'), 'w') as xml:
+        text.write('queuename                      qtype resv/used/tot. load_avg arch          states\n')
+        xml.write("<?xml version='1.0'?>\n<job_info  xmlns:xsd=\"http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd\">\n  <queue_info>\n")
+        for host in cluster.hosts:
+            jobs = cluster.node_jobs[host]
+            used = sum(slots for _, _, slots in jobs)
+            load = cluster.loads[host]
+            load_text = '-NA-' if load is None else '{0:.2f}'.format(load)
+            state = cluster.states[host]
+            text.write(SEPARATOR + '\n')
+            text.write('{0:<30} BIP   0/{1}/{2:<10} {3:<8} lx-amd64      {4}'.format(
+                'long@' + host, used, cores, load_text, state).rstrip() + '\n')
+            xml.write('    <Queue-List>\n      <name>long@{0}</name>\n      <qtype>BIP</qtype>\n'
+                      '      <slots_used>{1}</slots_used>\n      <slots_resv>0</slots_resv>\n'
+                      '      <slots_total>{2}</slots_total>\n'.format(host, used, cores))
+            if load is not None:
+                xml.write('      <load_avg>{0}</load_avg>\n'.format(load_text))
+            xml.write('      <arch>lx-amd64</arch>\n')
+            if state:
+                xml.write('      <state>{0}</state>\n'.format(state))
+            for job_id, user, slots in jobs:
+                start = cluster.job_info[job_id][1]
+                text.write('{0:>8} 0.50500 job{0:<7} {1:<12} r     {2} {3:>5}\n'.format(job_id, user, start, slots))
+                xml.write('      <job_list state="running">\n        <JB_job_number>{0}</JB_job_number>\n'
+                          '        <JAT_prio>0.50500</JAT_prio>\n        <JB_name>job{0}</JB_name>\n'
+                          '        <JB_owner>{1}</JB_owner>\n        <state>r</state>\n'
+                          '        <JAT_start_time>{2}</JAT_start_time>\n        <slots>{3}</slots>\n'
+                          '      </job_list>\n'.format(job_id, user, xml_date(start), slots))
+            xml.write('    </Queue-List>\n')
+        text.write('\n' + PENDING_MARKER + '\n' + ' - PENDING JOBS' * 5 + '\n' + PENDING_MARKER + '\n')
+        xml.write('  </queue_info>\n  <job_info>\n')
+        for job_id, user, state, date, slots in cluster.pending:
+            text.write('{0:>8} 0.00000 pend{0:<6} {1:<12} {2:<5} {3} {4:>5}\n'.format(job_id, user, state, date, slots))
+            xml.write('    <job_list state="pending">\n      <JB_job_number>{0}</JB_job_number>\n'
+                      '      <JAT_prio>0.00000</JAT_prio>\n      <JB_name>pend{0}</JB_name>\n'
+                      '      <JB_owner>{1}</JB_owner>\n      <state>{2}</state>\n'
+                      '      <JB_submission_time>{3}</JB_submission_time>\n      <slots>{4}</slots>\n'
+                      '    </job_list>\n'.format(job_id, user, state, xml_date(date), slots))
+        xml.write('  </job_info>\n</job_info>\n')
+
+    os.makedirs(os.path.join(out, 'jobs'))
+    for job_id, (user, start, maxvmem, hosts) in cluster.job_info.items():
+        with open(os.path.join(out, 'jobs', str(job_id)), 'w') as job:
+            job.write('=' * 62 + '\njob_number:                 {0}\nowner:                      {1}\n'
+                      'hard_queue_list:            long\nexec_host_list        1:    {2}\n'
+                      'usage                 1:    cpu=10:00:00, mem=100.0 GBs, io=1.0, vmem={3}G, maxvmem={3}G\n'
+                      'start_time            1:    {4}.000\nscheduling info:            (none)\n'.format(
+                          job_id, user, ' '.join(hosts), maxvmem, start))
+#^----------------------------------------------------------------------------- write_qstat(cluster, out)
+
+def write_requested_queues(cluster, out):
+    """Writes qstat -f -r -xml: qstat -f -xml with the hard_req_queue of every pending job which asked for a
+    queue (see PENDING_QUEUES). The other requests listed by -r are left out, node_search does not read them."""
+    queues = iter([PENDING_QUEUES[job_id % len(PENDING_QUEUES)] for job_id, _, _, _, _ in cluster.pending])
+    in_pending = False
+    with open(os.path.join(out, 'qstat_-f_-xml')) as plain, open(os.path.join(out, 'qstat_-f_-r_-xml'), 'w') as xml:
+        for line in plain:
+            if line.strip() == '<job_info>':
+                in_pending = True
+            elif in_pending and line.strip() == '</job_list>':
+                queue = next(queues)
+                if queue:
+                    xml.write('      <hard_req_queue>{0}</hard_req_queue>\n'.format(queue))
+            xml.write(line)
+#^----------------------------------------------------------------------------- write_requested_queues(cluster, out)
+
+def write_qhost(cluster, out):
+    """Writes qhost, which lists hosts by their short name."""
+    cores = cluster.options.cores
+    with open(os.path.join(out, 'qhost'), 'w') as qhost:
+        qhost.write('HOSTNAME                ARCH         NCPU NSOC NCOR NTHR  LOAD  MEMTOT  MEMUSE  SWAPTO  SWAPUS\n')
+        qhost.write('-' * 100 + '\n')
+        qhost.write('global                  -               -    -    -    -     -       -       -       -       -\n')
+        for host in cluster.hosts:
+            load = cluster.loads[host]
+            if load is None:
+                qhost.write('{0:<23} lx-amd64 {1:>8}    2 {1:>4} {1:>4}     -       -       -       -       -\n'.format(
+                    host.split('.')[0], cores))
+            else:
+                qhost.write('{0:<23} lx-amd64 {1:>8}    2 {1:>4} {1:>4} {2:>5.2f}  126.0G   10.0G    0.0    0.0\n'.format(
+                    host.split('.')[0], cores, load))
+#^----------------------------------------------------------------------------- write_qhost(cluster, out)
+
+def write_qconf(cluster, out):
+    """Writes the host-group, user-list and queue configuration."""
+    def write(name, content):
+        with open(os.path.join(out, name), 'w') as qconf:
+            qconf.write(content + '\n')
+
+    write('qconf_-shgrpl', '\n'.join(sorted(cluster.hostgroups)))
+    for group in cluster.hostgroups:
+        write('qconf_-shgrp_tree_' + group, '\n'.join(cluster.tree(group)))
+        write('qconf_-shgrp_resolved_' + group, ' '.join(cluster.resolve(group)))
+    write('qconf_-sul', '\n'.join(sorted(cluster.user_lists)))
+    for name, members in cluster.user_lists.items():
+        write('qconf_-su_' + name, 'name    {0}\ntype    ACL\nfshare  0\noticket 0\nentries {1}'.format(name, ','.join(members)))
+
+    acls = ['[{0}={1}]'.format(group, ' '.join(lists)) for group, lists in sorted(cluster.group_acls.items())]
+    acl_lines = []
+    for i in range(0, len(acls), 3):
+        acl_lines.append(','.join(acls[i:i + 3]))
+    user_lists = 'NONE,' + ' \\\n                      ,'.join(acl_lines) if acl_lines else 'NONE'
+    long_hosts = ' '.join(sorted(group for group in cluster.hostgroups if not group.startswith('@dept_')))
+    for queue, hostlist, acl in (('long', long_hosts, user_lists), ('hpc', '@general_access', 'NONE'),
+                                 ('gpu', 'NONE', 'NONE'), ('gpu-debug', 'NONE', 'NONE')):
+        write('qconf_-sq_' + queue, 'qname                 {0}\nhostlist              {1}\nseq_no                0\n'
+              'slots                 {2}\nuser_lists            {3}\nxuser_lists           NONE'.format(
+                  queue, hostlist, cluster.options.cores, acl))
+#^----------------------------------------------------------------------------- write_qconf(cluster, out)
+
+def write_xymon(cluster, out):
+    """Writes the xymon cpu page of every host: a top listing with one process per slot-holding job."""
+    os.makedirs(os.path.join(out, 'xymon'))
+    for host in cluster.hosts:
+        lines = ['<html><body><pre>', 'top - 10:00:00 up 100 days', '',
+                 '  PID USER      PR  NI    VIRT    RES    SHR S  %CPU %MEM     TIME+ COMMAND']
+        for job_id, user, slots in cluster.node_jobs[host]:
+            for task in range(min(slots, 4)):
+                lines.append('{0:>5} {1:<9} 20   0  {2:>6} {3:>6}  12m R {4:>5.1f}  1.0  10:00.00 job{5}'.format(
+                    (job_id * 4 + task) % 99999, user[:9], '1.2g', cluster.random.choice(['512m', '1.5g', '204800']),
+                    min(100.0, 100.0 * slots / max(1, min(slots, 4))), job_id))
+        lines.append('</pre></body></html>')
+        with open(os.path.join(out, 'xymon', host.split('.')[0] + '.html'), 'w') as page:
+            page.write('\n'.join(lines) + '\n')
+#^----------------------------------------------------------------------------- write_xymon(cluster, out)
+
+def write_recording(fixture_dir, path):
+    """Packs a fixture directory into one json recording, the format of fixtures/small.json."""
+    files = {}
+    for root, _, names in os.walk(fixture_dir):
+        for name in names:
+            with open(os.path.join(root, name)) as fixture:
+                files[os.path.relpath(os.path.join(root, name), fixture_dir)] = fixture.read()
+    with open(path, 'w') as recording:
+        json.dump({'version': 1, 'files': files}, recording, indent=1, sort_keys=True)
+#^----------------------------------------------------------------------------- write_recording(fixture_dir, path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Grid Engine cluster fixture.')
+    parser.add_argument('out', help='fixture directory to create (or the json file with --recording)')
+    parser.add_argument('--nodes', type=int, default=100, help='number of hosts (default: 100)')
+    parser.add_argument('--cores', type=int, default=24, help='cores per host (default: 24)')
+    parser.add_argument('--jobs-per-node', type=int, default=4, help='average running jobs per host (default: 4)')
+    parser.add_argument('--pending', type=int, default=50, help='number of pending jobs (default: 50)')
+    parser.add_argument('--users', type=int, default=50, help='number of users (default: 50)')
+    parser.add_argument('--hostgroups', type=int, default=10, help='number of faculty host-groups (default: 10)')
+    parser.add_argument('--nested', type=int, default=0,
+                        help='put every N faculty host-groups in a department host-group (default: no nesting)')
+    parser.add_argument('--overlap', type=int, default=0,
+                        help='hosts each faculty host-group shares with the next one (default: 0)')
+    parser.add_argument('--acls-per-group', type=int, default=1,
+                        help='user-lists allowed on each faculty host-group in the long queue (default: 1)')
+    parser.add_argument('--acl-size', type=int, default=5, help='users per faculty user-list (default: 5)')
+    parser.add_argument('--general-share', type=float, default=0.5, help='share of hosts in @general_access')
+    parser.add_argument('--mpi-share', type=float, default=0.02, help='share of jobs spanning several hosts')
+    parser.add_argument('--whole-node-share', type=float, default=0.1, help='share of jobs taking a whole host')
+    parser.add_argument('--down', type=float, default=0.03, help='share of hosts disabled or unreachable')
+    parser.add_argument('--idle', type=float, default=0.05, help='share of busy hosts with almost no load')
+    parser.add_argument('--domain', default='crc.nd.edu', help='domain of the host names')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    parser.add_argument('--recording', action='store_true', help='write one json recording instead of a directory')
+    options = parser.parse_args()
+
+    if os.path.exists(options.out):
+        parser.error('{0} already exists'.format(options.out))
+    cluster = Cluster(options)
+    fixture_dir = tempfile.mkdtemp(prefix='node_search_cluster.') if options.recording else options.out
+    try:
+        if not os.path.isdir(fixture_dir):
+            os.makedirs(fixture_dir)
+        write_qstat(cluster, fixture_dir)
+        write_requested_queues(cluster, fixture_dir)
+        write_qhost(cluster, fixture_dir)
+        write_qconf(cluster, fixture_dir)
+        write_xymon(cluster, fixture_dir)
+        if options.recording:
+            write_recording(fixture_dir, options.out)
+    finally:
+        if options.recording:
+            shutil.rmtree(fixture_dir, ignore_errors=True)
+    sys.stderr.write('{0}: {1} hosts, {2} host-groups, {3} running jobs, {4} pending jobs\n'.format(
+        options.out, len(cluster.hosts), len(cluster.hostgroups), len(cluster.job_info), len(cluster.pending)))
+#^----------------------------------------------------------------------------- main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""Offline benchmark of node_search. Every mode is run end to end against a fixture of recorded or generated
+Grid Engine output: fake qstat/qconf/qhost (bench/bin, see fake_ge.py) come first in $PATH and a stub xymon
+server (stub_xymon.py) answers the xymon requests. For each mode the wall time, the number of Grid Engine
+commands forked, the number of xymon requests and the peak RSS are reported.
+usage: run_bench.py [--fixture dir|recording.json] [--repeat N] [--modes a,b,...] [--json]"""
+
+import argparse, getpass, json, os, shutil, subprocess, sys, tempfile, time
+from stub_xymon import StubXymon
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+NODE_SEARCH = os.path.join(os.path.dirname(BENCH_DIR), 'node_search.py')
+DEFAULT_FIXTURE = os.path.join(BENCH_DIR, 'fixtures', 'small.json')
+
+def get_modes(hostgroup, user):
+    """Returns the benchmarked modes as a list of (name, node_search arguments)."""
+    return [('hostgroup', ['-' + hostgroup]),
+            ('details', ['-' + hostgroup, '--details']),
+            ('visual', ['-' + hostgroup, '-v']),
+            ('user', ['-u', user]),
+            ('user-details', ['-u', user, '--details']),
+            ('uf', ['-uf', user]),
+            ('qlong', ['-qlong']),
+            ('low-efficiency', ['--low_efficiency']),
+            ('hosts', ['-H'])]
+#^----------------------------------------------------------------------------- get_modes(hostgroup, user)
+
+def unpack_recording(path, fixture_dir):
+    """Writes a json recording ({"files": {relative path: content}}) out as a fixture directory."""
+    with open(path) as recording:
+        files = json.load(recording)['files']
+    for name, content in files.items():
+        target = os.path.join(fixture_dir, name)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        with open(target, 'w') as fixture:
+            fixture.write(content)
+#^----------------------------------------------------------------------------- unpack_recording(path, fixture_dir)
+
+def count_lines(path):
+    """Returns the number of lines in path, 0 when it does not exist yet."""
+    try:
+        with open(path) as log:
+            return sum(1 for _ in log)
+    except OSError:
+        return 0
+#^----------------------------------------------------------------------------- count_lines(path)
+
+def run_mode(args, env, log, server, cache_dir, warm):
+    """Runs node_search once with args and measures it.
+    Returns: dict with wall (seconds), forks, xymon (requests), rss (peak KB) and status (exit code)."""
+
+    if not warm:
+        shutil.rmtree(cache_dir, ignore_errors=True) # every run starts without cached qconf output
+    forks = count_lines(log)
+    requests = server.requests
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, NODE_SEARCH] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0) # rusage of this run only, not of every child so far
+    wall = time.time() - start
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        rss = rss // 1024 # bytes on macOS, KB elsewhere
+    return {'wall': wall, 'forks': count_lines(log) - forks, 'xymon': server.requests - requests,
+            'rss': rss, 'status': proc.returncode}
+#^----------------------------------------------------------------------------- run_mode(. . .)
+
+def summarize(runs):
+    """Combines the repeated runs of a mode: median and best wall time, the counts of the last run and the
+    highest peak RSS."""
+    walls = sorted(run['wall'] for run in runs)
+    return {'wall_median': walls[len(walls) // 2], 'wall_min': walls[0], 'forks': runs[-1]['forks'],
+            'xymon': runs[-1]['xymon'], 'rss_kb': max(run['rss'] for run in runs),
+            'status': max(run['status'] for run in runs)}
+#^----------------------------------------------------------------------------- summarize(runs)
+
+def print_report(results):
+    """Prints the summary of every mode as a table."""
+    print('{0:<16}{1:>12}{2:>12}{3:>8}{4:>8}{5:>12}{6:>8}'.format('mode', 'median (s)', 'best (s)', 'forks',
+                                                                 'xymon', 'peak RSS', 'exit'))
+    print('-' * 76)
+    for name, result in results:
+        print('{0:<16}{1:>12.3f}{2:>12.3f}{3:>8}{4:>8}{5:>9} MB{6:>8}'.format(
+            name, result['wall_median'], result['wall_min'], result['forks'], result['xymon'],
+            result['rss_kb'] // 1024, result['status']))
+#^----------------------------------------------------------------------------- print_report(results)
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of node_search.')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE,
+                        help='fixture directory or json recording (default: fixtures/small.json)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per mode (default: 3)')
+    parser.add_argument('--modes', help='comma separated modes to run (default: all)')
+    parser.add_argument('--hostgroup', default='general_access', help='host-group of the host-group modes')
+    parser.add_argument('--user', default=getpass.getuser(),
+                        help='user who owns the %%BENCH_USER%% jobs, must exist on this machine (default: you)')
+    parser.add_argument('--warm', action='store_true', help='keep the qconf cache between runs')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    options = parser.parse_args()
+
+    modes = get_modes(options.hostgroup, options.user)
+    if options.modes:
+        wanted = options.modes.split(',')
+        unknown = [name for name in wanted if name not in dict(modes)]
+        if unknown:
+            parser.error('unknown mode(s): {0}'.format(', '.join(unknown)))
+        modes = [(name, args) for name, args in modes if name in wanted]
+
+    work_dir = tempfile.mkdtemp(prefix='node_search_bench.')
+    try:
+        fixture_dir = options.fixture
+        if not os.path.isdir(fixture_dir):
+            fixture_dir = os.path.join(work_dir, 'fixture')
+            unpack_recording(options.fixture, fixture_dir)
+        server = StubXymon(fixture_dir, user=options.user).start()
+        log = os.path.join(work_dir, 'commands.log')
+        cache_dir = os.path.join(work_dir, 'cache')
+        env = dict(os.environ)
+        env.update({'PATH': os.path.join(BENCH_DIR, 'bin') + os.pathsep + env.get('PATH', ''),
+                    'NS_BENCH_FIXTURE': os.path.abspath(fixture_dir), 'NS_BENCH_LOG': log,
+                    'NS_BENCH_USER': options.user, 'USER': options.user, 'XDG_CACHE_HOME': cache_dir,
+                    'NODE_SEARCH_XYMON_URL': server.get_url()})
+
+        results = []
+        for name, args in modes:
+            runs = [run_mode(args, env, log, server, cache_dir, options.warm) for _ in range(options.repeat)]
+            results.append((name, summarize(runs)))
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if options.json:
+        print(json.dumps({'fixture': options.fixture, 'repeat': options.repeat, 'warm': options.warm,
+                          'modes': dict(results)}, indent=2, sort_keys=True))
+    else:
+        print_report(results)
+#^----------------------------------------------------------------------------- main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Stub of the xymon web interface for the benchmark. It answers the svcstatus.sh requests node_search makes
+with the xymon/<node>.html page of a fixture directory (see fake_ge.py), over keep-alive connections like the
+real server, and counts the requests it served.
+usage: stub_xymon.py fixture_dir [port]"""
+
+import os, sys, threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+USER_TOKEN = '%BENCH_USER%'
+
+class XymonHandler(BaseHTTPRequestHandler):
+    """Handler answering 'GET /...?HOST=<node>.<domain>&SERVICE=cpu' with the page of that node."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        host = parse_qs(urlsplit(self.path).query).get('HOST', [''])[0].split('.')[0]
+        self.server.count_request()
+        try:
+            with open(os.path.join(self.server.fixture_dir, 'xymon', host + '.html')) as page:
+                body = page.read().replace(USER_TOKEN, self.server.user).encode()
+        except OSError:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return # the benchmark output is the report, not an access log
+#^--------------------------------------------------------- class XymonHandler
+
+class StubXymon(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server holding the fixture directory, the user filled in for %BENCH_USER% and the number
+    of requests served so far."""
+
+    daemon_threads = True
+
+    def __init__(self, fixture_dir, port=0, user=USER_TOKEN):
+        HTTPServer.__init__(self, ('127.0.0.1', port), XymonHandler)
+        self.fixture_dir = fixture_dir
+        self.user = user
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def get_url(self):
+        """Returns the value of NODE_SEARCH_XYMON_URL pointing at this server."""
+        return 'http://127.0.0.1:' + str(self.server_address[1]) + '/xymon-cgi/svcstatus.sh?HOST={0}.crc.nd.edu&SERVICE=cpu'
+
+    def start(self):
+        """Serves requests from a daemon thread until shutdown() is called."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+#^--------------------------------------------------------- class StubXymon
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write(__doc__ + '\n')
+        sys.exit(20)
+    server = StubXymon(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0,
+                       os.environ.get('NS_BENCH_USER', USER_TOKEN))
+    print('NODE_SEARCH_XYMON_URL=' + server.get_url())
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
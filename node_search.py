@@ -1,7 +1,19 @@
 #!/usr/bin/env python3
 
-from pwd import getpwnam
-import sys, subprocess, urllib.request, os
+from pwd import getpwnam, getpwuid
+from grp import getgrgid
+import sys, subprocess, os, math, json, csv, struct, tempfile, time, threading, http.client, http.server, io, socket, socketserver, traceback, signal, shutil
+from collections import OrderedDict
+import sqlite3
+from urllib.parse import urlsplit
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+from array import array
+try:
+    import numpy
+except ImportError: # numpy is optional, NodeTable falls back to the array module without it
+    numpy = None
 
 #Globals
 TERMWIDTH = 80
@@ -10,6 +22,47 @@ DEBUG_QUEUE_HOSTGROUP = 'debug_d12chas'
 GENERAL_ACCESS_QUEUE_HOSTGROUP = 'general_access'
 SCRIPT_NAME = 'node_search.sh'
 LOWTHRESHOLD = 0.05
+QSTAT_SEPARATOR = '-'.center(81, '-') #81 -'s, separates queue instances in qstat -f
+PENDING_MARKER = '#'.center(79, '#') #denotes pending jobs in qstat 79 #'s
+DISABLED_STATES = ('d', 'E', 'au', 'Eau', 'Eqw', 'adu') # queue instance states which count as disabled
+PENDING_STATUS = (('E', 'Error'), ('h', 'Held'), ('R', 'Rescheduled'), ('d', 'Deleting'), ('q', 'Waiting'),
+                  ('w', 'Waiting')) # pending job state letter -> status, the first letter found wins
+WAIT_BUCKETS = ((3600, '< 1h'), (6 * 3600, '1h - 6h'), (86400, '6h - 1d'), (3 * 86400, '1d - 3d'), # --pending
+                (7 * 86400, '3d - 7d'), (None, '>= 7d'))                                            # histogram
+SNAPSHOT = None # ClusterSnapshot of the current qstat -f output, see get_snapshot()
+SNAPSHOT_REQUESTS = False # set by --pending, the snapshot is read with qstat -r for the queues jobs asked for
+JOB_DETAILS = None # JobDetails shared by every Job, see get_job_details()
+JOB_DETAIL_CHUNK = 200 # max number of job ids given to one qstat -j call
+QCONF_WORKERS = 8 # max number of qconf calls run at the same time
+CONFIG_CACHE = None # ConfigCache of qconf output, see get_config_cache()
+CACHE_VERSION = 1 # bump when the layout of the cache file changes, older files are then ignored
+CACHE_TTL = {'-shgrpl': 86400, '-shgrp_tree': 86400, '-shgrp_resolved': 86400, # seconds a qconf output is reused,
+             '-sul': 21600, '-su': 21600, '-sq': 86400}                         # keyed by the qconf option
+REFRESH_CACHE = False # set by --refresh, re-fetch every qconf output instead of using the cache
+USERLIST_CHUNK = 100 # max number of user lists given to one 'qconf -su a,b,c' call
+XYMON_URL = os.environ.get('NODE_SEARCH_XYMON_URL', # {0} is the node name without its domain
+                           'https://mon.crc.nd.edu/xymon-cgi/svcstatus.sh?HOST={0}.crc.nd.edu&SERVICE=cpu')
+XYMON_WORKERS = 8 # max number of xymon pages fetched at the same time
+XYMON_TIMEOUT = 10 # seconds before a xymon request is given up and its node reported as degraded
+SERVE_SOCKET = os.environ.get('NODE_SEARCH_SOCKET', '/tmp/node_search.sock') # unix socket of --serve / --query
+SERVE_INTERVAL = 30 # seconds between qstat refreshes in --serve mode
+SERVE_READ_TIMEOUT = 10 # seconds the daemon waits for a client to send its query before hanging up
+QUERY_TIMEOUT = 300 # seconds --query waits for the daemon's answer, queries are answered one after the other
+TRACE = None # CommandTrace set by --trace-commands, every command and xymon request is recorded in it
+WATCH_INTERVAL = None # seconds between refreshes given with --watch, None when not watching
+WATCH_CHANGES = 10 # max number of changed nodes and jobs listed under a --watch refresh
+OUTPUT_FORMAT = 'text' # set by --format, every mode writes records through RECORDS instead of text when not 'text'
+RECORDS = None # RecordWriter of --format json|ndjson|csv, see emit()
+METRICS_PREFIX = 'node_search_' # prefix of every metric written by --metrics
+METRICS_ADDRESS = '127.0.0.1' # address --metrics :PORT listens on, give HOST:PORT to listen elsewhere
+HISTORY_FILE = os.environ.get('NODE_SEARCH_HISTORY', # sqlite file written by --record and read by --report
+                              os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share'),
+                                           'node_search', 'history.sqlite'))
+HISTORY_VERSION = 1 # bump when the tables of the history file change
+HISTORY_RAW_DAYS = 31 # days the raw --record samples are kept, the hourly and daily rollups are kept for good
+HISTORY_PERIODS = (3600, 86400) # seconds covered by one rollup row: hourly and daily
+VISUAL_CORE_LIMIT = 2000 # hostgroups with more cores are drawn by -v with one character per node
+VISUAL_SHADES = '.:+*@#' # -v characters of an empty, <1/3, <2/3, mostly used, full and disabled node
 
 """Script to get and report information on nodes withtin the Sun Grid Engine for the CRC. It uses
 the subprocess module to execute bash(tcsh) commands and gather their output. Basically this script is a fancy
@@ -23,24 +76,36 @@ Purposely used exit codes:
     23 = incorrect arg
     24 = no user-name with -u option
     25 = User not on, or DNE
+    26 = --query could not reach the node_search daemon (node_search.sh then runs directly)
+    27 = the node_search daemon took the query but did not answer it within QUERY_TIMEOUT
+    28 = none of the job ids given with -j are known to the grid engine
+    29 = --report found no recorded history (see --record)
 """
 
 class Node:
     """Class to hold representation of a node for the CRC 
     Note: Python doesn't have private data, but the direct variables of
     this class are treated as private, and as such there are methods created
-    to obtain them."""
+    to obtain them. Attributes are kept in __slots__, as a snapshot holds one
+    Node per queue instance of the cluster."""
+
+    __slots__ = ('name', 'queue', 'host', 'total_cores', 'used_cores', 'free_cores', 'disabled', 'num_jobs',
+                 'load', 'states', 'job_list', 'total_mem', 'used_mem', 'free_mem')
     
     def __init__(self, name, total_cores=0, used_cores=0, disabled=True):
         """Instantiation for Node class, must pass in the node name, everything else defaults to 0.
         Node defaults in the disabled state."""
         self.name = name
+        queue, _, host = name.rpartition('@') # 'long@host' -> 'long', 'host'
+        self.queue = sys.intern(queue)
+        self.host = sys.intern(host)
         self.total_cores = int(total_cores)
         self.used_cores = int(used_cores)
         self.free_cores = (int(self.total_cores) - int(self.used_cores))
         self.disabled = disabled
         self.num_jobs = 0
         self.load = None
+        self.states = ''
         self.job_list = []
         
     def __repr__(self):
@@ -54,6 +119,7 @@ class Node:
         """Method to add an instance of class Job to the job_list of a node."""
         self.job_list.append(job)
         self.num_jobs += 1
+        job.node = self
     
     def set_load(self, load):
         """Method to set the sys-load for a node"""
@@ -148,12 +214,16 @@ class Node:
 
 class User:
     """Class to hold representation of a user recognized by UGE."""
+
+    __slots__ = ('name', 'job_list', 'cores_used', 'node_list')
     
-    def __init__(self, name, jobs=[],cores_used=0):
+    def __init__(self, name, jobs=None, cores_used=0):
         """Default instantiation for a user. Only need the name, everything else defaults
-        to empty or 0."""
+        to empty or 0. Every User gets its own job list unless one is given."""
         
-        self.name = str(name)
+        self.name = sys.intern(str(name))
+        if jobs is None:
+            jobs = []
         self.job_list = jobs
         self.cores_used = cores_used
         self.node_list = []
@@ -197,17 +267,24 @@ class User:
 #^--------------------------------------------------------- class User
 
 class Job:
-    """Class to hold representation of a job in a specific node for the CRC."""
+    """Class to hold representation of a job in a specific node for the CRC. Attributes are kept in
+    __slots__ and the strings many jobs share (name, user, state, date) are interned, as a snapshot
+    of a busy cluster holds hundreds of thousands of jobs."""
+
+    __slots__ = ('name', 'cores', 'user', 'priority', 'id', 'max_mem', 'state', 'date', 'node')
     
     def __init__(self, name, user, cores=0):
         """Default instantiation for a Job. Only need the name, and user everything else defaults
         to empty or 0."""
-        self.name = str(name)
+        self.name = sys.intern(str(name))
         self.cores = cores
-        self.user = str(user)
+        self.user = sys.intern(str(user))
         self.priority = 0
         self.id = 0
-        self.max_mem = 'NA'
+        self.max_mem = None # looked up lazily by get_max_mem
+        self.state = ''
+        self.date = ''
+        self.node = None
         return
         
     def __repr__(self):
@@ -246,46 +323,41 @@ class Job:
         return self.id
     
     def get_start_time(self):
-        """Function to obtain the start time of a running job. Will leverage qstat's -j flag."""
-        # Searching through qstat and grabbing only the start time. Lot of weeding out.
-        qstat = subprocess.getoutput("qstat -j {0}".format(self.id))
-        qstat = qstat[qstat.find("start_time"):]
-        qstat = qstat[:qstat.find('\n')]
-        return qstat[28:]
+        """Function to obtain the start time of a running job. Will leverage qstat's -j flag, through the
+        shared JobDetails so every job being printed is fetched in one qstat call."""
+        return get_job_details().get(self.id).get('start_time', '')
     
     def find_max_mem(self):
-        """Function that will find this job's maximum used memory (RAM) by parsing
-        through qstat -j <job_id>. The function will set this Job object's max_mem
-        variable."""
-        qstat = subprocess.getoutput("qstat -j {0}".format(self.id))
-        qstat = qstat[qstat.find("maxvmem=") + 8 :]
-        self.max_mem = qstat[:qstat.find('\n')]
+        """Function that will find this job's maximum used memory (RAM) from the usage line of
+        qstat -j <job_id>. The function will set this Job object's max_mem variable."""
+        self.max_mem = get_job_details().get(self.id).get('maxvmem', 'NA')
     
     def get_max_mem(self):
         """Function to return a STRING of the maximum memory a job as used thus far detected
-        by the grid engine."""
+        by the grid engine. It is only looked up the first time it is asked for."""
+        if self.max_mem is None:
+            self.find_max_mem()
         return str(self.max_mem)
     
     def set_id(self, job_id):
         self.id = job_id
-        self.find_max_mem()
+        self.max_mem = None # looked up lazily by get_max_mem
         return
 #^--------------------------------------------------------- class Job
 
 class Pending(Job):
     """Class to represent a Pending job in the SGE pending job-list. Class is child of Job class."""
+
+    __slots__ = ('status', 'queue') # queue: the hard queue request, only read with SNAPSHOT_REQUESTS
     
     def set_status(self, status):
-        """Method which sets the waiting status of the job. In qstat -f, hqw is error waiting, which will
-        become 'Error' here, and qw is simply waiting turn, which will be 'Waiting' here. """
-        if status == 'qw':
-            status = 'Waiting'
-        elif status == 'hqw':
-            status = 'Held'
-        elif status == 'Eqw':
-            status = 'Error'
-        else:
-            sys.exit(20)
+        """Method which sets the waiting status of the job from its qstat state letters. Eqw is 'Error',
+        hqw (and hRqw, ...) is 'Held', Rq is 'Rescheduled', a job being deleted is 'Deleting' and qw is simply
+        waiting its turn, 'Waiting'. States without any of these letters are kept as they are."""
+        for letter, name in PENDING_STATUS:
+            if letter in status:
+                status = name
+                break
         self.status = status
         return
         
@@ -301,13 +373,1087 @@ class Pending(Job):
     def get_date(self):
         """Method I wish was made a long time ago."""
         return self.date
+
+    def get_submit_time(self):
+        """Method to obtain the submission date as seconds since the epoch, None if it can not be read."""
+        try:
+            return time.mktime(time.strptime(self.date, '%m/%d/%Y %H:%M:%S'))
+        except ValueError:
+            return None
+
+    def get_line(self):
+        """Method to obtain the job as a line of the pending section of qstat -f, in qstat's columns. Names
+        and users longer than their column are not cut, the rest of the line moves over instead."""
+        return '{0:>8} {1:7.5f} {2:<10} {3:<12} {4:<5} {5} {6:>5}'.format(self.id, float(self.priority),
+               self.name, self.user, self.state, self.date, self.cores)
 #^--------------------------------------------------------- class Pending(Job)
 
+class ClusterSnapshot:
+    """Class to hold one indexed picture of the grid engine built from a single qstat run. Queue instances
+    are stored as Node objects (one per queuename line of qstat -f) and are keyed by host, running jobs are
+    keyed by job id and by owner, and pending jobs are kept separately. Every mode queries this instead of
+    searching through the raw qstat output."""
+
+    def __init__(self):
+        """Creates an empty snapshot, use add_node, add_job and add_pending to fill it."""
+        self.node_list = []
+        self.host_index = {} # full host name -> [Node, ...] in qstat order
+        self.short_index = {} # host name without the domain -> [Node, ...]
+        self.job_index = {} # job id -> Job, or [Job, ...] for a parallel job with one Job per queue instance
+        self.owner_index = {} # user name -> [Job, ...]
+        self.pending_list = []
+        self.table = None # NodeTable of node_list, see get_table()
+        self.requests = False # read with qstat -r, so pending jobs know the queue they asked for
+
+    def __repr__(self):
+        return 'ClusterSnapshot-{0}nodes-{1}jobs'.format(len(self.node_list), len(self.job_index))
+
+    def add_node(self, node):
+        """Method to add a queue instance (instance of class Node) to the snapshot."""
+        self.node_list.append(node)
+        self.table = None
+        self.host_index.setdefault(node.host, []).append(node)
+        self.short_index.setdefault(short_host(node.host), []).append(node)
+        return
+
+    def add_job(self, node, job):
+        """Method to add a running job to the given queue instance and to the job id and owner indexes."""
+        node.add_job(job)
+        job_id = str(job.get_id())
+        known = self.job_index.get(job_id)
+        if known is None:
+            self.job_index[job_id] = job # most jobs run in one queue instance, no list needed
+        elif isinstance(known, list):
+            known.append(job)
+        else:
+            self.job_index[job_id] = [known, job]
+        self.owner_index.setdefault(job.get_user(), []).append(job)
+        return
+
+    def add_pending(self, pending):
+        """Method to add a pending job, which must be an instance of class Pending."""
+        self.pending_list.append(pending)
+        return
+
+    def get_nodes(self):
+        """Method to obtain every queue instance in the snapshot, in qstat order."""
+        return self.node_list
+
+    def get_table(self):
+        """Method to obtain the NodeTable of every queue instance, built the first time it is asked for."""
+        if self.table is None:
+            self.table = NodeTable(self.node_list)
+        return self.table
+
+    def get_host_nodes(self, host):
+        """Method to obtain the queue instances of a host. The host may be the full name as given by
+        qconf or the short name given by qhost. Returns an empty list for unknown hosts."""
+        if host in self.host_index:
+            return self.host_index[host]
+        return self.short_index.get(short_host(host), [])
+
+    def get_host_node(self, host):
+        """Method to obtain the first queue instance of a host, which is the one that is counted when
+        summing up a host group. Returns None for unknown hosts."""
+        nodes = self.get_host_nodes(host)
+        if len(nodes):
+            return nodes[0]
+        return None
+
+    def get_jobs(self, job_id):
+        """Method to obtain the running Job objects belonging to a job id, as a list."""
+        jobs = self.job_index.get(str(job_id))
+        if jobs is None:
+            return []
+        if isinstance(jobs, list):
+            return jobs
+        return [jobs]
+
+    def get_owner_jobs(self, user_name):
+        """Method to obtain every running job of a user."""
+        return self.owner_index.get(user_name, [])
+
+    def get_owner_nodes(self, user_name):
+        """Method to obtain the queue instances which a user has running jobs on, in qstat order."""
+        node_list = []
+        seen = set()
+        for job in self.get_owner_jobs(user_name):
+            if id(job.node) not in seen:
+                seen.add(id(job.node))
+                node_list.append(job.node)
+        return node_list
+
+    def get_pending(self, user_name=None):
+        """Method to obtain the pending jobs, only those of user_name if it is given."""
+        if user_name is None:
+            return self.pending_list
+        return [job for job in self.pending_list if job.get_user() == user_name]
+#^--------------------------------------------------------- class ClusterSnapshot
+
+class HostTotals:
+    """Class to hold the core and node totals of a set of nodes (a hostgroup, a queue, the cluster), as
+    computed by NodeTable.totals. Disabled nodes count towards the total and disabled cores only."""
+
+    def __init__(self, total_cores=0, used_cores=0, free_cores=0, disabled_cores=0, total_nodes=0,
+                 empty_nodes=0, disabled_nodes=0):
+        """Instantiation for HostTotals, every count defaults to 0."""
+        self.total_cores = int(total_cores)
+        self.used_cores = int(used_cores)
+        self.free_cores = int(free_cores)
+        self.disabled_cores = int(disabled_cores)
+        self.total_nodes = int(total_nodes)
+        self.empty_nodes = int(empty_nodes)
+        self.disabled_nodes = int(disabled_nodes)
+
+    def __repr__(self):
+        return 'HostTotals-{0}/{1}cores-{2}nodes'.format(self.used_cores, self.total_cores, self.total_nodes)
+
+    def get_used_nodes(self):
+        """Method to obtain the number of nodes which are neither empty nor disabled."""
+        return self.total_nodes - self.empty_nodes - self.disabled_nodes
+#^--------------------------------------------------------- class HostTotals
+
+class NodeTable:
+    """Class holding the queue instances of a ClusterSnapshot as columns instead of Node objects: total,
+    used and free cores, a disabled flag, load and queue, one entry per queue instance. Row r is
+    node_list[r], so the names are only kept once, in the Node objects. Hostgroup, queue and cluster
+    totals are reductions over a selection of rows. The columns are numpy arrays when numpy is installed
+    and array.array otherwise, which gives the same results at loop speed."""
+
+    def __init__(self, node_list):
+        """Builds the columns from a list of Node objects (normally ClusterSnapshot.node_list)."""
+        self.node_list = node_list
+        self.host_rows = {} # full host name -> row of its first queue instance
+        self.short_rows = {} # host name without the domain -> row of its first queue instance
+        queue_ids = {}
+        total, used, disabled, load, queue = [], [], [], [], []
+        for row, node in enumerate(node_list):
+            total.append(node.get_total())
+            used.append(node.get_used())
+            disabled.append(1 if node.get_disabled_switch() else 0)
+            load.append(parse_load(node.load))
+            queue.append(queue_ids.setdefault(node.queue, len(queue_ids)))
+            self.host_rows.setdefault(node.host, row)
+            self.short_rows.setdefault(short_host(node.host), row)
+        self.queue_names = sorted(queue_ids, key=queue_ids.get) # queue id -> queue name
+        if numpy is not None:
+            self.total = numpy.array(total, dtype=numpy.int32)
+            self.used = numpy.array(used, dtype=numpy.int32)
+            self.free = self.total - self.used
+            self.disabled = numpy.array(disabled, dtype=bool)
+            self.load = numpy.array(load, dtype=numpy.float64)
+            self.queue = numpy.array(queue, dtype=numpy.int32)
+        else:
+            self.total = array('i', total)
+            self.used = array('i', used)
+            self.free = array('i', [t - u for t, u in zip(total, used)])
+            self.disabled = array('b', disabled)
+            self.load = array('d', load)
+            self.queue = array('i', queue)
+
+    def __repr__(self):
+        return 'NodeTable-{0}rows'.format(len(self.node_list))
+
+    def __len__(self):
+        return len(self.node_list)
+
+    def all_rows(self):
+        """Method to obtain the rows of every queue instance."""
+        return list(range(len(self.node_list)))
+
+    def host_rows_for(self, host_list):
+        """Method to obtain the row of the first queue instance of every host in host_list, which is the one
+        counted for a hostgroup. Hosts may be given with or without their domain, unknown hosts are skipped."""
+        rows = []
+        for host in host_list:
+            row = self.host_rows.get(host)
+            if row is None:
+                row = self.short_rows.get(short_host(host))
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def queue_rows(self, queue):
+        """Method to obtain the rows of every queue instance of a queue (cluster queue name, 'long')."""
+        if queue not in self.queue_names:
+            return []
+        queue_id = self.queue_names.index(queue)
+        if numpy is not None:
+            return numpy.flatnonzero(self.queue == queue_id)
+        return [row for row, value in enumerate(self.queue) if value == queue_id]
+
+    def nodes(self, rows):
+        """Method to obtain the Node objects of the given rows, for the printers that list every node."""
+        return [self.node_list[row] for row in rows]
+
+    def totals(self, rows):
+        """Method to sum up the given rows. Returns a HostTotals."""
+        if numpy is not None:
+            rows = numpy.asarray(rows, dtype=numpy.intp)
+            disabled = self.disabled[rows]
+            enabled = ~disabled
+            used = self.used[rows]
+            return HostTotals(self.total[rows].sum(), used[enabled].sum(), self.free[rows][enabled].sum(),
+                              self.total[rows][disabled].sum(), len(rows),
+                              numpy.count_nonzero(enabled & (used == 0)), numpy.count_nonzero(disabled))
+        totals = HostTotals(total_nodes=len(rows))
+        for row in rows:
+            totals.total_cores += self.total[row]
+            if self.disabled[row]:
+                totals.disabled_cores += self.total[row]
+                totals.disabled_nodes += 1
+            else:
+                totals.used_cores += self.used[row]
+                totals.free_cores += self.free[row]
+                if self.used[row] == 0:
+                    totals.empty_nodes += 1
+        return totals
+#^--------------------------------------------------------- class NodeTable
+
+def parse_load(load):
+    """Turns a load string of qstat or qhost into a float, NaN when there is none ('-NA-', '-', None)."""
+    try:
+        return float(load)
+    except (TypeError, ValueError):
+        return float('nan')
+#^----------------------------------------------------------------------------- parse_load(load)
+
+def parse_qhost(qhost):
+    """Function to turn the output of 'qhost' into a load map of every execution host.
+    Returns: dict of host name without its domain -> load string ('-' for hosts that are down), in qhost order."""
+
+    load_map = {}
+    for line in qhost.split('\n')[2:]: # Skipping the header and the dashes
+        fields = line.split()
+        if len(fields) < 7 or fields[0] == 'global':
+            continue # Skipping if it's a mistake, 'global' is not a host
+        load_map[short_host(fields[0])] = fields[6]
+    return load_map
+#^----------------------------------------------------------------------------- parse_qhost(qhost)
+
+class JobDetails:
+    """Class to hold the qstat -j information (start_time, usage, maxvmem, ...) of many jobs. Job ids are
+    registered with want() and nothing is fetched until a field is asked for, at which point every wanted
+    id is fetched at once with 'qstat -j id1,id2,...', JOB_DETAIL_CHUNK ids per call."""
+
+    def __init__(self, chunk_size=JOB_DETAIL_CHUNK):
+        """Creates an empty set of job details."""
+        self.chunk_size = chunk_size
+        self.details = {} # job id -> {field: value}
+        self.wanted = [] # job ids which should be fetched with the next qstat -j call
+
+    def want(self, job_ids):
+        """Method to register job ids that will most likely be asked for, so they are fetched together."""
+        for job_id in job_ids:
+            job_id = str(job_id)
+            if job_id not in self.details:
+                self.wanted.append(job_id)
+        return
+
+    def get(self, job_id):
+        """Method to obtain the detail dictionary of one job, fetching it (and every wanted job) if it has not
+        been fetched yet. Jobs qstat does not know about give an empty dictionary."""
+        job_id = str(job_id)
+        if job_id not in self.details:
+            self.want([job_id])
+            self.fetch()
+        return self.details.get(job_id, {})
+
+    def fetch(self):
+        """Method which runs qstat -j for every wanted job id, in chunks of chunk_size ids."""
+        job_ids = [job_id for job_id in dict.fromkeys(self.wanted) if job_id not in self.details]
+        self.wanted = []
+        chunks = [job_ids[i:i + self.chunk_size] for i in range(0, len(job_ids), self.chunk_size)]
+        outputs = run_commands(['qstat -j {0}'.format(','.join(chunk)) for chunk in chunks], 'job details')
+        for chunk, (status, output) in zip(chunks, outputs): # the chunks run at the same time
+            self.details.update(parse_qstat_j(output))
+            for job_id in chunk:
+                self.details.setdefault(job_id, {}) # unknown or finished jobs are not asked for again
+        return
+#^--------------------------------------------------------- class JobDetails
+
+class ConfigCache:
+    """Class for the on-disk cache of qconf output (hostgroups, user lists, queue configs), which changes
+    rarely but costs a fork and a qmaster round-trip every time. The cache lives in one versioned json file
+    under the user's cache directory, every entry keeps the time it was fetched and its own TTL, and the file
+    is written atomically so concurrent runs never see half a file."""
+
+    def __init__(self, path, refresh=False):
+        """Loads the cache file at path. If refresh is set every entry is treated as expired."""
+        self.path = path
+        self.refresh = refresh
+        self.entries = {} # command -> {'time': fetched at, 'ttl': seconds, 'output': str}
+        self.changed = False
+        self.load()
+
+    def __repr__(self):
+        return 'ConfigCache-{0}'.format(self.path)
+
+    def load(self):
+        """Method to read the cache file. A missing, broken or old-version file leaves the cache empty."""
+        try:
+            with open(self.path) as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(content, dict) and content.get('version') == CACHE_VERSION:
+            self.entries = content.get('entries', {})
+        return
+
+    def get(self, command):
+        """Method to obtain the cached output of a command, or None if it is missing or expired."""
+        entry = self.entries.get(command)
+        if self.refresh or entry is None or time.time() - entry['time'] > entry['ttl']:
+            return None
+        return entry['output']
+
+    def put(self, command, output, ttl):
+        """Method to store the output of a command, it is kept for ttl seconds."""
+        self.entries[command] = {'time': time.time(), 'ttl': ttl, 'output': output}
+        self.changed = True
+        return
+
+    def save(self):
+        """Method to write the cache file if anything changed. The file is written to a temporary file in the
+        same directory and renamed over the old one. Failing to write (read-only home, full disk) is ignored,
+        the cache is only an optimization."""
+        if not self.changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.qconf-')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump({'version': CACHE_VERSION, 'entries': self.entries}, cache_file)
+            os.replace(temp_path, self.path)
+            self.changed = False
+        except OSError:
+            pass
+        return
+#^--------------------------------------------------------- class ConfigCache
+
+def get_config_cache():
+    """Function to obtain the ConfigCache for this run, stored in $XDG_CACHE_HOME/node_search (~/.cache if unset)."""
+    global CONFIG_CACHE
+
+    if CONFIG_CACHE is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        CONFIG_CACHE = ConfigCache(os.path.join(cache_home, 'node_search', 'qconf.json'), REFRESH_CACHE)
+    return CONFIG_CACHE
+#^----------------------------------------------------------------------------- get_config_cache()
+
+def qconf_outputs(command_list):
+    """Function to obtain the output of many qconf commands. Outputs found in the ConfigCache are used as is,
+    the rest are run concurrently with run_commands and stored, unless the command failed. Returns the outputs
+    in the order of command_list."""
+
+    cache = get_config_cache()
+    outputs = [cache.get(command) for command in command_list]
+    missing = []
+    for command, output in zip(command_list, outputs):
+        if output is None and command not in missing:
+            missing.append(command)
+    results = {}
+    for command, (status, output) in zip(missing, run_commands(missing, 'config')):
+        results[command] = output
+        if status == 0:
+            cache.put(command, output, CACHE_TTL.get(command.split()[1], 3600))
+    cache.save()
+    return [results[command] if output is None else output for command, output in zip(command_list, outputs)]
+#^----------------------------------------------------------------------------- qconf_outputs(command_list)
+
+def qconf_output(command):
+    """Function to obtain the output of one qconf command through the ConfigCache, see qconf_outputs."""
+    return qconf_outputs([command])[0]
+#^----------------------------------------------------------------------------- qconf_output(command)
+
+def user_list_index():
+    """Function to obtain the reverse index of the user lists (ACLs): user name (or @unix_group) -> the user
+    lists which name it in their entries, in 'qconf -sul' order. The lists are fetched USERLIST_CHUNK at a
+    time with 'qconf -su a,b,c', the chunks running concurrently, and the index is kept in the ConfigCache
+    along with the list names it was built from, so it is rebuilt when a list is added or removed."""
+
+    all_user_lists = qconf_output("qconf -sul").split()
+    cache = get_config_cache()
+    cached = cache.get('qconf -su index')
+    if cached is not None:
+        content = json.loads(cached)
+        if content['lists'] == all_user_lists:
+            return content['index']
+    chunks = [all_user_lists[i:i + USERLIST_CHUNK] for i in range(0, len(all_user_lists), USERLIST_CHUNK)]
+    results = run_commands(['qconf -su ' + ','.join(chunk) for chunk in chunks], 'config')
+    entries = {}
+    for status, output in results:
+        entries.update(parse_user_lists(output))
+    index = {}
+    for ul in all_user_lists:
+        for entry in entries.get(ul, []):
+            lists = index.setdefault(entry, [])
+            if ul not in lists:
+                lists.append(ul)
+    if all(status == 0 for status, output in results):
+        cache.put('qconf -su index', json.dumps({'lists': all_user_lists, 'index': index}), CACHE_TTL['-su'])
+        cache.save()
+    return index
+#^----------------------------------------------------------------------------- user_list_index()
+
+def parse_user_lists(output):
+    """Function to parse the output of 'qconf -su a,b,c' (one 'name ... entries ...' block per list) into a
+    dictionary of list name -> entries. Continued lines (ending in '\\') are joined and NONE is no entry."""
+
+    user_lists = {}
+    name = None
+    for line in output.replace('\\\n', '').split('\n'):
+        fields = line.split(None, 1)
+        if len(fields) != 2:
+            continue
+        if fields[0] == 'name':
+            name = fields[1].strip()
+            user_lists[name] = []
+        elif fields[0] == 'entries' and name is not None:
+            user_lists[name] = [entry.strip() for entry in fields[1].split(',')
+                                if entry.strip() and entry.strip() != 'NONE']
+    return user_lists
+#^----------------------------------------------------------------------------- parse_user_lists(output)
+
+def find_user_lists(user_name, group_id):
+    """Function to obtain the user lists a user belongs to, by name or through one of the user's unix groups
+    (an '@group' entry), from the user_list_index. group_id is the user's primary group. Returns the lists
+    in 'qconf -sul' order."""
+
+    index = user_list_index()
+    found = set(index.get(user_name, []))
+    if any(entry.startswith('@') for entry in index):
+        for gid in os.getgrouplist(user_name, group_id):
+            try:
+                found.update(index.get('@' + getgrgid(gid).gr_name, []))
+            except KeyError:
+                continue # a group id without a name
+    order = qconf_output("qconf -sul").split()
+    return [ul for ul in order if ul in found]
+#^----------------------------------------------------------------------------- find_user_lists(user_name, group_id)
+
+class XymonFetcher:
+    """Class to fetch the xymon cpu (top) pages of many nodes at once. Pages are fetched by a pool of at most
+    `workers` threads, each thread keeps its own keep-alive connection to the xymon server and reuses it for
+    every page it fetches. Every request has a timeout, and a node whose page cannot be fetched is recorded
+    in `degraded` instead of stopping the run."""
+
+    # errors of a keep-alive connection which the server closed while it was idle
+    STALE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, url=None, workers=None, timeout=None):
+        """url is a template with {0} for the node name, workers and timeout default to the XYMON_ globals."""
+        self.url = url or XYMON_URL
+        self.workers = workers or XYMON_WORKERS
+        self.timeout = timeout or XYMON_TIMEOUT
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = [] # every connection opened, so close() can reach the ones of other threads
+        self.degraded = {} # node -> reason its page could not be fetched
+
+    def __repr__(self):
+        return 'XymonFetcher-{0}'.format(self.url)
+
+    def connection(self, scheme, netloc, fresh=False):
+        """Method to obtain this thread's connection to netloc, a new one is opened if there is none yet or
+        if fresh is set (after a dropped keep-alive connection)."""
+        connections = self.local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is not None and not fresh:
+            return conn
+        if conn is not None:
+            conn.close()
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        connections[(scheme, netloc)] = conn
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def fetch(self, node):
+        """Method to fetch the page of one node. Returns the page as a string, or None if it could not be
+        fetched, in which case the reason is kept in self.degraded. A request on a reused connection that
+        fails because the server closed the idle connection (STALE_ERRORS) is tried once more on a new
+        connection. Any other failure, a timeout above all, is not retried, and the connection is dropped
+        so the thread's next page gets a new one."""
+        start = time.time()
+        url = urlsplit(self.url.format(node))
+        path = url.path + ('?' + url.query if url.query else '')
+        connections = self.local.__dict__.setdefault('connections', {})
+        retries = (False, True) if (url.scheme, url.netloc) in connections else (False,)
+        for fresh in retries:
+            try:
+                conn = self.connection(url.scheme, url.netloc, fresh)
+                conn.request('GET', path)
+                response = conn.getresponse()
+                page = response.read() # always read the whole body, so the connection can be reused
+                if response.status != 200:
+                    reason = 'HTTP {0} {1}'.format(response.status, response.reason)
+                    break
+                self.trace(node, start, len(page), 0)
+                return page.decode('utf8', 'replace')
+            except (http.client.HTTPException, OSError) as error:
+                reason = str(error) or error.__class__.__name__
+                connections.pop((url.scheme, url.netloc)).close() # in an unknown state, the next request opens a new one
+                if not isinstance(error, self.STALE_ERRORS):
+                    break
+        with self.lock:
+            self.degraded[node] = reason
+        self.trace(node, start, 0, 1)
+        return None
+
+    def trace(self, node, start, size, status):
+        """Method to record the request for a node's page with --trace-commands, all under the url template."""
+        if TRACE is not None:
+            TRACE.record('processes', 'GET ' + self.url.format(node), time.time() - start, size, status,
+                         'GET ' + self.url)
+
+    def fetch_all(self, nodes):
+        """Method to fetch the pages of every node concurrently. Returns a dictionary of node -> page
+        (None for degraded nodes)."""
+        nodes = list(dict.fromkeys(nodes))
+        if len(nodes) < 2:
+            return dict((node, self.fetch(node)) for node in nodes)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(nodes))) as pool:
+            return dict(zip(nodes, pool.map(self.fetch, nodes)))
+
+    def close(self):
+        """Method to close every connection opened by this fetcher."""
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        return
+#^--------------------------------------------------------- class XymonFetcher
+
+def fetch_xymon_pages(nodes):
+    """Function to fetch the xymon cpu pages of the given nodes (names without the domain) concurrently.
+    Returns a dictionary of node -> page, where the page is None for nodes xymon did not answer for."""
+    fetcher = XymonFetcher()
+    try:
+        return fetcher.fetch_all(nodes)
+    finally:
+        fetcher.close()
+#^----------------------------------------------------------------------------- fetch_xymon_pages(nodes)
+
+def print_degraded(pages):
+    """Prints which nodes had no xymon page, if any, after a user printout."""
+    degraded = [node for node in pages if pages[node] is None]
+    if len(degraded):
+        print("Warning: xymon did not answer for {0} node(s), their process info is missing: {1}\n"
+              .format(len(degraded), ', '.join(degraded)))
+    return
+#^----------------------------------------------------------------------------- print_degraded(pages)
+
+class CommandTrace:
+    """Class to account for the external work of one run, set up by --trace-commands. Every qstat, qconf and
+    qhost command and every xymon request is recorded with the phase of the mode it belongs to, its wall time,
+    the size of its output and its status. A command issued again with the same arguments is a duplicate."""
+
+    def __init__(self, output_format='table'):
+        """Creates an empty trace which will be reported as a 'table' or as 'json'."""
+        self.output_format = output_format
+        self.start = time.time()
+        self.calls = [] # {'phase', 'command', 'group', 'seconds', 'bytes', 'status', 'duplicate'} in call order
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return 'CommandTrace-{0}calls'.format(len(self.calls))
+
+    def record(self, phase, command, seconds, size, status, group=None):
+        """Method to record one call. Calls with the same group (the command itself unless given, the url
+        template for xymon requests) are summed up in one row of the table."""
+        with self.lock:
+            self.calls.append({'phase': phase, 'command': command, 'group': group or command,
+                               'seconds': round(seconds, 6), 'bytes': size, 'status': status,
+                               'duplicate': command in self.seen})
+            self.seen.add(command)
+        return
+
+    def summary(self):
+        """Method to sum the calls up per phase and group, in the order they were first made.
+        Returns: list of {'phase', 'command', 'calls', 'seconds', 'bytes', 'duplicates', 'failed'}."""
+        rows = {}
+        for call in self.calls:
+            key = (call['phase'], call['group'])
+            if key not in rows:
+                rows[key] = {'phase': call['phase'], 'command': call['group'], 'calls': 0, 'seconds': 0.0,
+                             'bytes': 0, 'duplicates': 0, 'failed': 0}
+            row = rows[key]
+            row['calls'] += 1
+            row['seconds'] += call['seconds']
+            row['bytes'] += call['bytes']
+            row['duplicates'] += call['duplicate']
+            row['failed'] += call['status'] != 0
+        return list(rows.values())
+
+    def report(self):
+        """Method to obtain the trace as a string, in the format given to the constructor."""
+        wall = time.time() - self.start
+        rows = self.summary()
+        if self.output_format == 'json':
+            return json.dumps({'wall': round(wall, 6), 'summary': rows, 'calls': self.calls}, indent=2) + '\n'
+        lines = ['Command trace: {0} call(s) in {1:.3f} s, {2} duplicate(s)'.format(
+                     len(self.calls), wall, sum(row['duplicates'] for row in rows)),
+                 'phase'.ljust(13) + 'calls'.rjust(6) + 'seconds'.rjust(10) + 'bytes'.rjust(11) + '  command',
+                 '-'.center(TERMWIDTH, '-')]
+        for row in rows:
+            notes = []
+            if row['duplicates']:
+                notes.append('DUPLICATE x{0}'.format(row['duplicates']))
+            if row['failed']:
+                notes.append('{0} failed'.format(row['failed']))
+            lines.append(row['phase'].ljust(13) + str(row['calls']).rjust(6) + '{0:10.3f}'.format(row['seconds'])
+                         + str(row['bytes']).rjust(11) + '  ' + row['command']
+                         + ('  <-- ' + ', '.join(notes) if notes else ''))
+        return '\n'.join(lines) + '\n'
+#^--------------------------------------------------------- class CommandTrace
+
+class CountingReader(io.RawIOBase):
+    """Raw reader passing a binary pipe through and counting the bytes read from it, so the output size of a
+    streamed command can be traced."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.raw.readinto(buffer)
+        self.count += size or 0
+        return size
+#^--------------------------------------------------------- class CountingReader
+
+def run_command(command, phase):
+    """Function through which every external command is run, as subprocess.getstatusoutput, so it is
+    recorded under phase when --trace-commands is given.
+    Returns: (exit status, output)."""
+    start = time.time()
+    status, output = subprocess.getstatusoutput(command)
+    if TRACE is not None:
+        TRACE.record(phase, command, time.time() - start, len(output.encode('utf8', 'replace')), status)
+    return status, output
+#^----------------------------------------------------------------------------- run_command(command, phase)
+
+def command_output(command, phase):
+    """Function to obtain only the output of a command run with run_command, as subprocess.getoutput."""
+    return run_command(command, phase)[1]
+#^----------------------------------------------------------------------------- command_output(command, phase)
+
+def print_trace(stream=None):
+    """Function to print the report of --trace-commands, if it was given, to stream (stderr by default, so
+    the normal output can still be redirected on its own)."""
+    if TRACE is not None:
+        (stream or sys.stderr).write(TRACE.report())
+    return
+#^----------------------------------------------------------------------------- print_trace(stream)
+
+class RecordWriter:
+    """Class to write the data of a mode as records instead of text, for --format. Every record has a type
+    (host_summary, node, job, pending, ...) and named fields, and is written out as soon as it is given:
+    json is one array of objects which is closed by close(), ndjson is one object per line, flushed right
+    away, and csv gets a header line (type and field names) whenever the fields change from the last record."""
+
+    def __init__(self, output_format):
+        """Creates a writer for 'json', 'ndjson' or 'csv', writing to whatever sys.stdout is at the time."""
+        self.output_format = output_format
+        self.count = 0
+        self.header = None # field names of the last csv header
+
+    def __repr__(self):
+        return 'RecordWriter-{0}-{1}records'.format(self.output_format, self.count)
+
+    def write(self, kind, fields):
+        """Method to write one record of type kind, fields being a list of (name, value) pairs."""
+        record = OrderedDict([('type', kind)] + list(fields))
+        out = sys.stdout
+        if self.output_format == 'csv':
+            names = list(record)
+            writer = csv.writer(out, lineterminator='\n')
+            if names != self.header:
+                writer.writerow(names)
+                self.header = names
+            writer.writerow([csv_value(value) for value in record.values()])
+        elif self.output_format == 'ndjson':
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+        else:
+            out.write(('[\n' if self.count == 0 else ',\n') + json.dumps(record))
+        self.count += 1
+        return
+
+    def close(self):
+        """Method to finish the output, which closes the json array."""
+        if self.output_format == 'json':
+            sys.stdout.write('[]\n' if self.count == 0 else '\n]\n')
+        return
+#^--------------------------------------------------------- class RecordWriter
+
+def csv_value(value):
+    """Turns a record value into a csv cell: lists are joined with spaces and None is left empty."""
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(item) for item in value)
+    return value
+#^----------------------------------------------------------------------------- csv_value(value)
+
+def emit(kind, fields):
+    """Function through which the modes write a record (see RecordWriter) when --format is given."""
+    RECORDS.write(kind, fields)
+    return
+#^----------------------------------------------------------------------------- emit(kind, fields)
+
+def close_records():
+    """Function to finish the --format output of a run, if there is one."""
+    global RECORDS
+
+    if RECORDS is not None:
+        RECORDS.close()
+        RECORDS = None
+    return
+#^----------------------------------------------------------------------------- close_records()
+
+def totals_fields(key, name, totals):
+    """Returns the fields of a HostTotals record, named by key (hostgroup, queue, ...)."""
+    return [(key, name), ('total_cores', totals.total_cores), ('used_cores', totals.used_cores),
+            ('free_cores', totals.free_cores),
+            ('disabled_cores', totals.disabled_cores), ('total_nodes', totals.total_nodes),
+            ('used_nodes', totals.get_used_nodes()), ('disabled_nodes', totals.disabled_nodes),
+            ('empty_nodes', totals.empty_nodes)]
+#^----------------------------------------------------------------------------- totals_fields(key, name, totals)
+
+def node_fields(node):
+    """Returns the fields of a queue instance record."""
+    load = parse_load(node.load)
+    return [('queue_instance', node.get_name()), ('host', node.host), ('queue', node.queue),
+            ('used_cores', node.get_used()), ('total_cores', node.get_total()),
+            ('disabled', bool(node.get_disabled_switch())), ('states', node.states),
+            ('load', None if load != load else load)] # NaN is not valid json
+#^----------------------------------------------------------------------------- node_fields(node)
+
+def job_fields(job):
+    """Returns the fields of a running job record, the start time and maxvmem coming from qstat -j."""
+    details = get_job_details().get(job.get_id())
+    return [('job_id', str(job.get_id())), ('name', job.get_name()), ('user', job.get_user()),
+            ('cores', int(job.get_core_info())), ('priority', job.get_priority()), ('state', job.state),
+            ('start_time', details.get('start_time', job.date)), ('max_mem', details.get('maxvmem')),
+            ('queue_instance', job.node.get_name() if job.node else None),
+            ('host', job.node.host if job.node else None)]
+#^----------------------------------------------------------------------------- job_fields(job)
+
+def pending_fields(job):
+    """Returns the fields of a pending job record."""
+    return [('job_id', str(job.get_id())), ('name', job.get_name()), ('user', job.get_user()),
+            ('cores', int(job.get_core_info())), ('priority', job.get_priority()), ('state', job.state),
+            ('submitted', job.date)]
+#^----------------------------------------------------------------------------- pending_fields(job)
+
+def emit_processes(host, user_name, page):
+    """Writes the xymon processes of a user on a host as records, or a degraded record without a page."""
+    if page is None:
+        emit('degraded', [('host', host), ('reason', 'xymon did not answer')])
+        return
+    for proc in get_user_processes(page, user_name)[0]:
+        emit('process', [('host', host), ('user', user_name), ('pid', proc['PID']), ('name', proc['PNAME']),
+                         ('memory', proc['RESMEM']), ('cpu_percent', proc['CPU%']), ('time', proc['TIME'])])
+    return
+#^----------------------------------------------------------------------------- emit_processes(host, user_name, page)
+
+def get_job_details():
+    """Function to obtain the JobDetails shared by every Job in this run."""
+    global JOB_DETAILS
+
+    if JOB_DETAILS is None:
+        JOB_DETAILS = JobDetails()
+    return JOB_DETAILS
+#^----------------------------------------------------------------------------- get_job_details()
+
+def parse_qstat_j(qstat):
+    """Function to parse the output of 'qstat -j id1,id2,...' into a dictionary of job id -> detail dictionary.
+    Each 'key: value' line becomes a field, task numbers ('start_time   1:') are dropped and only the first task
+    is kept. The entries of the usage line (cpu=, mem=, maxvmem=, ...) also become fields of their own."""
+
+    details = {}
+    fields = None
+    for line in qstat.split('\n'):
+        key, sep, value = line.partition(':')
+        key = key.split()
+        if not sep or not len(key):
+            continue
+        if len(key) == 2 and key[1].isdigit(): # 'start_time   1:' is the first task of the job
+            key = key[:1]
+        if len(key) != 1:
+            continue
+        key = key[0]
+        value = value.strip()
+        if key == 'job_number':
+            fields = details.setdefault(value, {})
+        elif fields is not None and key not in fields:
+            fields[key] = value
+            if key == 'usage':
+                for usage in value.split(','):
+                    name, _, amount = usage.strip().partition('=')
+                    fields.setdefault(name, amount)
+    return details
+#^----------------------------------------------------------------------------- parse_qstat_j(qstat)
+
+def short_host(host):
+    """Returns the host name without its domain, d12chas400.crc.nd.edu -> d12chas400."""
+    return host.split('.')[0]
+#^----------------------------------------------------------------------------- short_host(host)
+
+def get_snapshot():
+    """Function to obtain the ClusterSnapshot of the grid engine. qstat is only run the first time, every
+    later call in the same run returns the same snapshot, unless SNAPSHOT_REQUESTS asks for the requests
+    the snapshot was read without (a --pending query to the daemon), in which case it is read again."""
+    global SNAPSHOT, JOB_DETAILS
+
+    if SNAPSHOT is None or (SNAPSHOT_REQUESTS and not SNAPSHOT.requests):
+        SNAPSHOT = load_snapshot(SNAPSHOT_REQUESTS)
+        JOB_DETAILS = None # details belong to the snapshot they were fetched for
+    return SNAPSHOT
+#^----------------------------------------------------------------------------- get_snapshot()
+
+def load_snapshot(requests=False):
+    """Function which runs qstat and returns a new ClusterSnapshot, without touching the shared one. The
+    snapshot is built while qstat is still writing, see stream_qstat. requests adds qstat -r."""
+    snapshot = build_snapshot(stream_qstat(snapshot_command(requests)))
+    snapshot.requests = requests
+    return snapshot
+#^----------------------------------------------------------------------------- load_snapshot(requests)
+
+def snapshot_command(requests):
+    """Returns the qstat command of a snapshot, with -r when the queues the pending jobs asked for are wanted.
+    -r lists the requests of every job, so it is only given when needed."""
+    if requests:
+        return 'qstat -f -r -xml'
+    return 'qstat -f -xml'
+#^----------------------------------------------------------------------------- snapshot_command(requests)
+
+def build_snapshot(records):
+    """Function which fills a new ClusterSnapshot from a stream of qstat records (see iter_qstat_text)."""
+    snapshot = ClusterSnapshot()
+    for record in fill_snapshot(snapshot, records):
+        pass
+    return snapshot
+#^----------------------------------------------------------------------------- build_snapshot(records)
+
+def fill_snapshot(snapshot, records):
+    """Generator which adds a stream of qstat records to snapshot, yielding every record once it is added."""
+    for kind, node, job in records:
+        if kind == 'node':
+            snapshot.add_node(node)
+        elif kind == 'job':
+            snapshot.add_job(node, job)
+        else:
+            snapshot.add_pending(job)
+        yield kind, node, job
+#^----------------------------------------------------------------------------- fill_snapshot(snapshot, records)
+
+def stream_snapshot():
+    """Generator to read the shared snapshot like get_snapshot, yielding every queue instance (Node) as soon
+    as qstat has given it, so records can be written before the whole cluster is read. If the snapshot was
+    already read (a second call, the daemon) its queue instances are yielded from memory."""
+    global SNAPSHOT
+
+    if SNAPSHOT is not None:
+        for node in SNAPSHOT.node_list:
+            yield node
+        return
+    snapshot = ClusterSnapshot()
+    snapshot.requests = SNAPSHOT_REQUESTS
+    for kind, node, job in fill_snapshot(snapshot, stream_qstat(snapshot_command(SNAPSHOT_REQUESTS))):
+        if kind == 'node':
+            yield node
+    SNAPSHOT = snapshot
+#^----------------------------------------------------------------------------- stream_snapshot()
+
+def stream_qstat(command):
+    """Generator which runs a qstat -f command and yields its records (see iter_qstat_text) as the output
+    arrives through a pipe, so parsing overlaps with the qmaster writing and the whole output is never held
+    in memory. Both the -xml output and the plain text output are accepted, the format is found by peeking
+    at the start of the output. qstat's errors go straight to stderr."""
+
+    start = time.time()
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    stdout = proc.stdout
+    if TRACE is not None:
+        stdout = io.BufferedReader(CountingReader(proc.stdout))
+    try:
+        if stdout.peek(64).lstrip().startswith(b'<'):
+            records = iter_qstat_xml(stdout)
+        else:
+            records = iter_qstat_text(io.TextIOWrapper(stdout, encoding='utf8', errors='replace'))
+        for record in records:
+            yield record
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        if TRACE is not None: # the time includes the parsing, which overlaps with qstat writing
+            TRACE.record('snapshot', command, time.time() - start, stdout.raw.count, proc.returncode)
+#^----------------------------------------------------------------------------- stream_qstat(command)
+
+def parse_qstat(qstat):
+    """Function which turns the output of qstat -f, already read into a string, into a ClusterSnapshot.
+    Both the -xml output and the plain text output are accepted."""
+    if qstat.lstrip().startswith('<'):
+        return build_snapshot(iter_qstat_xml(io.BytesIO(qstat.encode('utf8'))))
+    return build_snapshot(iter_qstat_text(qstat.split('\n')))
+#^----------------------------------------------------------------------------- parse_qstat(qstat)
+
+def iter_qstat_text(lines):
+    """Generator to parse the plain output of qstat -f one line at a time. Queue lines become Node objects,
+    the job lines under them become Job objects, and everything after the pending marker becomes Pending
+    objects. Yields (kind, node, job) records: ('node', Node, None), ('job', Node, Job) for a job running in
+    that queue instance and ('pending', None, Pending). With qstat -r, the 'Hard requested queues' line under
+    a pending job gives its queue, the other request lines are skipped."""
+
+    node = None
+    pending = None
+    in_pending = False
+    for line in lines:
+        fields = line.split()
+        if not len(fields) or fields[0] == 'queuename' or fields[0].startswith('---'):
+            continue
+        if fields[0].startswith('###'):
+            in_pending = True
+            continue
+        if fields[0] == '-': # ' - PENDING JOBS - PENDING JOBS ...' banner
+            continue
+        if in_pending:
+            if fields[0].isdigit() and len(fields) >= 5:
+                pending = pending_from_fields(fields)
+                yield 'pending', None, pending
+            elif pending is not None and fields[:3] == ['Hard', 'requested', 'queues:']:
+                pending.queue = sys.intern(''.join(fields[3:]))
+        elif '@' in fields[0] and len(fields) >= 3 and fields[2].count('/') == 2:
+            node = node_from_fields(fields)
+            yield 'node', node, None
+        elif node is not None and fields[0].isdigit() and len(fields) >= 5:
+            yield 'job', node, job_from_fields(fields)
+#^----------------------------------------------------------------------------- iter_qstat_text(lines)
+
+def node_from_fields(fields):
+    """Creates a Node from the split queue line of qstat -f:
+    queuename qtype resv/used/tot. load_avg arch [states]"""
+    cores = fields[2].split('/')
+    node = Node(fields[0], cores[2], cores[1], False)
+    if len(fields) > 3:
+        node.set_load(fields[3])
+    if len(fields) > 5:
+        node.states = sys.intern(fields[5])
+        node.set_disabled_switch(fields[5] in DISABLED_STATES)
+    return node
+#^----------------------------------------------------------------------------- node_from_fields(fields)
+
+def job_from_fields(fields):
+    """Creates a Job from the split job line of qstat -f:
+    job-ID prior name user state start-date start-time [slots] [ja-task-ID]"""
+    if len(fields) > 7:
+        slots = int(fields[7])
+    else:
+        slots = 1
+    job = Job(fields[2], fields[3], slots)
+    job.id = fields[0]
+    job.set_priority(sys.intern(fields[1]))
+    job.state = sys.intern(fields[4])
+    job.date = sys.intern(' '.join(fields[5:7]))
+    return job
+#^----------------------------------------------------------------------------- job_from_fields(fields)
+
+def pending_from_fields(fields):
+    """Creates a Pending job from the split pending line of qstat -f."""
+    if len(fields) > 7:
+        slots = int(fields[7])
+    else:
+        slots = 1
+    job = Pending(fields[2], fields[3], slots)
+    job.id = fields[0]
+    job.set_priority(sys.intern(fields[1]))
+    job.state = sys.intern(fields[4])
+    job.set_status(job.state)
+    job.set_date(sys.intern(' '.join(fields[5:7])))
+    job.queue = None
+    return job
+#^----------------------------------------------------------------------------- pending_from_fields(fields)
+
+def iter_qstat_xml(stream):
+    """Generator to parse the output of qstat -f -xml from a binary file object, one element at a time.
+    Every Queue-List element becomes a Node with its job_list children as Jobs, and the job_list elements
+    of the pending section become Pending objects, with the hard_req_queue of qstat -r as their queue.
+    Yields the same records as iter_qstat_text. Elements are dropped from the tree once handled, so memory
+    stays bounded however long the output is."""
+
+    parents = []
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == 'Queue-List':
+            fields = [element.findtext('name', ''), element.findtext('qtype', ''),
+                      '/'.join([element.findtext('slots_resv', '0'), element.findtext('slots_used', '0'),
+                                element.findtext('slots_total', '0')]),
+                      element.findtext('load_avg', '-NA-'), element.findtext('arch', '')]
+            if element.findtext('state'):
+                fields.append(element.findtext('state'))
+            node = node_from_fields(fields)
+            yield 'node', node, None
+            for job in element.findall('job_list'):
+                yield 'job', node, job_from_fields(xml_job_fields(job))
+        elif element.tag == 'job_list' and parents[-1].tag == 'job_info':
+            job = pending_from_fields(xml_job_fields(element))
+            queues = [queue.text for queue in element.findall('hard_req_queue') if queue.text] # with qstat -r
+            if queues:
+                job.queue = sys.intern(','.join(queues))
+            yield 'pending', None, job
+        else:
+            continue
+        parents[-1].remove(element)
+#^----------------------------------------------------------------------------- iter_qstat_xml(stream)
+
+def xml_job_fields(job):
+    """Turns a job_list element of qstat -xml into the same fields as a job line of qstat -f, so running
+    and pending jobs are built the same way from both formats. Dates become MM/DD/YYYY HH:MM:SS."""
+    stamp = job.findtext('JAT_start_time') or job.findtext('JB_submission_time') or 'T'
+    day, _, clock = stamp.partition('T')
+    if day.count('-') == 2:
+        year, month, date = day.split('-')
+        day = '/'.join([month, date, year])
+    return [job.findtext('JB_job_number', '0'), job.findtext('JAT_prio', '0'), job.findtext('JB_name', ''),
+            job.findtext('JB_owner', ''), job.findtext('state', ''), day, clock.split('.')[0],
+            job.findtext('slots', '1')]
+#^----------------------------------------------------------------------------- xml_job_fields(job)
+
 def main():
     """Main will parse through cmdline args, and give the result to the proper function. The debug
     queue is very simple to do on its own so it has its own function."""
-    global TERMWIDTH, PRINT_INDENT, DEBUG_QUEUE_HOSTGROUP, GENERAL_ACCESS_QUEUE_HOSTGROUP
-    
+    global TERMWIDTH, PRINT_INDENT, DEBUG_QUEUE_HOSTGROUP, GENERAL_ACCESS_QUEUE_HOSTGROUP, RECORDS, SNAPSHOT_REQUESTS
+    
+    if len(sys.argv) > 1 and sys.argv[1] == '--query':
+        query_daemon(sys.argv[2:])
+    parse_global_flags()
+    if len(sys.argv) > 1 and sys.argv[1] == '--report':
+        report_history(sys.argv[2:]) # takes its own --since and --hostgroup
+    if len(sys.argv) > 1 and sys.argv[1] == '--pending':
+        if len(sys.argv) > 2:
+            print("Error: Too many args, --pending does not take any.")
+            show_usage(20)
+        SNAPSHOT_REQUESTS = True # the per queue backlog comes from the snapshot's qstat -r
+        show_pending()
+    if len(sys.argv) > 1 and sys.argv[1] == '--top':
+        show_top(sys.argv[2:]) # takes its own --by
+    if WATCH_INTERVAL is not None:
+        if OUTPUT_FORMAT != 'text':
+            print("Error: --watch only shows text, it can not be used with --format.")
+            RECORDS = None
+            show_usage(23)
+        watch(sys.argv[1:])
     if len(sys.argv) < 2 or len(sys.argv) > 4:
         print("Error: Too few or too many arguments.")
         show_usage(20)
@@ -349,7 +1495,7 @@ def main():
             find_host_groups(os.environ['USER'], False, True)
             
     elif sys.argv[1] == '-j':
-        if (len(sys.argv)) > 4 or (len(sys.argv)) < 3:
+        if (len(sys.argv)) != 3:
             print("Error: Incorrect argument number.")
             show_usage(20)
         else:
@@ -367,6 +1513,26 @@ def main():
     elif sys.argv[1] == "-all":
         print("Did you mean, '--all'?")
         show_usage(20)
+    elif sys.argv[1] == '--stats':
+        if len(sys.argv) > 2:
+            print("Error: Too many args, --stats does not take any.")
+            show_usage(20)
+        show_everything()
+    elif sys.argv[1] == '--serve':
+        if len(sys.argv) > 3:
+            print("Error: Too many args, --serve only takes the path of its socket.")
+            show_usage(20)
+        serve(sys.argv[2] if len(sys.argv) == 3 else SERVE_SOCKET)
+    elif sys.argv[1] == '--record':
+        if len(sys.argv) > 2:
+            print("Error: Too many args, --record does not take any (the file is $NODE_SEARCH_HISTORY).")
+            show_usage(20)
+        record_history()
+    elif sys.argv[1] == '--metrics':
+        if len(sys.argv) > 3:
+            print("Error: Too many args, --metrics only takes a file, :PORT or HOST:PORT.")
+            show_usage(20)
+        export_metrics(sys.argv[2] if len(sys.argv) == 3 else '-')
     elif (sys.argv[1] == '-H' or sys.argv[1] == '--hosts'):
         if len(sys.argv) > 2:
             print("Error: Too many args, you can't use --details with -H!")
@@ -375,7 +1541,7 @@ def main():
     else:
         desired_host = str(sys.argv[1][1:]) #getting rid of '-'
     
-    valid_hosts = (subprocess.getoutput("qconf -shgrpl").split())
+    valid_hosts = (qconf_output("qconf -shgrpl").split())
 
     if desired_host == DEBUG_QUEUE_HOSTGROUP or desired_host == GENERAL_ACCESS_QUEUE_HOSTGROUP or \
        desired_host == "all":
@@ -387,6 +1553,44 @@ def main():
         process_host(desired_host)
     sys.exit()
 #^----------------------------------------------------------------------------- main()   
+
+def parse_global_flags():
+    """Takes the flags which may be given along with any mode (see show_usage) out of sys.argv and sets
+    their globals, so main and the mode functions only ever see the mode's own arguments."""
+    global REFRESH_CACHE, TRACE, WATCH_INTERVAL, OUTPUT_FORMAT, RECORDS
+
+    args = []
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg == '--refresh':
+            REFRESH_CACHE = True
+        elif arg == '--watch':
+            interval = next(argv, '')
+            try:
+                WATCH_INTERVAL = float(interval)
+            except ValueError:
+                WATCH_INTERVAL = 0
+            if WATCH_INTERVAL <= 0:
+                print("Error: --watch takes the number of seconds between refreshes, not '{0}'.".format(interval))
+                show_usage(23)
+        elif arg == '--format' or arg.startswith('--format='):
+            OUTPUT_FORMAT = arg.partition('=')[2] or next(argv, '')
+            if OUTPUT_FORMAT not in ('text', 'json', 'ndjson', 'csv'):
+                print("Error: --format takes text, json, ndjson or csv, not '{0}'.".format(OUTPUT_FORMAT))
+                OUTPUT_FORMAT = 'text'
+                show_usage(23)
+            RECORDS = None if OUTPUT_FORMAT == 'text' else RecordWriter(OUTPUT_FORMAT)
+        elif arg == '--trace-commands' or arg.startswith('--trace-commands='):
+            output_format = arg.partition('=')[2] or 'table'
+            if output_format not in ('table', 'json'):
+                print("Error: --trace-commands takes 'table' or 'json', not {0}.".format(output_format))
+                show_usage(23)
+            TRACE = CommandTrace(output_format)
+        else:
+            args.append(arg)
+    sys.argv[1:] = args
+    return
+#^----------------------------------------------------------------------------- parse_global_flags()
  
 def find_host_groups(user_name, detail_switch, queue_switch):
     """Method to find the host groups that a given user belongs to. Username is passed in,
@@ -400,14 +1604,7 @@ def find_host_groups(user_name, detail_switch, queue_switch):
         print("Error: User {0} is not recognized.".format(user_name))
         sys.exit(25)
 
-    all_user_lists = subprocess.getoutput("qconf -sul").split('\n')
-    
-    user_list = []
-    #Going through each element of all_user_lists and finding detailed output for that element
-    for ul in all_user_lists:
-        u_list = subprocess.getoutput("qconf -su " + ul)
-        if u_list.find(user_name) != (-1):
-            user_list.append(ul)
+    user_list = find_user_lists(user_name, user_pwd.pw_gid)
             
     queue_list= []
     if queue_switch:
@@ -430,25 +1627,141 @@ def find_host_groups(user_name, detail_switch, queue_switch):
     # Everyone has access to debug
     host_user_list.append('@' + DEBUG_QUEUE_HOSTGROUP)
     
-    if detail_switch:
+    if OUTPUT_FORMAT != 'text':
+        for ul in user_list:
+            emit('user_list', [('user', user_name), ('user_list', ul)])
+        host_user_list = list(dict.fromkeys(host_user_list)) # one record per hostgroup, in the order found
+        hostgroup_hosts = resolve_hostgroups(host_user_list) if detail_switch else {}
+        for hostgroup in host_user_list:
+            emit('hostgroup_access', [('user', user_name), ('hostgroup', hostgroup),
+                                      ('hosts', hostgroup_hosts.get(hostgroup))])
+    elif detail_switch:
         print_duser_host(host_user_list, user_name, user_list)
     else:
         print_user_host(host_user_list, user_name, user_list)
     sys.exit()
 #^----------------------------------------------------------------------------- find_host_groups(user_name)
 
-def process_id(job_id):
-    """Accepts the job id to search for. Parses qstat to find the job associated with the job_id.
-    Will parse both qstat's -j flag and searches for the job on xymon. Passes on necessary information
-    to print_id function."""
-    pass # Not implemented yet
+def process_id(job_ids):
+    """Accepts the job id(s) to search for, comma separated. Running jobs are found through the job id index of
+    the snapshot, their qstat -j information (start time, maxvmem) is fetched for every id in one batched call
+    and the xymon process rows of each job's owner are fetched for every node at once. Passes on necessary
+    information to print_id function."""
+
+    id_list = []
+    for job_id in job_ids.split(','):
+        job_id = job_id.strip()
+        if not job_id:
+            continue
+        if not job_id.isdigit():
+            print('Error: {0} is not a job id.'.format(job_id))
+            show_usage(23)
+        if job_id not in id_list:
+            id_list.append(job_id)
+    if not id_list:
+        print('Error: No job id given.')
+        show_usage(20)
+
+    snapshot = get_snapshot()
+    pending_index = {}
+    for job in snapshot.get_pending():
+        pending_index[str(job.get_id())] = job
+
+    running = [] # (job id, [Job, ...]) of the running jobs, one Job per queue instance
+    pending = [] # Pending jobs
+    unknown = [] # job ids qstat does not know about
+    for job_id in id_list:
+        jobs = snapshot.get_jobs(job_id)
+        if jobs:
+            running.append((job_id, jobs))
+        elif job_id in pending_index:
+            pending.append(pending_index[job_id])
+        else:
+            unknown.append(job_id)
+
+    details = get_job_details()
+    details.want([job_id for job_id, jobs in running]) # every running job in one qstat -j call
+    node_names = []
+    for job_id, jobs in running:
+        for job in jobs:
+            if short_host(job.node.host) not in node_names:
+                node_names.append(short_host(job.node.host))
+    pages = fetch_xymon_pages(node_names) # every node's page at once
+
+    if OUTPUT_FORMAT != 'text':
+        for job_id, jobs in running:
+            for job in jobs:
+                emit('job', job_fields(job))
+            for host in dict.fromkeys(short_host(job.node.host) for job in jobs):
+                emit_processes(host, jobs[0].get_user(), pages[host])
+        for job in pending:
+            emit('pending', pending_fields(job))
+        for job_id in unknown:
+            emit('unknown_job', [('job_id', job_id)])
+    else:
+        print_id(running, pending, unknown, details, pages)
+    if unknown and not running and not pending:
+        sys.exit(28)
+    sys.exit(0)
+#^----------------------------------------------------------------------------- process_id(job_ids)
+
+def print_id(running, pending, unknown, details, pages):
+    """Prints the job information found by process_id: for each running job its owner, priority, slots, start
+    time and maximum memory, the queue instances it runs in and the processes of its owner on those nodes.
+    Pending jobs are printed with their qstat line and unknown ids are listed last."""
+
+    print("=".center(TERMWIDTH,"="))
+    print("=".ljust(TERMWIDTH - 1) + "=")
+    print("=" + "Job information".center(TERMWIDTH - 2) + "=")
+    print("=".ljust(TERMWIDTH - 1) + "=")
+    print("=".center(TERMWIDTH, '=') + "\n")
+
+    for job_id, jobs in running:
+        job = jobs[0]
+        job_detail = details.get(job_id)
+        slots = 0
+        for instance in jobs:
+            slots += int(instance.get_core_info())
+        print('Job ID: {0}'.format(job_id))
+        print(PRINT_INDENT + 'Job Name:'.ljust(15) + job.get_name())
+        print(PRINT_INDENT + 'Owner:'.ljust(15) + job.get_user())
+        print(PRINT_INDENT + 'Priority:'.ljust(15) + job.get_priority())
+        print(PRINT_INDENT + 'Slots:'.ljust(15) + str(slots))
+        print(PRINT_INDENT + 'Start Time:'.ljust(15) + job_detail.get('start_time', job.date))
+        print(PRINT_INDENT + 'Max Memory:'.ljust(15) + job_detail.get('maxvmem', 'NA'))
+        print(PRINT_INDENT + 'Queue Instance'.ljust(int(TERMWIDTH/2)) + 'Slots'.rjust(10))
+        for instance in jobs:
+            print(PRINT_INDENT + instance.node.get_name().ljust(int(TERMWIDTH/2)) + str(instance.get_core_info()).rjust(10))
+        print('-'.center(TERMWIDTH,"-"))
+        for cleanName in dict.fromkeys(short_host(instance.node.host) for instance in jobs): # each host once
+            print("{0}'s processes on {1}:".format(job.get_user(), cleanName))
+            if pages[cleanName] is None:
+                print("Process info unavailable: xymon did not answer for {0}.".format(cleanName))
+                continue
+            print('PID'.center(10, ' ') + 'ProcName'.center(20, ' ') + 'Memory Used'.center(20) + 'CPU%'.center(10) + 'TIME'.center(16))
+            for proc in get_user_processes(pages[cleanName], job.get_user())[0]:
+                print(proc['PID'].center(10) + proc['PNAME'].center(20) + proc['RESMEM'].center(20) + proc['CPU%'].center(10) + proc['TIME'].center(16))
+        print('')
+    print_degraded(pages)
+
+    if pending:
+        print('#'.center(TERMWIDTH, '#'))
+        print("Pending jobs:".center(TERMWIDTH))
+        print('#'.center(TERMWIDTH, '#'))
+        for job in pending:
+            print(job.get_line())
+        print('')
+    if unknown:
+        print('Job id(s) not known to the grid engine: {0}'.format(', '.join(unknown)))
+    return
+#^----------------------------------------------------------------------------- print_id(. . .)
 
 def find_queue_usersets(queue, user_list):
     """Searches through a queue with 'qconf -sq' to find all usersets which are allowed on the hostgroups
     that operate within the specified queue. Takes in the queue to be searched as a string. Returns a list
     of hostgroups from the specified queue which the user belongs to."""
 
-    sq = subprocess.getoutput("qconf -sq {0}".format(queue))
+    sq = qconf_output("qconf -sq {0}".format(queue))
     
     #splicing the sq output up to the user_list point, we don't need the rest of the garbarge before that
     sq = sq[sq.find('user_lists') + 9 :sq.find('xuser')]
@@ -461,9 +1774,9 @@ def find_queue_usersets(queue, user_list):
             #host-groups in sq output have '@', so that's what we're looking for
             hostg_list.append(line)
     for line in hostg_list:
-        for ul in user_list:
-            if ul in line:
-                host_user_list.append(line.split('=')[0])
+        hostgroup, _, lists = line.partition('=')
+        if set(user_list) & set(lists.rstrip(']').split(',')): # whole list names only
+            host_user_list.append(hostgroup)
     return host_user_list
 #^----------------------------------------------------------------------------- find_queue_usersets(user_name)
 
@@ -505,8 +1818,8 @@ def print_duser_host(host_list, user, ul):
             content += '\n{0}\n'.format(u)
     content += '-'.center(TERMWIDTH, '-') + '\n'
     
-    for host in host_list:
-        content += subprocess.getoutput('qconf -shgrp_tree ' + host ) + '\n'
+    for tree in qconf_outputs(['qconf -shgrp_tree ' + host for host in host_list]):
+        content += tree + '\n'
         
     print(header)
     print(content)
@@ -515,174 +1828,135 @@ def print_duser_host(host_list, user, ul):
    
 def show_hosts():
     """Function that displays all available hosts and exists. Best to be piped through a pager."""
-    valid_hosts = (subprocess.getoutput("qconf -shgrpl").split())
+    valid_hosts = (qconf_output("qconf -shgrpl").split())
     for host in valid_hosts:
-        print(host)
+        if OUTPUT_FORMAT != 'text':
+            emit('hostgroup', [('hostgroup', host)])
+        else:
+            print(host)
     sys.exit()
 #^----------------------------------------------------------------------------- show_hosts()
 
 def process_queue(host_user_list, user_name, user_list):
     """Process the long queue for the user who's environment this is running in. Accepts
-    the results from find_host_groups. Will run through process_host for every hostgroup
-    this user has access to through the long queue."""
-
-    total_nodes = 0
-    total_cores = 0
-    disabled_cores = 0
-    used_cores = 0
-    free_cores = 0
-    empty_nodes = 0
-    disabled_nodes = 0
- 
-    node_strings= []
+    the results from find_host_groups. Every hostgroup this user has access to through the long
+    queue is resolved up front, and the totals are summed over the union of their nodes so nodes
+    in overlapping hostgroups are only counted once."""
 
+    hostgroup_hosts = resolve_hostgroups(host_user_list)
+    queue_hosts = []
+    seen = set()
     for hostgroup in host_user_list:
-        # Obtain totals for one hostgroup, and contine a summation
-        tc, uc, tn, en, dc,dn, nl = process_host(hostgroup.replace('@',''))
-
-        # Do not want to recount same nodes. This needs to be looked at for efficiency.
-        nl_strings = [n.name for n in nl]
-
-        if nl_strings[0] in node_strings:
-            continue
-
-        # Sum to get totals for whole queue which user has access to
-        total_cores += tc 
-        used_cores += uc 
-        total_nodes += tn
-        empty_nodes += en
-        disabled_cores += dc
-        disabled_nodes += dn
-        node_strings= node_strings + nl
+        for host in hostgroup_hosts[hostgroup]:
+            if host not in seen:
+                seen.add(host)
+                queue_hosts.append(host)
 
     # Send totals to be printed to screen
-    print_host_info(total_cores, used_cores, total_nodes, empty_nodes, "Long Queue", disabled_cores, 
-                    disabled_nodes)
+    print_host_info(host_totals(queue_hosts), "Long Queue")
     sys.exit(0)
 #^----------------------------------------------------------------------------- process_queue(...)
 
+def resolve_hostgroups(hostgroup_list):
+    """Function to resolve the nodes of many hostgroups together. Each hostgroup (with or without the '@')
+    is only asked for once with 'qconf -shgrp_resolved', and the calls run concurrently. Returns a dictionary of hostgroup -> list of
+    host names, keyed by the hostgroups as they were given."""
+
+    names = []
+    for hostgroup in hostgroup_list:
+        name = '@' + hostgroup.lstrip('@')
+        if name not in names:
+            names.append(name)
+    outputs = qconf_outputs(["qconf -shgrp_resolved " + name for name in names])
+    resolved = {}
+    for name, output in zip(names, outputs):
+        resolved[name] = output.split()
+    hostgroup_hosts = {}
+    for hostgroup in hostgroup_list:
+        hostgroup_hosts[hostgroup] = resolved['@' + hostgroup.lstrip('@')]
+    return hostgroup_hosts
+#^----------------------------------------------------------------------------- resolve_hostgroups(hostgroup_list)
+
+def host_totals(host_list):
+    """Function to sum up the cores and nodes of a list of hosts from the NodeTable of the snapshot, using
+    the first queue instance of every host. Returns a HostTotals."""
+    table = get_snapshot().get_table()
+    return table.totals(table.host_rows_for(host_list))
+#^----------------------------------------------------------------------------- host_totals(host_list)
+
 def process_host(desired_host):
     """Processes the desired host whether thats long or any host group. Will gather info on
     all of that group's nodes and send them to the print_host_info() function."""
     
-    node_list = []
-    host_info_list = []    
     if desired_host == "all":
         desired_host_list = getAllMachines()
     else:
-        desired_host_list = (subprocess.getoutput("qconf -shgrp_resolved " + '@' + str(desired_host))).split()
-    qstat = subprocess.getoutput('qstat -f')
-    for host in desired_host_list:
-        if qstat.find(host) != (-1):
-            #Searches the long string for the index of the occurance of the specified host, then
-            #parses it the string for just that one line with the host that we want.
-            host_info_list.append((qstat[qstat.find(host):].split('\n'))[0])
-    #Start at with everything at 0, and will count up as encountered.
-    total_nodes = 0
-    total_cores = 0
-    disabled_cores = 0
-    used_cores = 0
-    free_cores = 0
-    empty_nodes = 0
-    disabled_nodes = 0
-    for host in host_info_list:
-        #simply gathering info qstat spat out for us
-        temp_node = Node((host.split()[0]))
-        cores = host.split()[2].replace('/', ' ').split()
-        host_used_cores = cores[1]
-        host_total_cores = cores[2]
-        if len(host.split()) == 6 and (host.split()[5] == 'd' or host.split()[5] == 'E' or \
-               host.split()[5] == 'au' or host.split()[5] == 'Eau' or host.split()[5] == 'Eqw' \
-               or host.split()[5] == 'adu'):
-            temp_node.set_disabled_switch(True)
-            disabled_cores += int(host_total_cores)
-            total_cores += int(host_total_cores)
-            disabled_nodes += 1
-        else:    
-            temp_node.set_disabled_switch(False)
-            used_cores += int(host_used_cores)
-            total_cores += int(host_total_cores)
-            free_cores += int(host_total_cores) - int(host_used_cores)
-            if int(host_used_cores) == 0:
-                empty_nodes += 1
-        temp_node.set_cores(host_total_cores, host_used_cores)
-        total_nodes += 1
-        node_list.append(temp_node)        
+        desired_host_list = resolve_hostgroups([desired_host])[desired_host]
+    if OUTPUT_FORMAT != 'text':
+        emit_host(desired_host, desired_host_list)
+        return
+    table = get_snapshot().get_table()
+    rows = table.host_rows_for(desired_host_list)
+    totals = table.totals(rows)
     
     if len(sys.argv) == 3:
         if sys.argv[2] == '--details':
-            print_detailed_host(total_cores, used_cores, total_nodes, empty_nodes, desired_host, 
-                                disabled_cores, disabled_nodes, node_list)
+            print_detailed_host(totals, desired_host, table.nodes(rows))
         elif sys.argv[2] == '-v' or sys.argv[2] == '--visual':
-            draw_queue(total_nodes, total_cores, used_cores, empty_nodes, desired_host, disabled_cores, 
-                       disabled_nodes, node_list, free_cores)
+            draw_queue(totals, desired_host, table.nodes(rows))
         else:
             print('Error: Arg syntax error with: ' + sys.argv[2])
             show_usage(23)
-    elif sys.argv[1] == "-qlong":
-        # Returning values from this host group to the qlong function
-        return(total_cores, used_cores, total_nodes, empty_nodes, disabled_cores,disabled_nodes, node_list)
     elif len(sys.argv) < 3:
-        print_host_info(total_cores, used_cores, total_nodes, empty_nodes, desired_host, disabled_cores, 
-                        disabled_nodes)
+        print_host_info(totals, desired_host)
     else:
         print('Error: Too many args')
         show_usage(23)
     return
 #^----------------------------------------------------------------------------- process_host(desired_host)    
 
+def emit_host(desired_host, desired_host_list):
+    """Writes the records of a hostgroup for --format. With --details or -v every node (the first queue
+    instance of each host) is written while qstat is still being read, and the host_summary comes last."""
+
+    if len(sys.argv) > 3 or (len(sys.argv) == 3 and sys.argv[2] not in ('--details', '-v', '--visual')):
+        print('Error: Arg syntax error with: ' + ' '.join(sys.argv[2:]))
+        show_usage(23)
+    if len(sys.argv) == 3:
+        hosts = set(desired_host_list) | set(short_host(host) for host in desired_host_list)
+        seen = set()
+        for node in stream_snapshot():
+            if node.host not in seen and (node.host in hosts or short_host(node.host) in hosts):
+                seen.add(node.host)
+                emit('node', [('hostgroup', desired_host)] + node_fields(node))
+    table = get_snapshot().get_table()
+    emit('host_summary', totals_fields('hostgroup', desired_host, table.totals(table.host_rows_for(desired_host_list))))
+    return
+#^----------------------------------------------------------------------------- emit_host(desired_host, desired_host_list)
+
 def show_efficiency():
     """Function to find and show machines with low efficiency. Low efficiency is described as
     a machine where all or most of the cores are being used by UGE (not ocndor) jobs, but the CPU usage is very
-    low."""
+    low. qhost runs once for the whole cluster while the snapshot is read, and its load map is joined with the
+    queue instances of the snapshot by exact host name, so no command is run per node or per job."""
 
-    machineList = getAllMachines() # obtaining all nodes from UGE into a list.
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        qhost = pool.submit(command_output, 'qhost', 'load') # qhost and qstat run at the same time
+        snapshot = get_snapshot()
+        load_map = parse_qhost(qhost.result())
 
-    macString = machineList[0].replace('.crc.nd.edu','') # priming the machine list.
-    for mac in machineList[1:]: # Going through all but the first machine in machineList
-        mac = mac.replace('.crc.nd.edu','')
-        macString += ("," + mac) # Making the string comma separated
-    qh = subprocess.getoutput('qhost -h {0}'.format(macString))
-
-    qstat = subprocess.getoutput('qstat -f').split('-'.center(81, '-')) #81 -'s, grabbing results of qstat to wade through
-    pending_search = '#'.center(79, '#') #denotes pending jobs in qstat 79 #'s
-
-    lowEffNodes = []
-    for node in qh.split('\n')[3:]: # Skipping lines that aren't nodes
-        ns = node.split()
-        if len(ns) < 7:
-            continue # Skipping if it's a mistake
-        if ns[6] != '-' and float(ns[6]) < LOWTHRESHOLD : # Not including machines that are turned off
-            #lowUsageNodes.append({'NAME': ns[0], "LOAD": ns[6]}) #appending the string name of the nodes with low CPU usage
-            for nd in qstat:
-                if ns[0] in nd: # ns[0] == name of node
-                    if pending_search in nd: #Taking pending jobs out
-                        if ".crc.nd.edu" in nd:
-                            # Reap out the node text before the pending search and keep it as a node, ditch the rest of pending jobs
-                            continue
-                        else:
-                            # ignore it
-                            continue
-                    cores = nd.split()[2][nd.split()[2].find('/')+1:]
-                    usedCores = cores[:cores.find('/')]
-                    totalCores = cores[cores.find('/')+1:]
-                    if usedCores != totalCores:
-                        continue
-                    else:
-                        splitNode = nd.lstrip().split('\n') # We want one more value than there really is for the for loop to work easily
-                        tempNode = Node(splitNode[0].split()[0].replace('long@','').replace('gpu-debug@','')\
-                                .replace('debug@','').replace('gpu@','').replace('.crc.nd.edu',''),
-                                totalCores,usedCores, False) # Creating node for this low efficiency node
-                        tempNode.set_load(ns[6])
-                        num_jobs = len(splitNode) -1
-                        for x in range(1, num_jobs):
-                            jobSplit = splitNode[x].split() # splitting the job itself into a list to easily grab what we need
-                            tempJob = Job(jobSplit[2], jobSplit[3], jobSplit[7]) # Creating a Job to be added.
-                            tempJob.set_id(jobSplit[0])
-                            tempNode.add_job(tempJob) # appending this job to the node's jobList
-
-                        lowEffNodes.append(tempNode) # adding the tempNode to the final list of low_efficiency nodes
+    lowEffNodes = find_low_efficiency(snapshot, load_map)
 
+    if OUTPUT_FORMAT != 'text':
+        for node, load in lowEffNodes:
+            emit('low_efficiency', [('host', short_host(node.host)), ('queue_instance', node.get_name()),
+                                    ('load', parse_load(load)), ('used_cores', node.get_used()),
+                                    ('total_cores', node.get_total()), ('jobs', node.num_jobs)])
+            for job in node.get_job_list():
+                emit('job', [('job_id', str(job.get_id())), ('name', job.get_name()), ('user', job.get_user()),
+                             ('cores', int(job.get_core_info())), ('queue_instance', node.get_name()),
+                             ('host', node.host)])
+        sys.exit(0)
 
     # Printing the header
     print("=".center(80,'='))
@@ -694,107 +1968,123 @@ def show_efficiency():
     print("    " + "Job ID".ljust(15,' ') + "User".ljust(15,' ') + "Job Name\n")
 
     # Printing the nodes along with the jobs on those nodes
-    for node in lowEffNodes:
+    for node, load in lowEffNodes:
         if node.num_jobs >= 1:
-            print(node.name.ljust(15,' ') +  node.load.center(15, " "))
+            print(short_host(node.host).ljust(15,' ') +  load.center(15, " "))
             for job in node.get_job_list():
                 print("    " + job.id.ljust(15,' ') + job.user.ljust(15, ' ') + job.name)
         print('-'.center(40,'-'))
 
-    #print(qh.split('\n')[2:])
-
     sys.exit(0)
 #^---------------------------------------------------------------------------- show_efficiency(...)
 
+def find_low_efficiency(snapshot, load_map):
+    """Function to join the qhost load map (see parse_qhost) with the queue instances of snapshot. Returns a
+    list of (Node, load string) of every full queue instance on a node whose load is below LOWTHRESHOLD."""
+
+    lowEffNodes = []
+    for host, load in load_map.items():
+        value = parse_load(load)
+        if math.isnan(value) or value >= LOWTHRESHOLD: # Not including machines that are turned off or without a load
+            continue
+        for nd in snapshot.short_index.get(host, []): # every queue instance on the node
+            if nd.get_used() != nd.get_total():
+                continue
+            lowEffNodes.append((nd, load)) # keeping the qhost load along with the queue instance
+    return lowEffNodes
+#^----------------------------------------------------------------------------- find_low_efficiency(snapshot, load_map)
+
+def run_commands(command_list, phase):
+    """Function to run many independent commands at the same time, at most QCONF_WORKERS at once, so the
+    whole list takes about as long as the slowest command. Each command is run with run_command under phase.
+    Returns the (exit status, output) of each command in the order of command_list."""
+
+    if len(command_list) < 2:
+        return [run_command(command, phase) for command in command_list]
+    with ThreadPoolExecutor(max_workers=min(QCONF_WORKERS, len(command_list))) as pool:
+        return list(pool.map(lambda command: run_command(command, phase), command_list))
+#^----------------------------------------------------------------------------- run_commands(command_list, phase)
+
 def getAllMachines():
     """Function to get all of the machines UGE can find and return a list of them as strings.
     This takes into account duplicate machines. Will not count machines counted in previous HG's.
+    The 'qconf -shgrp_tree' of every hostgroup runs concurrently and the nodes are merged into a set.
     Returns: List of strings."""
 
-    validHosts = (subprocess.getoutput("qconf -shgrpl").split())
-    machineList = []
-    processedHGList = []
-    readNodes = False
-    for host in validHosts:
-        hostMachineList = ((subprocess.getoutput("qconf -shgrp_tree " + str(host))).split())
-        for element in hostMachineList:
+    validHosts = (qconf_output("qconf -shgrpl").split())
+    machineSet = set()
+    for hostTree in qconf_outputs(["qconf -shgrp_tree " + str(host) for host in validHosts]):
+        for element in hostTree.split():
             if '@' not in element: # If it is not a HG name
-                if element not in machineList:
-                    machineList.append(element) # Searching whole list for this node
-    machineList.sort()
-    return machineList
+                machineSet.add(element)
+    return sorted(machineSet)
 #^----------------------------------------------------------------------------- getAllMachines()
 
-def draw_queue(total_nodes, total_cores, used_cores, empty_nodes, desired_host, 
-                disabled_cores, disabled_nodes, node_list, free_cores):
-    """Method to draw the queue on the screen. Will use '[]' to represent a core.
+def draw_queue(totals, desired_host, node_list):
+    """Method to draw the queue on the screen. Will use '[]' to represent a core, as many to a row as
+    the terminal is wide. Hostgroups of more than VISUAL_CORE_LIMIT cores are drawn with one character per
+    node instead, shaded by how many of its cores are used (see VISUAL_SHADES). The whole drawing is built
+    in memory and written at once. totals is the HostTotals of node_list.
     Returns: Nothing, draws to stdout."""
     
-    if total_cores > 400:
-        screen_size = 119
-        cores_per_row = 39
-    else:
-        screen_size = 100
-        cores_per_row = 30
-    
+    screen_size = max(shutil.get_terminal_size((100, 24)).columns - 1, 40)
+    half = int(screen_size/2)
     o_core = '[O]'
     u_core = '[~]'
     dis_core = '[#]'
-    print('{0} Queue'.format(str(desired_host)).center(screen_size))
-    print('-'.center(screen_size,'-'))
-    print('Total Cores:'.ljust(int(screen_size/2)), end="")
-    print('{0}'.format(str(total_cores)).ljust(int(screen_size/2)))
-    print('Used Cores:'.ljust(int(screen_size/2)), end="")
-    print('{0}'.format(str(used_cores)).ljust(int(screen_size/2)))
-    print('Free Cores:'.ljust(int(screen_size/2)), end="")
-    print('{0}'.format(str(free_cores)).ljust(int(screen_size/2)))
-    print('Disabled/Error Cores:'.ljust(int(screen_size/2)), end="")
-    print('{0}'.format(str(disabled_cores)).ljust(int(screen_size/2)))
-    print('Total Nodes:'.ljust(int(screen_size/2)),end ="")
-    print('{0}'.format(str(total_nodes)).ljust(int(screen_size/2)))
-    print('-'.center(screen_size, '-'))
-    print(('[0] = Open Core' + PRINT_INDENT + '[~] = Used Core' + PRINT_INDENT + \
-           '[#] = Disabled/Err Core').center(screen_size) + '\n')
-    
-    #Drawing representation of the Queue
-    drawn_cores = 0
-    for node in node_list:
-        if node.get_disabled_switch():
-            for i in range(1, node.total_cores +1):
-                print(dis_core, end="")
-                drawn_cores += 1
-                if drawn_cores == cores_per_row:
-                    drawn_cores = 0
-                    print('')
-            continue
-        if node.get_free():
-            for i in range(1, (node.free_cores) +1):
-                print(o_core, end="")
-                drawn_cores += 1
-                if drawn_cores == cores_per_row:
-                    drawn_cores = 0
-                    print('')
-        if node.get_used():
-            for i in range(1, (node.used_cores) +1):
-                print(u_core, end="")
-                drawn_cores += 1
-                if drawn_cores == cores_per_row:
-                    drawn_cores = 0
-                    print('')
-    print('\n' + '-'.center(screen_size,'-'))
+    lines = ['{0} Queue'.format(str(desired_host)).center(screen_size), '-'.center(screen_size,'-'),
+             'Total Cores:'.ljust(half) + '{0}'.format(str(totals.total_cores)).ljust(half),
+             'Used Cores:'.ljust(half) + '{0}'.format(str(totals.used_cores)).ljust(half),
+             'Free Cores:'.ljust(half) + '{0}'.format(str(totals.free_cores)).ljust(half),
+             'Disabled/Error Cores:'.ljust(half) + '{0}'.format(str(totals.disabled_cores)).ljust(half),
+             'Total Nodes:'.ljust(half) + '{0}'.format(str(totals.total_nodes)).ljust(half),
+             '-'.center(screen_size, '-')]
+
+    if totals.total_cores > VISUAL_CORE_LIMIT:
+        lines.append(('One character per node: ' + '  '.join('{0} = {1}'.format(shade, meaning) for shade, meaning in
+                      zip(VISUAL_SHADES, ('Empty', '<1/3 Used', '<2/3 Used', 'Mostly Used', 'Full', 'Disabled/Err'))))
+                     .center(screen_size) + '\n')
+        cells = []
+        for node in node_list:
+            if node.get_disabled_switch():
+                cells.append(VISUAL_SHADES[5])
+            elif not node.get_total(): # unknown or misreported host, drawn as empty
+                cells.append(VISUAL_SHADES[0])
+            elif node.get_used() >= node.get_total():
+                cells.append(VISUAL_SHADES[4])
+            else:
+                cells.append(VISUAL_SHADES[min(3, int(3 * node.get_used() / node.get_total()) + 1) if node.get_used() else 0])
+        cells = ''.join(cells)
+        per_row = screen_size
+    else:
+        lines.append(('[0] = Open Core' + PRINT_INDENT + '[~] = Used Core' + PRINT_INDENT + \
+                      '[#] = Disabled/Err Core').center(screen_size) + '\n')
+        #Drawing representation of the Queue
+        cells = []
+        for node in node_list:
+            if node.get_disabled_switch():
+                cells.append(dis_core * node.total_cores)
+                continue
+            cells.append(o_core * node.free_cores + u_core * node.used_cores)
+        cells = ''.join(cells)
+        per_row = int(screen_size / len(o_core)) * len(o_core)
+    for row in range(0, len(cells), per_row):
+        lines.append(cells[row:row + per_row])
+    lines.append('-'.center(screen_size,'-'))
+    sys.stdout.write('\n'.join(lines) + '\n')
     return
 #^----------------------------------------------------------------------------- draw_queues(. . .)
 
-def print_detailed_host(total_cores, used_cores, total_nodes, empty_nodes, desired_host, 
-                        disabled_cores, disabled_nodes, node_list):
-    """Prints detailed version of the designated host. Will print every node along with the totals.
+def print_detailed_host(totals, desired_host, node_list):
+    """Prints detailed version of the designated host. Will print every node along with the totals,
+    totals being the HostTotals of node_list.
     Return: Nothing, writes to stdout."""
     
     print('\nDetailed info pertaining to: ' + desired_host)
     print('Total Nodes: {0}'.format(str(len(node_list)))) 
-    print('Total Cores : {0}'.format(total_cores) + PRINT_INDENT + 'Used Cores: {0}'.format(used_cores)
-          + PRINT_INDENT + 'Free Cores: {0}'.format(str(total_cores - used_cores - disabled_cores)) 
-          + PRINT_INDENT + 'Disabled Cores: {0}'.format(disabled_cores))
+    print('Total Cores : {0}'.format(totals.total_cores) + PRINT_INDENT + 'Used Cores: {0}'.format(totals.used_cores)
+          + PRINT_INDENT + 'Free Cores: {0}'.format(str(totals.total_cores - totals.used_cores - totals.disabled_cores)) 
+          + PRINT_INDENT + 'Disabled Cores: {0}'.format(totals.disabled_cores))
     print('\nThe following is a list of each node within {0}:\n'.format(desired_host))
     print('Node name'.ljust(int(TERMWIDTH/2)) + 'Used Cores/Total Cores')
     for node in node_list:
@@ -803,122 +2093,162 @@ def print_detailed_host(total_cores, used_cores, total_nodes, empty_nodes, desir
             disabled = 'Unavailable'
         else:
             disabled = ''
-        print((PRINT_INDENT + node.get_name()).ljust(int(TERMWIDTH/2)) + PRINT_INDENT + (str(cores).rjust(5,' ') \
+        print((PRINT_INDENT + node.host).ljust(int(TERMWIDTH/2)) + PRINT_INDENT + (str(cores).rjust(5,' ') \
         + PRINT_INDENT + disabled))
     return
 #^----------------------------------------------------------------------------- print_detailed_host(. . .)
     
-def print_host_info(total_cores, used_cores, total_nodes, empty_nodes, desired_host, 
-                    disabled_cores, disabled_nodes):
-    """Prints the information from the process_host function in a pretty* format"""
+def print_host_info(totals, desired_host):
+    """Prints the HostTotals from the process_host function in a pretty* format"""
     
+    if OUTPUT_FORMAT != 'text':
+        emit('host_summary', totals_fields('hostgroup', desired_host, totals))
+        return
     print(str(desired_host).ljust(TERMWIDTH))
     print('-'.center(60, '-'))
-    print('Total Cores:'.ljust(int(TERMWIDTH/2)) + str(total_cores).ljust(int(TERMWIDTH/2)))
-    print('Used Cores:'.ljust(int(TERMWIDTH/2)) + str(used_cores).ljust(int(TERMWIDTH/2)))
-    print('Free Cores:'.ljust(int(TERMWIDTH/2)) + str(total_cores - used_cores - disabled_cores).ljust(int(TERMWIDTH/2)))
-    print('Disabled/Error Cores:'.ljust(int(TERMWIDTH/2)) + str(disabled_cores).ljust(int(TERMWIDTH/2)))
+    print('Total Cores:'.ljust(int(TERMWIDTH/2)) + str(totals.total_cores).ljust(int(TERMWIDTH/2)))
+    print('Used Cores:'.ljust(int(TERMWIDTH/2)) + str(totals.used_cores).ljust(int(TERMWIDTH/2)))
+    print('Free Cores:'.ljust(int(TERMWIDTH/2)) + str(totals.total_cores - totals.used_cores - totals.disabled_cores).ljust(int(TERMWIDTH/2)))
+    print('Disabled/Error Cores:'.ljust(int(TERMWIDTH/2)) + str(totals.disabled_cores).ljust(int(TERMWIDTH/2)))
     print("")
-    print('Total Nodes:'.ljust(int(TERMWIDTH/2)) + str(total_nodes).ljust(int(TERMWIDTH/2)))
-    print('Used Nodes:'.ljust(int(TERMWIDTH/2)) + str(total_nodes - empty_nodes - disabled_nodes).ljust(int(TERMWIDTH/2)))
-    print('Disabled/Error Nodes:'.ljust(int(TERMWIDTH/2)) + str(disabled_nodes).ljust(int(TERMWIDTH/2)))
-    print('Empty Nodes:'.ljust(int(TERMWIDTH/2)) + str(empty_nodes).ljust(int(TERMWIDTH/2)))
+    print('Total Nodes:'.ljust(int(TERMWIDTH/2)) + str(totals.total_nodes).ljust(int(TERMWIDTH/2)))
+    print('Used Nodes:'.ljust(int(TERMWIDTH/2)) + str(totals.get_used_nodes()).ljust(int(TERMWIDTH/2)))
+    print('Disabled/Error Nodes:'.ljust(int(TERMWIDTH/2)) + str(totals.disabled_nodes).ljust(int(TERMWIDTH/2)))
+    print('Empty Nodes:'.ljust(int(TERMWIDTH/2)) + str(totals.empty_nodes).ljust(int(TERMWIDTH/2)))
     return
 #^----------------------------------------------------------------------------- print_host_info(. . .)
 
-def process_user(user_name):
-    """Function to process the username given after -u option. Will find information pertaining to the specified
-    user and send them to the printing function."""
-    
-    try:
-        user_pwd = getpwnam(user_name)
-    except KeyError:
-        print('Error: User {0} is not recognized.'.format(user_name))
-        sys.exit(25)
-    
-    qstat = subprocess.getoutput("qstat -f").split('-'.center(81, '-')) #81 -'s
-    
-    node_list = []
-    pending_jobs = ''
-    pending_search = '#'.center(79, '#') #denotes pending jobs in qstat 79 #'s
-    #Weeding out nonessential nodes
-    for node in qstat:
-        if user_name in (node.split()):
-            if pending_search in node: #Taking pending jobs out
-                if ".crc.nd.edu" in node:
-                    # This means its the last node. We must only accept up tp the pending jobs ONLY. Below we are doing that and taking out an
-                    # Additional newline by stripping it but adding one back in to keep formatting correct. (there were two instead of one).
-                    tempNode = (node[:node.find(pending_search)].rstrip())+'\n'
-                    if user_name in tempNode:
-                        node_list.append(tempNode)
-                pending_jobs += (node[node.find(pending_search):]) #reaping pending jobs
-            else:
-                node_list.append(node)
-    
-    final_list = []
-        
-    numU_jobs = 0 # Will hold the number of jobs attributed to the specified user
-    numU_cores = 0 # The number of cores the user is currently using. Starts at 0 and counts up as jobs encountered.
-    
-    for host in node_list:
-        # Grabbing the node's name in qstat and making a Node() instance of it
-        temp_node = Node((host.split()[0]))
-        host_used_cores = host.split()[2].split('/')[1]
-        host_total_cores = host.split()[2].split('/')[2]
-        # If within the first line of the node there is a 'd' at the end, disable it
-        if len(host.split('\n')[0]) == 6 and host.split()[5] == 'd':
-            temp_node.set_disabled_switch(True)
-            disabled_cores += int(host_total_cores)
-        else:    
-            temp_node.set_disabled_switch(False)
-            
-        temp_node.set_cores(host_total_cores, host_used_cores)
-        # In qstat -F, qf:min_cpu . . . . is the last item before the jobs are listed, 
-        # 28 is how many char's that string is (don't want it)
-        node_stat= host[host.find('qf:min_cpu_interval=00:05:00') + 28\
-                             :host.find('\n---------------------------------------------------------------------------------\n')]
-        """Possibly do a host.split('\n') and join the rest of 2 - end"""
-
-        # There is always an extra '\n' in here, so subtract 1 to get rid of it
-        num_jobs = len(node_stat.split('\n')) -1
-        # If there are any jobs, parse them and gather info
-        if num_jobs > 0:
-            # Python is non-inclusive for the right operand, and we want to 
-            # skip another extra '\n' so start at 1, and want to go num_jobs
-            for i in range(1, num_jobs + 1):
-                info = node_stat.split('\n')[i].split()
-                temp_job = Job(info[2], info[3], info[7])
-                temp_job.set_id(info[0])
-                temp_job.set_priority(info[1])
-                temp_node.add_job(temp_job)
-                if info[3] == user_name:
-                    numU_jobs += 1 #info[3] is the user-name of job, if == spec. user, increment user_jobs
-                    numU_cores += int(info[7]) # info[7] is the number of cores occupied by the user's job
-        
-        final_list.append(temp_node)
-    
-    pending_list = []
-    if len(pending_jobs): #As long as the user has pending jobs T if len != 0
-        p_lines = pending_jobs.split('\n')
-        pending_list.append((p_lines[0] + '\n' + p_lines[1] + '\n' + p_lines[2] + '\n'))
-        for i in range(3, len(p_lines)):
-            if p_lines[i].find(user_name) != (-1):
-                pending_list.append(p_lines[i])
-         
-    if len(sys.argv) == 4:
-        if sys.argv[3] == '--details':
-            print_detailed_user(final_list, pending_list, user_name, numU_jobs, numU_cores)
+def process_user(user_names):
+    """Function to process the username(s) given after -u option: one user, several separated by commas, or
+    '*' for everyone with running or pending jobs. Will find information pertaining to every user from the
+    one snapshot, fetch the qstat -j details and xymon pages of all of them at once, and send each user
+    to the printing function. More than one user ends with a table of every user's totals."""
+    
+    if len(sys.argv) == 4 and sys.argv[3] != '--details':
+        print('Error: Arg syntax error with: ' + sys.argv[3])
+        show_usage(23)
+    details = len(sys.argv) == 4
+    snapshot = get_snapshot()
+    user_list = select_users(user_names, snapshot)
+
+    # Details are printed for the users' jobs only, fetched with one qstat -j when first needed.
+    for user_name in user_list:
+        get_job_details().want([job.get_id() for job in snapshot.get_owner_jobs(user_name)])
+    pages = None
+    if len(user_list) > 1: # every node's page once, even if several of the users run on it
+        pages = fetch_xymon_pages([short_host(node.host) for user_name in user_list
+                                   for node in snapshot.get_owner_nodes(user_name)])
+
+    user_totals = []
+    for user_name in user_list:
+        # Only the queue instances which hold at least one of this user's jobs
+        final_list = snapshot.get_owner_nodes(user_name)
+
+        numU_jobs = 0 # Will hold the number of jobs attributed to the specified user
+        numU_cores = 0 # The number of cores the user is currently using. Starts at 0 and counts up as jobs encountered.
+        for job in snapshot.get_owner_jobs(user_name):
+            numU_jobs += 1
+            numU_cores += int(job.get_core_info())
+
+        pending_list = []
+        user_pend = snapshot.get_pending(user_name)
+        if len(user_pend): #As long as the user has pending jobs T if len != 0
+            pending_list.append(PENDING_MARKER + '\n' + ' - PENDING JOBS'*5 + '\n' + PENDING_MARKER + '\n')
+            for job in user_pend:
+                pending_list.append(job.get_line())
+        user_totals.append((user_name, numU_jobs, numU_cores, len(final_list), len(user_pend)))
+
+        if OUTPUT_FORMAT != 'text':
+            emit_user(final_list, user_pend, user_name, numU_jobs, numU_cores, details, pages)
+        elif details:
+            print_detailed_user(final_list, pending_list, user_name, numU_jobs, numU_cores, pages)
         else:
-            print('Error: Arg syntax error with: ' + sys.argv[3])
-            show_usage(23)
-    else:
-        print_short_user(final_list, pending_list, user_name, numU_jobs, numU_cores)
-#^----------------------------------------------------------------------------- process_user(user_name)
+            print_short_user(final_list, pending_list, user_name, numU_jobs, numU_cores, pages)
+    if len(user_list) > 1 and OUTPUT_FORMAT == 'text':
+        print_users_summary(user_totals)
+    sys.exit()
+#^----------------------------------------------------------------------------- process_user(user_names)
+
+def select_users(user_names, snapshot):
+    """Function to turn the argument of -u into a list of user names. '*' gives every user with running or
+    pending jobs in snapshot, sorted, otherwise the comma separated names are checked against /etc/passwd
+    and the program exits with 25 on the first one which is not a user."""
+
+    if user_names == '*':
+        user_list = set(snapshot.owner_index)
+        user_list.update(job.get_user() for job in snapshot.get_pending())
+        return sorted(user_list)
+    user_list = []
+    for user_name in user_names.split(','):
+        user_name = user_name.strip()
+        if not user_name or user_name in user_list:
+            continue
+        try:
+            user_pwd = getpwnam(user_name)
+        except KeyError:
+            print('Error: User {0} is not recognized.'.format(user_name))
+            sys.exit(25)
+        user_list.append(user_name)
+    if not user_list:
+        print("Error: Missing user-name.")
+        show_usage(24)
+    return user_list
+#^----------------------------------------------------------------------------- select_users(user_names, snapshot)
+
+def user_pages(node_list, pages):
+    """Function to obtain the xymon pages of the nodes in node_list: taken from pages when they were already
+    fetched for several users, fetched now otherwise. Returns a dictionary of node -> page (None if degraded)."""
+    nodes = [short_host(node.host) for node in node_list]
+    if pages is None:
+        return fetch_xymon_pages(nodes) # every node's page at once
+    return dict((node, pages[node]) for node in nodes)
+#^----------------------------------------------------------------------------- user_pages(node_list, pages)
+
+def print_users_summary(user_totals):
+    """Prints one line per user of -u with several users: running jobs, cores, nodes and pending jobs.
+    user_totals is a list of (user, jobs, cores, nodes, pending jobs)."""
+
+    print('='.center(TERMWIDTH, '='))
+    print('User'.ljust(20) + 'Running Jobs'.rjust(15) + 'Cores'.rjust(10) + 'Nodes'.rjust(10) + 'Pending Jobs'.rjust(15))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    for user_name, user_jobs, num_cores, num_nodes, num_pending in user_totals:
+        print(user_name[:19].ljust(20) + str(user_jobs).rjust(15) + str(num_cores).rjust(10) + str(num_nodes).rjust(10)
+              + str(num_pending).rjust(15))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    print('Total'.ljust(20) + str(sum(row[1] for row in user_totals)).rjust(15)
+          + str(sum(row[2] for row in user_totals)).rjust(10) + ''.rjust(10) + str(sum(row[4] for row in user_totals)).rjust(15))
+    return
+#^----------------------------------------------------------------------------- print_users_summary(user_totals)
+
+def emit_user(node_list, user_pend, user_name, user_jobs, num_cores, details, pages=None):
+    """Writes the records of -u for --format: the user's summary, every queue instance the user runs on with
+    the user's memory there (from xymon), the user's jobs and pending jobs, and with details every process."""
+
+    emit('user_summary', [('user', user_name), ('running_jobs', user_jobs), ('cores', num_cores),
+                          ('pending_jobs', len(user_pend))])
+    pages = user_pages(node_list, pages)
+    for node in node_list:
+        page = pages[short_host(node.host)]
+        memory = None
+        if page is not None:
+            memory = 0
+            for mem in get_user_processes(page, user_name)[1]:
+                memory += int(mem)
+        emit('node', node_fields(node) + [('user', user_name), ('user_memory_kb', memory)])
+        for job in node.get_job_list():
+            if job.get_user() == user_name:
+                emit('job', job_fields(job))
+        if details or page is None:
+            emit_processes(short_host(node.host), user_name, page if details else None)
+    for job in user_pend:
+        emit('pending', pending_fields(job))
+    return
+#^----------------------------------------------------------------------------- emit_user(. . .)
  
-def print_detailed_user(node_list, pending_list, user_name, user_jobs, num_cores):
+def print_detailed_user(node_list, pending_list, user_name, user_jobs, num_cores, pages=None):
     """Prints detailed version, as in all of the nodes the specified user's jobs are in along with the 
     processes spawned that are owned by the specified user. Will also print all of user's pending jobs(if any).
-    Upon completion, will exit."""
+    pages are the xymon pages if they were already fetched (see user_pages)."""
     
     user_pend = []
     if len(pending_list):    
@@ -933,34 +2263,12 @@ def print_detailed_user(node_list, pending_list, user_name, user_jobs, num_cores
     print("=".center(TERMWIDTH, '=') + "\n")
 
     print("{0}'s total number of running jobs on UGE: {1}\n".format(user_name, user_jobs))
-    # Getting every process of the user to print
+    # Getting every process of the user to print, every node's page is fetched at once
+    pages = user_pages(node_list, pages)
     for node in node_list:
-        user_proc_list = []
-        cleanName = str(node).replace('long@','').replace('debug@','').replace('.crc.nd.edu','').replace('gpu@','').replace('gpu-debug@','')
-        full_page = urllib.request.urlopen("https://mon.crc.nd.edu/xymon-cgi/svcstatus.sh?HOST={0}.crc.nd.edu&SERVICE=cpu".format(cleanName))
-        mybytes = full_page.read() # getting all html into a byte-list
-        pageStr = mybytes.decode("utf8") # Now the html is in a string
-        full_page.close()
-        del mybytes #releasing these
-        del full_page
-        # Each line below will be a line in Top for processes
-        userNodeMem = [] # List to hold the different amounts of memory a user is using on this node!
-        for line in pageStr.split('\n'):
-            if user_name in line:
-                lineSplit = line.split()
-                memCheck = lineSplit[5] # used to check quality of memory string (check for m's, t's, or g's)
-                tmp_user_list = {}
-                lineSplit = line.split()
-                tmp_user_list["PID"] = lineSplit[0]
-                tmp_user_list["RESMEM"] = cleanMem(memCheck)
-                tmp_user_list["CPU%"] = lineSplit[8]
-                tmp_user_list["TIME"] = lineSplit[10]
-                tmp_user_list["PNAME"] = lineSplit[11]
-                user_proc_list.append(tmp_user_list)
-                if ('t' in memCheck)  or ('g' in memCheck) or ('m' in memCheck): # this is what contains the amount of resident memory
-                    userNodeMem.append(toKB(memCheck))
-                else:
-                    userNodeMem.append(memCheck) # we want it in KB to add up after finished running through node
+        cleanName = short_host(node.host)
+        pageStr = pages[cleanName] or '' # None when xymon did not answer for this node
+        user_proc_list, userNodeMem = get_user_processes(pageStr, user_name)
 
 
         # Printing process information that pertains to the current user only.
@@ -969,13 +2277,17 @@ def print_detailed_user(node_list, pending_list, user_name, user_jobs, num_cores
         print('PID'.center(10, ' ') + 'ProcName'.center(20, ' ') + 'Memory Used'.center(20) + 'CPU%'.center(10) + 'TIME'.center(16))
         for proc in user_proc_list:
             print(proc['PID'].center(10) + proc['PNAME'].center(20) + proc['RESMEM'].center(20) + proc['CPU%'].center(10) + proc['TIME'].center(16))
-        userTotalMem = 0
-        for mem in userNodeMem:
-            userTotalMem += int(mem)  
-        print("User's total memory usage on Node: {0}".format(cleanMem(str(userTotalMem))))
-        print("Total number of processes owned by user on Node: {0}".format(str(len(user_proc_list))))
+        if pages[cleanName] is None:
+            print("Process info unavailable: xymon did not answer for {0}.".format(cleanName))
+        else:
+            userTotalMem = 0
+            for mem in userNodeMem:
+                userTotalMem += int(mem)  
+            print("User's total memory usage on Node: {0}".format(cleanMem(str(userTotalMem))))
+            print("Total number of processes owned by user on Node: {0}".format(str(len(user_proc_list))))
                 
         print('') # Simple newline
+    print_degraded(pages)
 
     if len(user_pend):
         print('\n' + '#'.center(TERMWIDTH, '#'))
@@ -983,9 +2295,35 @@ def print_detailed_user(node_list, pending_list, user_name, user_jobs, num_cores
         print('#'.center(TERMWIDTH, '#'))
         for job in user_pend:
             print(job)
-    sys.exit()
+    return
 #^----------------------------------------------------------------------------- print_detailed_user(. . .)
 
+def get_user_processes(pageStr, user_name):
+    """Function to pick the processes of a user out of the top listing of a node's xymon page.
+    Returns: (list of process dictionaries with PID, RESMEM, CPU%, TIME and PNAME keys,
+              list of the resident memory of each process in KB)."""
+
+    user_proc_list = []
+    userNodeMem = [] # List to hold the different amounts of memory a user is using on this node!
+    # Each line below will be a line in Top for processes
+    for line in pageStr.split('\n'):
+        if user_name in line:
+            lineSplit = line.split()
+            memCheck = lineSplit[5] # used to check quality of memory string (check for m's, t's, or g's)
+            tmp_user_list = {}
+            tmp_user_list["PID"] = lineSplit[0]
+            tmp_user_list["RESMEM"] = cleanMem(memCheck)
+            tmp_user_list["CPU%"] = lineSplit[8]
+            tmp_user_list["TIME"] = lineSplit[10]
+            tmp_user_list["PNAME"] = lineSplit[11]
+            user_proc_list.append(tmp_user_list)
+            if ('t' in memCheck)  or ('g' in memCheck) or ('m' in memCheck): # this is what contains the amount of resident memory
+                userNodeMem.append(toKB(memCheck))
+            else:
+                userNodeMem.append(memCheck) # we want it in KB to add up after finished running through node
+    return user_proc_list, userNodeMem
+#^----------------------------------------------------------------------------- get_user_processes(pageStr, user_name)
+
 def toKB(badMem):
     """Function which accepts a string representing resident memory from top off of a node. badMem will contain
     a t for terabytes, m for megabytes, or a g for gigabytes. These will be translated into KB and returned so the total
@@ -1030,9 +2368,9 @@ def cleanMem(badMem):
         return badMem + ' KB'
 #^----------------------------------------------------------------------------- cleanMem(string:badmem)
 
-def print_short_user(node_list, pending_list, user_name, user_jobs, num_cores):
+def print_short_user(node_list, pending_list, user_name, user_jobs, num_cores, pages=None):
     """Prints a short version of the user details: the node the user is running on with their jobs, and the
-    user's pending jobs (if any)."""
+    user's pending jobs (if any). pages are the xymon pages if they were already fetched (see user_pages)."""
     
     user_pend = []
     if len(pending_list):    
@@ -1046,16 +2384,12 @@ def print_short_user(node_list, pending_list, user_name, user_jobs, num_cores):
                 .format(user_name)).center(TERMWIDTH - 2) + "=")
     print("=".ljust(TERMWIDTH - 1) + "=")
     print("=".center(TERMWIDTH, '=') + "\n")
+    pages = user_pages(node_list, pages)
     for node in node_list:
         print()
         user_proc_list = []
-        cleanName = str(node).replace('long@','').replace('debug@','').replace('.crc.nd.edu','').replace('gpu@','').replace('gpu-debug@','')
-        full_page = urllib.request.urlopen("https://mon.crc.nd.edu/xymon-cgi/svcstatus.sh?HOST={0}.crc.nd.edu&SERVICE=cpu".format(cleanName))
-        mybytes = full_page.read() # getting all html into a byte-list
-        pageStr = mybytes.decode("utf8") # Now the html is in a string
-        full_page.close()
-        del mybytes #releasing these
-        del full_page
+        cleanName = short_host(node.host)
+        pageStr = pages[cleanName] or '' # None when xymon did not answer for this node
         # Each line below will be a line in Top for processes
         userNodeMem = [] # List to hold the different amounts of memory a user is using on this node!
         for line in pageStr.split('\n'):
@@ -1076,18 +2410,22 @@ def print_short_user(node_list, pending_list, user_name, user_jobs, num_cores):
               + 'Start Time'.center(int(TERMWIDTH/2) - 9))
         for job in node.get_job_list():
             this_nodeJobs = 0
-            if user_name in job.get_user():
+            if user_name == job.get_user():
                 print(str(job.get_id()).center(int(TERMWIDTH/4))  \
                     + job.get_name().center(int(TERMWIDTH/4)) +str(job.get_core_info()).center(int(9))\
                     + job.get_start_time().center(int(TERMWIDTH/2) - 9))
                 job_count += 1
 
-        userTotalMem = 0
-        for mem in userNodeMem:
-            userTotalMem += int(mem)  
-        print("User's total memory usage on Node: {0}\n".format(cleanMem(str(userTotalMem))))
+        if pages[cleanName] is None:
+            print("User's total memory usage on Node: unknown, xymon did not answer for {0}.\n".format(cleanName))
+        else:
+            userTotalMem = 0
+            for mem in userNodeMem:
+                userTotalMem += int(mem)  
+            print("User's total memory usage on Node: {0}\n".format(cleanMem(str(userTotalMem))))
     print("----\n{0}'s Total Running Jobs: {1}".format(user_name, str(job_count)))
     print("Total cores used: {0}\n".format(num_cores))
+    print_degraded(pages)
         
     if len(user_pend):
         print('\n' + '#'.center(TERMWIDTH, '#'))
@@ -1096,7 +2434,7 @@ def print_short_user(node_list, pending_list, user_name, user_jobs, num_cores):
         for job in user_pend:
             print(job)
       
-    sys.exit()
+    return
 #^----------------------------------------------------------------------------- print_short_user(. . .)
 
 def show_usage(exit_code):
@@ -1111,13 +2449,25 @@ def show_usage(exit_code):
     print("  -g, --general-access".ljust(int(TERMWIDTH/2)) + "show information from the general_access queue.".ljust(int(TERMWIDTH/2)))
     print("  -H, --hosts".ljust(int(TERMWIDTH/2)) + "show all available host-groups(you may not have access to all)".ljust(int(TERMWIDTH/2)))
     print("  -[hostgroup]".ljust(int(TERMWIDTH/2)) + "show information on specific host-group, the '@' is not required.".ljust(int(TERMWIDTH/2)))
-    print("  -u, --user [user_name] ".ljust(int(TERMWIDTH/2)) + \
+    print("  -u, --user [user_name,...|'*']".ljust(int(TERMWIDTH/2)) + \
           "show which nodes the specified user's jobs are on and job info.".ljust(int(TERMWIDTH/2)))
     print("  -uf, [user_name]".ljust(int(TERMWIDTH/2)) + "show which host-groups are available to specified user.".ljust(int(TERMWIDTH/2)))
+    print("  -j [job_id,job_id,...]".ljust(int(TERMWIDTH/2)) + "show where the job(s) run, their owner, slots, memory and processes.".ljust(int(TERMWIDTH/2)))
     print("  -qlong".ljust(int(TERMWIDTH/2)) + "display node and core usage of the long queue for the current user.".ljust(int(TERMWIDTH/2)))
+    print("  --pending".ljust(int(TERMWIDTH/2)) + "show the pending jobs by status, wait time, user and queue.".ljust(int(TERMWIDTH/2)))
+    print("  --top N [users|jobs|hostgroups]".ljust(int(TERMWIDTH/2)) + "rank by --by cores|jobs|pending|mem, cores by default.".ljust(int(TERMWIDTH/2)))
+    print("  --stats".ljust(int(TERMWIDTH/2)) + "report on the whole cluster: cores, nodes, jobs, users, per host-group and queue.".ljust(int(TERMWIDTH/2)))
+    print("  --metrics [file|:port]".ljust(int(TERMWIDTH/2)) + "write Prometheus metrics of the whole cluster.".ljust(int(TERMWIDTH/2)))
+    print("  --record".ljust(int(TERMWIDTH/2)) + "add the cluster's usage to the history, run it from cron.".ljust(int(TERMWIDTH/2)))
+    print("  --report [--since 7d] [--hostgroup X]".ljust(int(TERMWIDTH/2)) + "show the recorded usage over a time window.".ljust(int(TERMWIDTH/2)))
+    print("  --serve [socket]".ljust(int(TERMWIDTH/2)) + "run as a daemon answering node_search.sh through a unix socket.".ljust(int(TERMWIDTH/2)))
     print("Optional arguments:".ljust(int(TERMWIDTH/2)))
     print("  --details".ljust(int(TERMWIDTH/2)) + "flag which can be passed to certain args for a detailed output.".ljust(int(TERMWIDTH/2)))
-    print("  -v, --visual".ljust(int(TERMWIDTH/2)) + "flag which can be passed after a host name for a visual queue.".ljust(int(TERMWIDTH/2)) \
+    print("  -v, --visual".ljust(int(TERMWIDTH/2)) + "flag which can be passed after a host name for a visual queue.".ljust(int(TERMWIDTH/2)))
+    print("  --refresh".ljust(int(TERMWIDTH/2)) + "re-fetch cached qconf info (host-groups, user-lists, queues).".ljust(int(TERMWIDTH/2)))
+    print("  --format FORMAT".ljust(int(TERMWIDTH/2)) + "write records as json, ndjson or csv instead of text.".ljust(int(TERMWIDTH/2)))
+    print("  --watch SECONDS".ljust(int(TERMWIDTH/2)) + "show the output again every SECONDS, with what changed.".ljust(int(TERMWIDTH/2)))
+    print("  --trace-commands[=json]".ljust(int(TERMWIDTH/2)) + "report every qstat/qconf/qhost/xymon call on stderr.".ljust(int(TERMWIDTH/2)) \
           + '\n')
     print('Examples:')
     print('  {0} -d'.format(SCRIPT_NAME).ljust(int(TERMWIDTH/2)) + '[--debug] could also be used'.ljust(int(TERMWIDTH/2)))
@@ -1133,16 +2483,1077 @@ def show_usage(exit_code):
     sys.exit(exit_code) 
 #^----------------------------------------------------------------------------- show_usage(exit_code)    
 
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Handler for one connection to the --serve daemon. The client sends one json line holding its
+    arguments, and gets back one json object with the output and the exit status. The query is answered as
+    the user the client process runs as, read from the socket (SO_PEERCRED), so nobody can ask as someone
+    else. Every connection has its own thread, and a client which sends nothing is dropped after
+    SERVE_READ_TIMEOUT."""
+
+    timeout = SERVE_READ_TIMEOUT
+
+    def handle(self):
+        try:
+            credentials = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            user = getpwuid(struct.unpack('3i', credentials)[1]).pw_name # pid, uid, gid
+            request = json.loads(self.rfile.readline(65536).decode('utf8'))
+            argv = [str(arg) for arg in request['argv']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        with self.server.lock:
+            status, output = answer_query(argv, user)
+        self.wfile.write(json.dumps({'status': status, 'output': output}).encode('utf8'))
+#^--------------------------------------------------------- class QueryHandler
+
+def serve(socket_path):
+    """Function for --serve. Keeps a ClusterSnapshot in memory, refreshed with one qstat every
+    SERVE_INTERVAL seconds, and answers the normal modes of node_search for clients connecting through
+    the unix socket at socket_path (see query_daemon and node_search.sh). Queries are answered one at a
+    time from the snapshot, so the load on the qmaster does not depend on how many users ask. Runs
+    until interrupted. Clients only trust the socket if it belongs to root, to themselves or to the
+    owner of node_search.py, so the daemon should be run by one of them. The refreshed snapshot is read
+    without qstat -r, which lists the requests of every job: the first --pending query after a refresh reads
+    one with -r, which then answers every query until the next refresh (see get_snapshot)."""
+    global SNAPSHOT, TRACE
+
+    SNAPSHOT = load_snapshot()
+    print_trace()
+    TRACE = None # queries trace their own commands, see answer_query
+    if os.path.exists(socket_path):
+        try:
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            probe.connect(socket_path)
+            probe.close()
+            print("Error: a node_search daemon is already serving {0}.".format(socket_path))
+            sys.exit(23)
+        except OSError:
+            os.remove(socket_path) # left over from a daemon which did not shut down cleanly
+    server = socketserver.ThreadingUnixStreamServer(socket_path, QueryHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock() # answer_query swaps sys.stdout and the globals, one query at a time
+    os.chmod(socket_path, 0o666) # every user on the login node may ask
+    refresher = threading.Thread(target=refresh_snapshots, args=(server.lock,))
+    refresher.daemon = True
+    refresher.start()
+    print("node_search daemon serving {0}, refreshing every {1} seconds.".format(socket_path, SERVE_INTERVAL))
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # so the socket is removed on kill
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+    sys.exit(0)
+#^----------------------------------------------------------------------------- serve(socket_path)
+
+def refresh_snapshots(lock):
+    """Function run by the --serve refresher thread. qstat is run outside of the lock, so queries keep
+    being answered from the old snapshot until the new one is swapped in. Job details belong to the old
+    snapshot and are dropped with it."""
+    global SNAPSHOT, JOB_DETAILS
+
+    while True:
+        time.sleep(SERVE_INTERVAL)
+        try:
+            snapshot = load_snapshot()
+        except Exception:
+            traceback.print_exc() # keep answering from the last good snapshot
+            continue
+        with lock:
+            SNAPSHOT = snapshot
+            JOB_DETAILS = None
+#^----------------------------------------------------------------------------- refresh_snapshots(lock)
+
+def answer_query(argv, user):
+    """Function to run one query of the daemon through main, as if node_search had been run with argv by
+    user. The output is captured instead of printed and the exit status is caught. --watch renders every
+    refresh with it as well. Modes which never return (--serve, --metrics, --watch) are refused, they would
+    keep the daemon from answering anyone else, and so are --record and --report, which would read and write
+    the history file of the daemon's owner instead of the user's. Returns (status, output)."""
+    global CONFIG_CACHE, REFRESH_CACHE, TRACE, OUTPUT_FORMAT, SNAPSHOT_REQUESTS
+
+    for mode in ('--serve', '--query', '--metrics', '--watch', '--record', '--report'):
+        if mode in argv:
+            return 23, "Error: {0} can not be sent to the node_search daemon, run it directly.\n".format(mode)
+    saved_argv, saved_stdout, saved_user = sys.argv, sys.stdout, os.environ.get('USER')
+    sys.argv = [saved_argv[0]] + argv
+    sys.stdout = io.StringIO()
+    os.environ['USER'] = user
+    if '--refresh' in argv:
+        CONFIG_CACHE = None # main sets REFRESH_CACHE, so a new cache re-fetches every qconf entry
+    status = 0
+    try:
+        main()
+    except SystemExit as error:
+        if isinstance(error.code, int):
+            status = error.code
+        elif error.code is not None:
+            print(error.code)
+            status = 1
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        status = 1
+    finally:
+        close_records()
+        print_trace(sys.stdout) # the client only gets one stream back
+        TRACE = None
+        output = sys.stdout.getvalue()
+        sys.argv, sys.stdout = saved_argv, saved_stdout
+        if saved_user is None:
+            os.environ.pop('USER', None)
+        else:
+            os.environ['USER'] = saved_user
+        if REFRESH_CACHE:
+            CONFIG_CACHE = None # later queries go back to a normal cache, reading the freshly written file
+            REFRESH_CACHE = False
+        OUTPUT_FORMAT = 'text'
+        SNAPSHOT_REQUESTS = False
+    return status, output
+#^----------------------------------------------------------------------------- answer_query(argv, user)
+
+def query_daemon(argv):
+    """Function for --query, used by node_search.sh. Sends argv to the daemon listening on SERVE_SOCKET,
+    prints its answer and exits with the answer's status. Exits with 26 if the daemon can not be reached,
+    or if the socket belongs to anyone but root, the user or the owner of node_search.py (anyone may create
+    a socket in /tmp), so the caller can fall back to running directly. Once the query is sent, it is not
+    run a second time: if the daemon does not answer in QUERY_TIMEOUT seconds, exits with 27."""
+
+    try:
+        owner = os.stat(SERVE_SOCKET).st_uid
+        trusted = (0, os.getuid(), os.stat(os.path.realpath(__file__)).st_uid)
+    except OSError:
+        sys.exit(26)
+    if owner not in trusted:
+        sys.stderr.write("Warning: ignoring {0}, it does not belong to a trusted user.\n".format(SERVE_SOCKET))
+        sys.exit(26)
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(QUERY_TIMEOUT)
+        client.connect(SERVE_SOCKET)
+        client.sendall((json.dumps({'argv': argv}) + '\n').encode('utf8'))
+    except OSError:
+        sys.exit(26)
+    try:
+        chunks = []
+        chunk = client.recv(65536)
+        while chunk:
+            chunks.append(chunk)
+            chunk = client.recv(65536)
+        client.close()
+        reply = json.loads(b''.join(chunks).decode('utf8'))
+    except socket.timeout:
+        print("Error: the node_search daemon did not answer within {0} seconds.".format(QUERY_TIMEOUT))
+        sys.exit(27)
+    except (OSError, ValueError):
+        sys.exit(26)
+    sys.stdout.write(reply['output'])
+    sys.exit(reply['status'])
+#^----------------------------------------------------------------------------- query_daemon(argv)
+
+class SnapshotDiff:
+    """Class to hold what changed between two ClusterSnapshots within the part of the cluster a view shows:
+    queue instances whose state changed, jobs which started or finished, and the cores they took or freed.
+    node_filter(node) and job_filter(job) decide what is part of the view."""
+
+    def __init__(self, old, new, node_filter, job_filter):
+        """Compares the old snapshot with the new one."""
+        self.state_changes = [] # (queue instance, old states, new states)
+        self.started = [] # Jobs running in new but not in old
+        self.finished = [] # Jobs running in old but not in new
+        old_nodes = dict((node.get_name(), node) for node in old.node_list if node_filter(node))
+        new_nodes = dict((node.get_name(), node) for node in new.node_list if node_filter(node))
+        for name, node in new_nodes.items():
+            before = old_nodes.get(name)
+            if before is None:
+                self.state_changes.append((name, 'new', node.states or 'ok'))
+            elif before.states != node.states:
+                self.state_changes.append((name, before.states or 'ok', node.states or 'ok'))
+        for name in old_nodes:
+            if name not in new_nodes:
+                self.state_changes.append((name, old_nodes[name].states or 'ok', 'gone'))
+        old_jobs = self.job_keys(old_nodes, job_filter)
+        new_jobs = self.job_keys(new_nodes, job_filter)
+        self.started = [job for key, job in new_jobs.items() if key not in old_jobs]
+        self.finished = [job for key, job in old_jobs.items() if key not in new_jobs]
+        self.cores_taken = sum(int(job.get_core_info()) for job in self.started)
+        self.cores_freed = sum(int(job.get_core_info()) for job in self.finished)
+
+    def __repr__(self):
+        return 'SnapshotDiff-{0}states-{1}started-{2}finished'.format(len(self.state_changes), len(self.started),
+                                                                       len(self.finished))
+
+    @staticmethod
+    def job_keys(nodes, job_filter):
+        """Returns the jobs running on nodes as a dictionary of (job id, queue instance) -> Job."""
+        jobs = {}
+        for name, node in nodes.items():
+            for job in node.get_job_list():
+                if job_filter(job):
+                    jobs[(str(job.get_id()), name)] = job
+        return jobs
+
+    def get_lines(self, limit):
+        """Method to obtain the changes as lines of text, at most limit of them per kind of change."""
+        lines = ['{0} queue instance(s) changed state, {1} job(s) started, {2} job(s) finished, '
+                 '{3} core(s) taken, {4} core(s) freed'.format(len(self.state_changes), len(self.started),
+                                                               len(self.finished), self.cores_taken, self.cores_freed)]
+        for changes, show in ((self.state_changes, lambda change: '    {0}: {1} -> {2}'.format(*change)),
+                              (self.started, lambda job: '  + {0} {1} {2} core(s) on {3}'.format(
+                                  job.get_id(), job.get_user(), job.get_core_info(), job.node.get_name())),
+                              (self.finished, lambda job: '  - {0} {1} {2} core(s) on {3}'.format(
+                                  job.get_id(), job.get_user(), job.get_core_info(), job.node.get_name()))):
+            for change in changes[:limit]:
+                lines.append(show(change))
+            if len(changes) > limit:
+                lines.append('    ... and {0} more'.format(len(changes) - limit))
+        return lines
+#^--------------------------------------------------------- class SnapshotDiff
+
+def watch_filters(argv, old, new):
+    """Function to find which part of the cluster the view of argv shows, for SnapshotDiff between the old
+    and the new snapshot: the hosts of a hostgroup view (taken from the cached qconf output), the jobs of a
+    user view and the hosts they ran on in either snapshot, else the whole cluster. The users of a user view
+    are read like -u reads them (see select_users). Returns: (node_filter, job_filter)."""
+
+    everything = lambda item: True
+    if not argv:
+        return everything, everything
+    if argv[0] in ('-u', '--user') and len(argv) > 1:
+        users = set(select_users(argv[1], old)) | set(select_users(argv[1], new))
+        hosts = set(node.host for snapshot in (old, new) for user_name in users
+                    for node in snapshot.get_owner_nodes(user_name))
+        return lambda node: node.host in hosts, lambda job: job.get_user() in users
+    if argv[0] in ('-d', '--debug'):
+        hostgroup = DEBUG_QUEUE_HOSTGROUP
+    elif argv[0] in ('-g', '--general_access'):
+        hostgroup = GENERAL_ACCESS_QUEUE_HOSTGROUP
+    elif argv[0].startswith('-') and argv[0].lstrip('-') in [hg.lstrip('@') for hg in qconf_output("qconf -shgrpl").split()]:
+        hostgroup = argv[0].lstrip('-')
+    else:
+        return everything, everything
+    hosts = set(resolve_hostgroups([hostgroup])[hostgroup])
+    return lambda node: node.host in hosts, everything
+#^----------------------------------------------------------------------------- watch_filters(argv)
+
+def draw_frame(lines, previous):
+    """Function to put one --watch frame on a terminal. Only the lines which differ from the previous frame
+    are rewritten, by moving the cursor to them, and the first frame (previous is None) clears the screen."""
+
+    out = sys.stdout
+    if previous is None:
+        out.write('\033[H\033[2J')
+        previous = []
+    for row, line in enumerate(lines):
+        if row >= len(previous) or previous[row] != line:
+            out.write('\033[{0};1H{1}\033[K'.format(row + 1, line))
+    if len(lines) < len(previous):
+        out.write('\033[{0};1H\033[J'.format(len(lines) + 1)) # the frame got shorter
+    out.write('\033[{0};1H'.format(len(lines) + 1))
+    out.flush()
+    return
+#^----------------------------------------------------------------------------- draw_frame(lines, previous)
+
+def watch(argv):
+    """Function for --watch SECONDS. Keeps node_search running and shows the view of argv again every SECONDS,
+    each time from a new snapshot (one qstat) while the qconf information is reused from the ConfigCache.
+    Under the view, the changes since the last refresh are listed (see SnapshotDiff). On a terminal only the
+    lines of the screen which changed are redrawn, anything else (a pipe, a file) gets the first view and then
+    only the changes of every refresh. Runs until interrupted."""
+    global SNAPSHOT, JOB_DETAILS, WATCH_INTERVAL
+
+    interval = WATCH_INTERVAL
+    WATCH_INTERVAL = None # the views are rendered through main, which must not start watching again
+    if argv[:1] in (['--serve'], ['--query']):
+        print("Error: --serve can not be watched.")
+        show_usage(23)
+    if TRACE is not None: # every refresh gets its own trace, appended to its view
+        argv = argv + ['--trace-commands=' + TRACE.output_format]
+    user = os.environ.get('USER', '')
+    terminal = sys.stdout.isatty()
+    title = 'Every {0:g}s: {1} {2}'.format(interval, SCRIPT_NAME, ' '.join(argv))
+    previous = None
+    old_snapshot = None
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            started = time.time()
+            SNAPSHOT = None # main reads a new one
+            JOB_DETAILS = None # details belong to the old snapshot
+            status, output = answer_query(argv, user)
+            if previous is None and status not in (0, 21):
+                sys.stdout.write(output) # the view itself failed, such as a wrong option
+                sys.exit(status)
+            view = output.rstrip('\n').split('\n')
+            changes = []
+            if old_snapshot is not None:
+                node_filter, job_filter = watch_filters(argv, old_snapshot, get_snapshot())
+                changes = [''] + SnapshotDiff(old_snapshot, get_snapshot(), node_filter, job_filter).get_lines(WATCH_CHANGES)
+            header = [title.ljust(TERMWIDTH - 8) + time.strftime('%H:%M:%S'), '']
+            if terminal:
+                rows = shutil.get_terminal_size().lines - 1
+                room = max(1, rows - len(header) - len(changes) - 1) # the changes stay in sight
+                if len(view) > room:
+                    view = view[:room] + ['... {0} more line(s), enlarge the terminal to see them'.format(len(view) - room)]
+                lines = header + view + changes
+                draw_frame(lines, previous)
+                previous = lines
+            else:
+                sys.stdout.write('\n'.join(header[:1] + (changes[1:] if previous else view)) + '\n')
+                sys.stdout.flush()
+                previous = view
+            old_snapshot = get_snapshot()
+            time.sleep(max(0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+#^----------------------------------------------------------------------------- watch(argv)
+
 def show_everything():
-    """Function which will display information on all host groups summed up into a format similiar to the format
-    of viewing a single host-group/queue. This function will most likely take a very long time..."""
-    
-    #print("WARNING: This may take awhile. . .\n")
-    # Need to find all hostgroups, and make sure there are no deuplicate machines in this calculation.
-    print("This feature is still under construction. Check back soon!")
+    """Function for --stats, a report on the whole cluster built from one qstat snapshot and the cached
+    qconf hostgroups: total, used, free and disabled cores and nodes, the percentage of nodes down, job and
+    user counts, and a breakdown per hostgroup and per queue. Nodes belonging to several hostgroups are
+    only counted once in the cluster totals. Quick enough to be run from cron every minute."""
+
+    snapshot = get_snapshot()
+    hostgroup_list = qconf_output("qconf -shgrpl").split()
+    hostgroup_hosts = resolve_hostgroups(hostgroup_list)
+    cluster_hosts = set()
+    for hostgroup in hostgroup_list:
+        cluster_hosts.update(hostgroup_hosts[hostgroup])
+    table = snapshot.get_table()
+    cluster = table.totals(table.host_rows_for(cluster_hosts))
+
+    running_users = set(snapshot.owner_index)
+    pending_users = set(job.get_user() for job in snapshot.get_pending())
+
+    if OUTPUT_FORMAT != 'text':
+        emit('cluster_summary', totals_fields('cluster', 'Cluster', cluster) + [
+            ('nodes_down_percent', round(100.0 * cluster.disabled_nodes / cluster.total_nodes, 1) if cluster.total_nodes else None),
+            ('running_jobs', len(snapshot.job_index)), ('pending_jobs', len(snapshot.get_pending())),
+            ('users_running', len(running_users)), ('users_pending', len(pending_users)),
+            ('users', len(running_users | pending_users))])
+        for hostgroup in hostgroup_list:
+            emit('host_summary', totals_fields('hostgroup', hostgroup, table.totals(table.host_rows_for(hostgroup_hosts[hostgroup]))))
+        for queue in sorted(table.queue_names):
+            emit('queue_summary', totals_fields('queue', queue, table.totals(table.queue_rows(queue))))
+        sys.exit(0)
+
+    print_host_info(cluster, 'Cluster')
+    if cluster.total_nodes:
+        print('Nodes Down:'.ljust(int(TERMWIDTH/2)) + '{0:.1f}%'.format(100.0 * cluster.disabled_nodes / cluster.total_nodes))
+    print("")
+    print('Running Jobs:'.ljust(int(TERMWIDTH/2)) + str(len(snapshot.job_index)))
+    print('Pending Jobs:'.ljust(int(TERMWIDTH/2)) + str(len(snapshot.get_pending())))
+    print('Users Running Jobs:'.ljust(int(TERMWIDTH/2)) + str(len(running_users)))
+    print('Users With Pending Jobs:'.ljust(int(TERMWIDTH/2)) + str(len(pending_users)))
+    print('Total Users:'.ljust(int(TERMWIDTH/2)) + str(len(running_users | pending_users)))
+
+    print('\nPer host-group:')
+    print_stats_header('Host-group')
+    for hostgroup in hostgroup_list:
+        print_stats_row(hostgroup, table.totals(table.host_rows_for(hostgroup_hosts[hostgroup])))
+    print('\nPer queue (every queue instance, a node in several queues is counted in each):')
+    print_stats_header('Queue')
+    for queue in sorted(table.queue_names):
+        print_stats_row(queue, table.totals(table.queue_rows(queue)))
     sys.exit(0)
 #^----------------------------------------------------------------------------- show_everything()    
 
+def print_stats_header(title):
+    """Prints the column titles of the --stats breakdown tables."""
+    print(title.ljust(24) + 'Nodes'.rjust(7) + 'Cores'.rjust(8) + 'Used'.rjust(8) + 'Free'.rjust(8)
+          + 'Disabled'.rjust(10) + 'Used%'.rjust(8) + 'Down'.rjust(6))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    return
+#^----------------------------------------------------------------------------- print_stats_header(title)
+
+def print_stats_row(name, totals):
+    """Prints one row of a --stats breakdown table from a HostTotals."""
+    usable = totals.total_cores - totals.disabled_cores
+    if usable:
+        percent = '{0:.1f}'.format(100.0 * totals.used_cores / usable)
+    else:
+        percent = '-'
+    print(name[:23].ljust(24) + str(totals.total_nodes).rjust(7) + str(totals.total_cores).rjust(8)
+          + str(totals.used_cores).rjust(8) + str(totals.free_cores).rjust(8) + str(totals.disabled_cores).rjust(10)
+          + percent.rjust(8) + str(totals.disabled_nodes).rjust(6))
+    return
+#^----------------------------------------------------------------------------- print_stats_row(name, totals)
+
+def show_pending():
+    """Function for --pending, an analysis of the pending jobs of one snapshot: jobs and slots per status,
+    a histogram of how long the jobs have been waiting since their submission (see WAIT_BUCKETS), and the
+    backlog of every user (jobs, slots, longest and median wait) and of every requested queue. The queue
+    a job asked for is read along with the snapshot (qstat -r, see SNAPSHOT_REQUESTS), so no command is run
+    per pending job."""
+
+    snapshot = get_snapshot()
+    pending = snapshot.get_pending()
+    now = time.time()
+    submit_times = {} # many jobs share a submission date, each date is only parsed once
+    waits = []
+    for job in pending:
+        if job.date not in submit_times:
+            submit_times[job.date] = job.get_submit_time()
+        submitted = submit_times[job.date]
+        waits.append(None if submitted is None else max(now - submitted, 0))
+
+    statuses = OrderedDict()
+    histogram = [0] * len(WAIT_BUCKETS)
+    users, queues = {}, {}
+    for job, wait in zip(pending, waits):
+        slots = int(job.get_core_info())
+        status = statuses.setdefault(job.get_status(), [0, 0])
+        status[0] += 1
+        status[1] += slots
+        if wait is not None:
+            bucket = 0
+            while WAIT_BUCKETS[bucket][0] is not None and wait >= WAIT_BUCKETS[bucket][0]:
+                bucket += 1
+            histogram[bucket] += 1
+        users.setdefault(job.get_user(), []).append((job, wait))
+        queues.setdefault(job.queue or '(any)', []).append(job)
+
+    user_rows = []
+    for user_name, jobs in users.items():
+        user_waits = sorted(wait for job, wait in jobs if wait is not None)
+        user_rows.append([('user', user_name), ('jobs', len(jobs)),
+                          ('slots', sum(int(job.get_core_info()) for job, wait in jobs)),
+                          ('longest_wait_hours', user_waits[-1] / 3600.0 if user_waits else None),
+                          ('median_wait_hours', user_waits[len(user_waits) // 2] / 3600.0 if user_waits else None)])
+    user_rows.sort(key=lambda row: (-row[1][1], row[0][1])) # most jobs first
+    queue_rows = []
+    for queue in sorted(queues):
+        queue_rows.append([('queue', queue), ('jobs', len(queues[queue])),
+                           ('slots', sum(int(job.get_core_info()) for job in queues[queue])),
+                           ('users', len(set(job.get_user() for job in queues[queue])))])
+
+    if OUTPUT_FORMAT != 'text':
+        emit('pending_summary', [('jobs', len(pending)), ('slots', sum(int(job.get_core_info()) for job in pending)),
+                                 ('users', len(users))])
+        for status, (count, slots) in statuses.items():
+            emit('pending_status', [('status', status), ('jobs', count), ('slots', slots)])
+        for (limit, label), count in zip(WAIT_BUCKETS, histogram):
+            emit('wait_bucket', [('wait', label), ('below_seconds', limit), ('jobs', count)])
+        for row in user_rows:
+            emit('pending_user', row)
+        for row in queue_rows:
+            emit('pending_queue', row)
+        sys.exit(0)
+
+    half = int(TERMWIDTH/2)
+    print('Pending Jobs'.ljust(TERMWIDTH))
+    print('-'.center(60, '-'))
+    print('Pending Jobs:'.ljust(half) + str(len(pending)))
+    print('Pending Slots:'.ljust(half) + str(sum(int(job.get_core_info()) for job in pending)))
+    print('Users With Pending Jobs:'.ljust(half) + str(len(users)))
+    for status, (count, slots) in statuses.items():
+        print((PRINT_INDENT + status + ':').ljust(half) + '{0} jobs, {1} slots'.format(count, slots))
+
+    print('\nTime waiting since submission:')
+    most = max(histogram) if pending else 0
+    for (limit, label), count in zip(WAIT_BUCKETS, histogram):
+        bar = '#' * int(round(40.0 * count / most)) if most else ''
+        print(PRINT_INDENT + label.ljust(10) + '|' + bar.ljust(41) + str(count).rjust(8))
+
+    print('\nPer user:')
+    print('User'.ljust(20) + 'Jobs'.rjust(10) + 'Slots'.rjust(10) + 'Longest Wait'.rjust(16) + 'Median Wait'.rjust(16))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    for row in user_rows:
+        row = dict(row)
+        print(row['user'][:19].ljust(20) + str(row['jobs']).rjust(10) + str(row['slots']).rjust(10)
+              + format_hours(row['longest_wait_hours']).rjust(16) + format_hours(row['median_wait_hours']).rjust(16))
+    print('\nPer requested queue:')
+    print('Queue'.ljust(20) + 'Jobs'.rjust(10) + 'Slots'.rjust(10) + 'Users'.rjust(10))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    for row in queue_rows:
+        row = dict(row)
+        print(row['queue'][:19].ljust(20) + str(row['jobs']).rjust(10) + str(row['slots']).rjust(10)
+              + str(row['users']).rjust(10))
+    sys.exit(0)
+#^----------------------------------------------------------------------------- show_pending()
+
+def format_hours(hours):
+    """Turns a number of hours into a short string like 5.2h or 3.1d, '-' for None."""
+    if hours is None:
+        return '-'
+    if hours < 48:
+        return '{0:.1f}h'.format(hours)
+    return '{0:.1f}d'.format(hours / 24)
+#^----------------------------------------------------------------------------- format_hours(hours)
+
+def show_top(argv):
+    """Function for --top N [users|jobs|hostgroups] [--by cores|jobs|pending|mem]. Ranks the users (default),
+    running jobs or hostgroups of one snapshot and shows the first N, largest first, with a bounded heap
+    (heapq.nlargest) so only N entries are ever kept in order. Users are ranked by running cores by default,
+    and shown with their jobs, pending jobs and the hostgroups holding most of their cores. Max memory
+    (qstat -j maxvmem) is shown for the N jobs, and for users only when ranking by it, as that needs the
+    qstat -j of every running job."""
+
+    if not argv or not argv[0].isdigit() or int(argv[0]) < 1:
+        print("Error: --top takes the number of entries to show, e.g. --top 10.")
+        show_usage(23)
+    count = int(argv[0])
+    kind, key = 'users', 'cores'
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in ('users', 'jobs', 'hostgroups'):
+            kind = arg
+        elif arg == '--by':
+            key = next(args, '')
+        else:
+            print("Error: --top takes users, jobs or hostgroups and --by, not '{0}'.".format(arg))
+            show_usage(23)
+    keys = {'users': ('cores', 'jobs', 'pending', 'mem'), 'jobs': ('cores', 'mem'), 'hostgroups': ('cores', 'jobs')}
+    if key not in keys[kind]:
+        print("Error: --top {0} can be ranked --by {1}.".format(kind, '|'.join(keys[kind])))
+        show_usage(23)
+
+    snapshot = get_snapshot()
+    if kind == 'users':
+        rows = top_users(snapshot, count, key)
+    elif kind == 'jobs':
+        rows = top_jobs(snapshot, count, key)
+    else:
+        rows = top_hostgroups(snapshot, count, key)
+
+    if OUTPUT_FORMAT != 'text':
+        for rank, row in enumerate(rows, 1):
+            emit('top_' + kind[:-1], [('rank', rank), ('by', key)] + row)
+        sys.exit(0)
+    print('Top {0} {1} by {2}'.format(count, kind, {'cores': 'running cores', 'jobs': 'running jobs',
+                                                     'pending': 'pending jobs', 'mem': 'max memory'}[key]))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    if kind == 'users':
+        print('Rank'.rjust(4) + '  ' + 'User'.ljust(14) + 'Cores'.rjust(7) + 'Jobs'.rjust(7) + 'Pending'.rjust(9)
+              + 'Max Mem'.rjust(9) + '  Hostgroups (cores)')
+        for rank, row in enumerate(rows, 1):
+            row = dict(row)
+            hostgroups = ''
+            for name, cores in row['hostgroups']: # as many as fit on the line
+                if len(hostgroups) + len(name) + len(str(cores)) + 2 <= TERMWIDTH - 52:
+                    hostgroups += '{0}:{1} '.format(name, cores)
+            print(str(rank).rjust(4) + '  ' + row['user'][:13].ljust(14) + str(row['cores']).rjust(7)
+                  + str(row['jobs']).rjust(7) + str(row['pending']).rjust(9) + format_mem(row['max_mem']).rjust(9)
+                  + '  ' + hostgroups.rstrip())
+    elif kind == 'jobs':
+        print('Rank'.rjust(4) + '  ' + 'Job ID'.ljust(10) + 'Owner'.ljust(14) + 'Name'.ljust(20) + 'Cores'.rjust(7)
+              + 'Hosts'.rjust(7) + 'Max Mem'.rjust(9))
+        for rank, row in enumerate(rows, 1):
+            row = dict(row)
+            print(str(rank).rjust(4) + '  ' + row['job_id'].ljust(10) + row['user'][:13].ljust(14)
+                  + row['name'][:19].ljust(20) + str(row['cores']).rjust(7) + str(row['hosts']).rjust(7)
+                  + format_mem(row['max_mem']).rjust(9))
+    else:
+        print('Rank'.rjust(4) + '  ' + 'Hostgroup'.ljust(24) + 'Used'.rjust(8) + 'Cores'.rjust(8) + 'Jobs'.rjust(8)
+              + 'Users'.rjust(8))
+        for rank, row in enumerate(rows, 1):
+            row = dict(row)
+            print(str(rank).rjust(4) + '  ' + row['hostgroup'][:23].ljust(24) + str(row['used_cores']).rjust(8)
+                  + str(row['total_cores']).rjust(8) + str(row['jobs']).rjust(8) + str(row['users']).rjust(8))
+    sys.exit(0)
+#^----------------------------------------------------------------------------- show_top(argv)
+
+def top_users(snapshot, count, key):
+    """Function to rank the users of snapshot by key (cores, jobs, pending or mem) for --top. Builds a User
+    of every owner from the owner index. Returns the fields of the first count users, max_mem being None
+    unless ranking by it."""
+
+    pending = {}
+    for job in snapshot.get_pending():
+        pending[job.get_user()] = pending.get(job.get_user(), 0) + 1
+    users = []
+    for user_name in sorted(set(snapshot.owner_index) | set(pending)):
+        user = User(user_name, list(snapshot.get_owner_jobs(user_name)))
+        user.update_cores()
+        users.append(user)
+    if key == 'mem':
+        get_job_details().want(job.get_id() for user in users for job in user.get_job_list())
+    values = {'cores': lambda user: user.get_core_info(),
+              'jobs': lambda user: len(set(job.get_id() for job in user.get_job_list())),
+              'pending': lambda user: pending.get(user.get_name(), 0),
+              'mem': lambda user: jobs_max_mem(user.get_job_list())}
+    top = heapq.nlargest(count, users, key=values[key])
+
+    host_groups = host_hostgroups()
+    rows = []
+    for user in top:
+        hostgroup_cores = {}
+        for job in user.get_job_list():
+            for hostgroup in host_groups.get(short_host(job.node.host), ()):
+                hostgroup_cores[hostgroup] = hostgroup_cores.get(hostgroup, 0) + int(job.get_core_info())
+        rows.append([('user', user.get_name()), ('cores', user.get_core_info()), ('jobs', values['jobs'](user)),
+                     ('pending', pending.get(user.get_name(), 0)),
+                     ('max_mem', jobs_max_mem(user.get_job_list()) if key == 'mem' else None),
+                     ('hostgroups', heapq.nlargest(3, sorted(hostgroup_cores.items()), key=lambda item: item[1]))])
+    return rows
+#^----------------------------------------------------------------------------- top_users(snapshot, count, key)
+
+def top_jobs(snapshot, count, key):
+    """Function to rank the running jobs of snapshot by key (cores or mem) for --top, the cores of a parallel
+    job being summed over its queue instances. Returns the fields of the first count jobs."""
+
+    if key == 'mem':
+        get_job_details().want(snapshot.job_index)
+    cores = lambda job_id: sum(int(job.get_core_info()) for job in snapshot.get_jobs(job_id))
+    values = {'cores': cores, 'mem': lambda job_id: jobs_max_mem(snapshot.get_jobs(job_id))}
+    top = heapq.nlargest(count, snapshot.job_index, key=values[key])
+    get_job_details().want(top)
+    rows = []
+    for job_id in top:
+        jobs = snapshot.get_jobs(job_id)
+        rows.append([('job_id', job_id), ('user', jobs[0].get_user()), ('name', jobs[0].get_name()),
+                     ('cores', cores(job_id)), ('hosts', len(set(job.node.host for job in jobs))),
+                     ('max_mem', jobs_max_mem(jobs))])
+    return rows
+#^----------------------------------------------------------------------------- top_jobs(snapshot, count, key)
+
+def top_hostgroups(snapshot, count, key):
+    """Function to rank the hostgroups by used cores or by running jobs for --top. Returns the fields of the
+    first count hostgroups."""
+
+    hostgroup_list = qconf_output("qconf -shgrpl").split()
+    hostgroup_hosts = resolve_hostgroups(hostgroup_list)
+    table = snapshot.get_table()
+    rows = []
+    for hostgroup in hostgroup_list:
+        totals = table.totals(table.host_rows_for(hostgroup_hosts[hostgroup]))
+        jobs = [job for host in hostgroup_hosts[hostgroup] for node in snapshot.get_host_nodes(host)
+                for job in node.get_job_list()]
+        rows.append([('hostgroup', hostgroup), ('used_cores', totals.used_cores), ('total_cores', totals.total_cores),
+                     ('jobs', len(set(job.get_id() for job in jobs))), ('users', len(set(job.get_user() for job in jobs)))])
+    field = 'used_cores' if key == 'cores' else 'jobs'
+    return heapq.nlargest(count, rows, key=lambda row: dict(row)[field])
+#^----------------------------------------------------------------------------- top_hostgroups(snapshot, count, key)
+
+def host_hostgroups():
+    """Function to obtain the hostgroups of every host (name without the domain), from the cached qconf
+    hostgroups. Returns a dictionary of host -> [hostgroup, ...]."""
+
+    hostgroup_list = qconf_output("qconf -shgrpl").split()
+    host_groups = {}
+    for hostgroup, host_list in resolve_hostgroups(hostgroup_list).items():
+        for host in host_list:
+            host_groups.setdefault(short_host(host), []).append(hostgroup)
+    return host_groups
+#^----------------------------------------------------------------------------- host_hostgroups()
+
+def jobs_max_mem(job_list):
+    """Function to sum up the maxvmem (from qstat -j) of the distinct jobs in job_list, in bytes. Returns None
+    if qstat -j gave none of them."""
+
+    total = None
+    for job_id in set(job.get_id() for job in job_list):
+        mem = parse_mem(get_job_details().get(job_id).get('maxvmem'))
+        if mem is not None:
+            total = (total or 0) + int(mem)
+    return total
+#^----------------------------------------------------------------------------- jobs_max_mem(job_list)
+
+def parse_mem(mem):
+    """Turns a grid engine memory value (1.5G, 512.000M, 0.000 ...) into bytes, None when it is not one."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if not mem:
+        return None
+    try:
+        if mem[-1:].upper() in units:
+            return float(mem[:-1]) * units[mem[-1:].upper()]
+        return float(mem)
+    except ValueError:
+        return None
+#^----------------------------------------------------------------------------- parse_mem(mem)
+
+def format_mem(mem):
+    """Turns a number of bytes into a short string like 1.5G, '-' for None."""
+    if mem is None:
+        return '-'
+    for unit in ('K', 'M', 'G', 'T'):
+        mem /= 1024.0
+        if mem < 1024 or unit == 'T':
+            return '{0:.1f}{1}'.format(mem, unit)
+#^----------------------------------------------------------------------------- format_mem(mem)
+
+def export_metrics(target):
+    """Function for --metrics. Writes the metrics of cluster_metrics in the Prometheus text format: to stdout
+    for '-', to a file for the node_exporter textfile collector (written to a temporary file first and
+    renamed, so the collector never reads half a file), or answered over HTTP on every scrape for :PORT or
+    HOST:PORT, which runs until interrupted."""
+
+    host, colon, port = target.rpartition(':')
+    if colon and port.isdigit():
+        server = http.server.HTTPServer((host or METRICS_ADDRESS, int(port)), MetricsHandler)
+        print("node_search exporter listening on http://{0}:{1}/metrics".format(host or METRICS_ADDRESS, port))
+        sys.stdout.flush()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        sys.exit(0)
+    text = cluster_metrics()
+    if target == '-':
+        sys.stdout.write(text)
+        sys.exit(0)
+    directory = os.path.dirname(os.path.abspath(target))
+    handle, temp_path = tempfile.mkstemp(prefix='.node_search-', suffix='.prom', dir=directory)
+    try:
+        with os.fdopen(handle, 'w') as temp_file:
+            temp_file.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, target)
+    except OSError:
+        os.remove(temp_path)
+        raise
+    sys.exit(0)
+#^----------------------------------------------------------------------------- export_metrics(target)
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Class answering the scrapes of --metrics :PORT. The server handles one request at a time, so scrapes
+    arriving together wait for each other instead of running qstat side by side."""
+
+    def do_GET(self):
+        """Answers /metrics with a fresh cluster_metrics, anything else with 404."""
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        try:
+            body = cluster_metrics().encode()
+        except Exception:
+            traceback.print_exc()
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return # scrapes come every few seconds, not worth a line each
+#^--------------------------------------------------------- class MetricsHandler
+
+def cluster_metrics():
+    """Function to compute every metric of --metrics from one new snapshot: core and node totals of the
+    cluster, of every hostgroup and of every queue, queue utilization, running cores and jobs and pending
+    jobs of every user, and low efficiency nodes. Costs one qstat and one qhost, run at the same time, plus
+    the hostgroups from the qconf cache. Returns the metrics in the Prometheus text format."""
+    global SNAPSHOT, JOB_DETAILS
+
+    started = time.time()
+    SNAPSHOT = None # every scrape gets the cluster as it is now
+    JOB_DETAILS = None
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        qhost = pool.submit(command_output, 'qhost', 'load')
+        snapshot = get_snapshot()
+        load_map = parse_qhost(qhost.result())
+    hostgroup_list = qconf_output("qconf -shgrpl").split()
+    hostgroup_hosts = resolve_hostgroups(hostgroup_list)
+    table = snapshot.get_table()
+
+    cluster_hosts = set()
+    for hostgroup in hostgroup_list:
+        cluster_hosts.update(hostgroup_hosts[hostgroup])
+    groups = [({}, table.totals(table.host_rows_for(cluster_hosts)))]
+    for hostgroup in hostgroup_list:
+        groups.append(({'hostgroup': hostgroup}, table.totals(table.host_rows_for(hostgroup_hosts[hostgroup]))))
+    for queue in sorted(table.queue_names):
+        groups.append(({'queue': queue}, table.totals(table.queue_rows(queue))))
+
+    metrics = []
+    for name, help_text, attribute in (('cores', 'Cores of the nodes, disabled ones included.', 'total_cores'),
+                                       ('used_cores', 'Cores used by jobs on enabled nodes.', 'used_cores'),
+                                       ('free_cores', 'Cores free on enabled nodes.', 'free_cores'),
+                                       ('disabled_cores', 'Cores of disabled nodes.', 'disabled_cores'),
+                                       ('nodes', 'Nodes, disabled ones included.', 'total_nodes'),
+                                       ('empty_nodes', 'Enabled nodes without any job.', 'empty_nodes'),
+                                       ('disabled_nodes', 'Disabled nodes.', 'disabled_nodes')):
+        metrics.append((name, help_text, [(labels, getattr(totals, attribute)) for labels, totals in groups]))
+    metrics.append(('used_nodes', 'Enabled nodes running at least one job.',
+                    [(labels, totals.get_used_nodes()) for labels, totals in groups]))
+    utilization = []
+    for labels, totals in groups:
+        usable = totals.total_cores - totals.disabled_cores
+        utilization.append((labels, float(totals.used_cores) / usable if usable else 0.0))
+    metrics.append(('utilization_ratio', 'Used cores over the cores of enabled nodes.', utilization))
+
+    user_cores, user_jobs, user_pending = {}, {}, {}
+    for user_name, job_list in snapshot.owner_index.items():
+        user_cores[user_name] = sum(int(job.get_core_info()) for job in job_list)
+        user_jobs[user_name] = len(set(job.get_id() for job in job_list)) # a parallel job is counted once
+    for job in snapshot.get_pending():
+        user_pending[job.get_user()] = user_pending.get(job.get_user(), 0) + 1
+    metrics.append(('user_running_cores', 'Cores used by the running jobs of a user.',
+                    [({'user': user_name}, user_cores[user_name]) for user_name in sorted(user_cores)]))
+    metrics.append(('user_running_jobs', 'Running jobs of a user.',
+                    [({'user': user_name}, user_jobs[user_name]) for user_name in sorted(user_jobs)]))
+    metrics.append(('user_pending_jobs', 'Pending jobs of a user.',
+                    [({'user': user_name}, user_pending[user_name]) for user_name in sorted(user_pending)]))
+    metrics.append(('running_jobs', 'Running jobs.', [({}, len(snapshot.job_index))]))
+    metrics.append(('pending_jobs', 'Pending jobs.', [({}, len(snapshot.get_pending()))]))
+
+    low_hosts = set(short_host(node.host) for node, load in find_low_efficiency(snapshot, load_map))
+    low_efficiency = [({}, len(low_hosts))]
+    for hostgroup in hostgroup_list:
+        hosts = set(short_host(host) for host in hostgroup_hosts[hostgroup])
+        low_efficiency.append(({'hostgroup': hostgroup}, len(low_hosts & hosts)))
+    metrics.append(('low_efficiency_nodes', 'Full nodes with a load below {0}.'.format(LOWTHRESHOLD), low_efficiency))
+    metrics.append(('scrape_duration_seconds', 'Seconds taken to compute these metrics.', [({}, time.time() - started)]))
+    return format_metrics(metrics)
+#^----------------------------------------------------------------------------- cluster_metrics()
+
+def format_metrics(metrics):
+    """Turns a list of (name, help, [(labels dict, value), ...]) into the Prometheus text format, every name
+    getting METRICS_PREFIX and every metric being a gauge."""
+
+    lines = []
+    for name, help_text, samples in metrics:
+        name = METRICS_PREFIX + name
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} gauge'.format(name))
+        for labels, value in samples:
+            label_text = ','.join('{0}="{1}"'.format(key, metric_label(labels[key])) for key in sorted(labels))
+            if label_text:
+                label_text = '{' + label_text + '}'
+            lines.append('{0}{1} {2}'.format(name, label_text, repr(value) if isinstance(value, float) else value))
+    return '\n'.join(lines) + '\n'
+#^----------------------------------------------------------------------------- format_metrics(metrics)
+
+def metric_label(value):
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+#^----------------------------------------------------------------------------- metric_label(value)
+
+class HistoryStore:
+    """Class for the sqlite file of --record and --report. Every --record adds one raw sample per hostgroup
+    (and one for the whole cluster, named 'Cluster', which also holds the pending jobs) and adds the same
+    sample to the hourly and daily rollup rows it falls in, so a report over a long window reads one row per
+    hour or day instead of every sample. Raw samples are dropped after HISTORY_RAW_DAYS. Disabled nodes are
+    kept as spans (host, first seen, last seen) which are extended while the node stays disabled."""
+
+    def __init__(self, path):
+        """Opens (and creates if needed) the history file at path."""
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != HISTORY_VERSION:
+            self.create()
+
+    def __repr__(self):
+        return 'HistoryStore-{0}'.format(self.path)
+
+    def create(self):
+        """Method to create the tables of a new history file."""
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS samples (time INTEGER, hostgroup TEXT, total_cores INTEGER, '
+                            'used_cores INTEGER, disabled_cores INTEGER, total_nodes INTEGER, disabled_nodes INTEGER, '
+                            'pending_jobs INTEGER, pending_cores INTEGER, PRIMARY KEY (hostgroup, time))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS samples_time ON samples (time)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS rollups (period INTEGER, start INTEGER, hostgroup TEXT, '
+                            'samples INTEGER, used_sum INTEGER, usable_sum INTEGER, util_max REAL, pending_sum INTEGER, '
+                            'pending_max INTEGER, disabled_sum INTEGER, disabled_max INTEGER, '
+                            'PRIMARY KEY (period, hostgroup, start))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS disabled (host TEXT, since INTEGER, last INTEGER, '
+                            'PRIMARY KEY (host, since))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS disabled_last ON disabled (last)')
+            self.db.execute('PRAGMA user_version = {0}'.format(HISTORY_VERSION))
+        return
+
+    def last_time(self):
+        """Method to obtain the time of the last sample, None for a new file."""
+        return self.db.execute("SELECT MAX(time) FROM samples WHERE hostgroup = 'Cluster'").fetchone()[0]
+
+    def record(self, now, totals_list, pending_jobs, pending_cores, disabled_hosts):
+        """Method to add one sample taken at now (seconds since the epoch). totals_list is a list of
+        (hostgroup, HostTotals), the first being 'Cluster', and disabled_hosts the hosts disabled at now."""
+        previous = self.last_time()
+        with self.db:
+            for hostgroup, totals in totals_list:
+                pending = (pending_jobs, pending_cores) if hostgroup == 'Cluster' else (0, 0)
+                self.db.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (now, hostgroup, totals.total_cores, totals.used_cores, totals.disabled_cores,
+                                 totals.total_nodes, totals.disabled_nodes) + pending)
+                usable = totals.total_cores - totals.disabled_cores
+                utilization = float(totals.used_cores) / usable if usable else 0.0
+                for period in HISTORY_PERIODS:
+                    start = bucket_start(now, period)
+                    self.db.execute('INSERT OR IGNORE INTO rollups VALUES (?, ?, ?, 0, 0, 0, 0, 0, 0, 0, 0)',
+                                    (period, start, hostgroup))
+                    self.db.execute('UPDATE rollups SET samples = samples + 1, used_sum = used_sum + ?, '
+                                    'usable_sum = usable_sum + ?, util_max = MAX(util_max, ?), '
+                                    'pending_sum = pending_sum + ?, pending_max = MAX(pending_max, ?), '
+                                    'disabled_sum = disabled_sum + ?, disabled_max = MAX(disabled_max, ?) '
+                                    'WHERE period = ? AND hostgroup = ? AND start = ?',
+                                    (totals.used_cores, usable, utilization, pending[0], pending[0],
+                                     totals.disabled_nodes, totals.disabled_nodes, period, hostgroup, start))
+            for host in disabled_hosts:
+                extended = self.db.execute('UPDATE disabled SET last = ? WHERE host = ? AND last = ?',
+                                           (now, host, previous)).rowcount
+                if not extended: # not disabled at the last sample, a new span starts
+                    self.db.execute('INSERT OR IGNORE INTO disabled VALUES (?, ?, ?)', (host, now, now))
+            self.db.execute('DELETE FROM samples WHERE time < ?', (now - HISTORY_RAW_DAYS * 86400,))
+        return
+
+    def rollups(self, period, hostgroup, since):
+        """Method to obtain the rollup rows of a hostgroup starting from the bucket holding since, oldest first.
+        Returns a list of (start, samples, used_sum, usable_sum, util_max, pending_max, disabled_sum)."""
+        return self.db.execute('SELECT start, samples, used_sum, usable_sum, util_max, pending_max, disabled_sum '
+                               'FROM rollups WHERE period = ? AND hostgroup = ? AND start >= ? ORDER BY start',
+                               (period, hostgroup, bucket_start(since, period))).fetchall()
+
+    def disabled_spans(self, since):
+        """Method to obtain the (host, since, last) disabled spans which reach into the window from since."""
+        return self.db.execute('SELECT host, since, last FROM disabled WHERE last >= ?', (since,)).fetchall()
+
+    def close(self):
+        self.db.close()
+        return
+#^--------------------------------------------------------- class HistoryStore
+
+def bucket_start(when, period):
+    """Returns the start of the hour or day (in local time) of period seconds which holds when."""
+    offset = time.localtime(when).tm_gmtoff
+    return int(when - (when + offset) % period)
+#^----------------------------------------------------------------------------- bucket_start(when, period)
+
+def record_history():
+    """Function for --record, meant to be run from cron every few minutes. Adds the core and node totals of
+    the cluster and of every hostgroup, the pending jobs and the disabled nodes of one snapshot to the
+    history file (HISTORY_FILE, see HistoryStore)."""
+
+    snapshot = get_snapshot()
+    hostgroup_list = qconf_output("qconf -shgrpl").split()
+    hostgroup_hosts = resolve_hostgroups(hostgroup_list)
+    table = snapshot.get_table()
+    cluster_hosts = set()
+    for hostgroup in hostgroup_list:
+        cluster_hosts.update(hostgroup_hosts[hostgroup])
+    totals_list = [('Cluster', table.totals(table.host_rows_for(cluster_hosts)))]
+    for hostgroup in hostgroup_list:
+        totals_list.append((hostgroup, table.totals(table.host_rows_for(hostgroup_hosts[hostgroup]))))
+
+    pending = snapshot.get_pending()
+    disabled_hosts = set()
+    for node in table.nodes(table.host_rows_for(cluster_hosts)): # first queue instance of every host, as counted
+        if node.get_disabled_switch():
+            disabled_hosts.add(short_host(node.host))
+    store = HistoryStore(HISTORY_FILE)
+    store.record(int(time.time()), totals_list, len(pending), sum(int(job.get_core_info()) for job in pending),
+                 sorted(disabled_hosts))
+    store.close()
+    sys.exit(0)
+#^----------------------------------------------------------------------------- record_history()
+
+def parse_since(text):
+    """Turns a --since window such as 90m, 12h, 7d or 4w into seconds, None if it is not one."""
+    units = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    try:
+        seconds = float(text[:-1]) * units[text[-1:]]
+    except (KeyError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+#^----------------------------------------------------------------------------- parse_since(text)
+
+def report_history(argv):
+    """Function for --report [--since WINDOW] [--hostgroup NAME]. Summarizes the recorded history of a hostgroup
+    (the whole cluster by default) over the window (7d by default): mean and peak utilization, peak pending
+    depth of the cluster, disabled nodes and how long they stayed disabled, followed by one row per hour for
+    windows up to two days and one row per day beyond, read from the rollups."""
+
+    window, hostgroup = '7d', 'Cluster'
+    args = iter(argv)
+    for arg in args:
+        if arg == '--since':
+            window = next(args, '')
+        elif arg == '--hostgroup':
+            hostgroup = next(args, '')
+            hostgroup = '@' + hostgroup.lstrip('@') if hostgroup.lstrip('@') else ''
+        else:
+            print("Error: --report only takes --since and --hostgroup, not '{0}'.".format(arg))
+            show_usage(23)
+    seconds = parse_since(window)
+    if seconds is None or not hostgroup:
+        print("Error: --report takes --since 90m|12h|7d|4w and --hostgroup NAME.")
+        show_usage(23)
+    if not os.path.exists(HISTORY_FILE):
+        print("Error: no history in {0}, it is written by node_search --record.".format(HISTORY_FILE))
+        sys.exit(29)
+
+    store = HistoryStore(HISTORY_FILE)
+    since = int(time.time() - seconds)
+    period = HISTORY_PERIODS[0] if seconds <= 2 * 86400 else HISTORY_PERIODS[1]
+    buckets = store.rollups(period, hostgroup, since)
+    pending = dict((row[0], row[5]) for row in store.rollups(period, 'Cluster', since))
+    spans = store.disabled_spans(since)
+    last = store.last_time()
+    store.close()
+    if not buckets:
+        print("Error: nothing was recorded for {0} in the last {1}.".format(hostgroup, window))
+        sys.exit(29)
+    if hostgroup != 'Cluster':
+        hosts = set(short_host(host) for host in resolve_hostgroups([hostgroup])[hostgroup])
+        spans = [span for span in spans if span[0] in hosts]
+
+    samples = sum(row[1] for row in buckets)
+    used_sum = sum(row[2] for row in buckets)
+    usable_sum = sum(row[3] for row in buckets)
+    durations = {} # host -> seconds disabled within the window
+    for host, start, end in spans:
+        durations[host] = durations.get(host, 0) + end - max(start, since)
+    summary = [('hostgroup', hostgroup), ('since', window), ('samples', samples),
+               ('mean_utilization', float(used_sum) / usable_sum if usable_sum else 0.0),
+               ('peak_utilization', max(row[4] for row in buckets)),
+               ('mean_used_cores', float(used_sum) / samples),
+               ('peak_pending_jobs', max(pending.values()) if pending else None),
+               ('mean_disabled_nodes', float(sum(row[6] for row in buckets)) / samples),
+               ('nodes_disabled', len(durations)),
+               ('nodes_disabled_now', len(set(span[0] for span in spans if span[2] == last))),
+               ('longest_disabled_hours', max(end - start for host, start, end in spans) / 3600.0 if spans else 0.0),
+               ('disabled_node_hours', sum(durations.values()) / 3600.0)]
+
+    if OUTPUT_FORMAT != 'text':
+        emit('history_summary', summary)
+        for start, count, used, usable, util_max, pending_max, disabled in buckets:
+            emit('history_bucket', [('hostgroup', hostgroup), ('start', start), ('period', period), ('samples', count),
+                                    ('mean_utilization', float(used) / usable if usable else 0.0),
+                                    ('peak_utilization', util_max), ('mean_used_cores', float(used) / count),
+                                    ('peak_pending_jobs', pending.get(start)),
+                                    ('mean_disabled_nodes', float(disabled) / count)])
+        sys.exit(0)
+
+    values = dict(summary)
+    half = int(TERMWIDTH/2)
+    print('{0}, last {1}'.format(hostgroup, window).ljust(TERMWIDTH))
+    print('-'.center(60, '-'))
+    print('Samples:'.ljust(half) + str(samples))
+    print('Mean Utilization:'.ljust(half) + '{0:.1f}%'.format(100 * values['mean_utilization']))
+    print('Peak Utilization:'.ljust(half) + '{0:.1f}%'.format(100 * values['peak_utilization']))
+    print('Mean Used Cores:'.ljust(half) + '{0:.1f}'.format(values['mean_used_cores']))
+    print('Peak Pending Jobs (cluster):'.ljust(half) + str(values['peak_pending_jobs']))
+    print('Mean Disabled Nodes:'.ljust(half) + '{0:.1f}'.format(values['mean_disabled_nodes']))
+    print('Nodes Disabled:'.ljust(half) + '{0} ({1} now)'.format(values['nodes_disabled'], values['nodes_disabled_now']))
+    print('Longest Disabled:'.ljust(half) + '{0:.1f} h'.format(values['longest_disabled_hours']))
+    print('Disabled Node-Hours:'.ljust(half) + '{0:.1f}'.format(values['disabled_node_hours']))
+    print('')
+    print(('Hour' if period == HISTORY_PERIODS[0] else 'Day').ljust(18) + 'Samples'.rjust(8) + 'Util%'.rjust(8)
+          + 'Peak%'.rjust(8) + 'Used'.rjust(9) + 'Pending'.rjust(9) + 'Disabled'.rjust(10))
+    print('-'.center(TERMWIDTH - 1, '-'))
+    for start, count, used, usable, util_max, pending_max, disabled in buckets:
+        print(time.strftime('%Y-%m-%d %H:%M', time.localtime(start)).ljust(18) + str(count).rjust(8)
+              + '{0:.1f}'.format(100.0 * used / usable if usable else 0.0).rjust(8)
+              + '{0:.1f}'.format(100 * util_max).rjust(8) + '{0:.0f}'.format(float(used) / count).rjust(9)
+              + str(pending.get(start, '-')).rjust(9) + '{0:.1f}'.format(float(disabled) / count).rjust(10))
+    sys.exit(0)
+#^----------------------------------------------------------------------------- report_history(argv)
+
 # Standard boilerplate to call the main() function.
 if __name__ == '__main__':
-  main()
+    try:
+        main()
+    finally:
+        close_records()
+        print_trace()
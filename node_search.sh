@@ -1,11 +1,30 @@
 #!/bin/bash
 
 # This scipt simply loads the python3 module for a user and then runs node_search. This
-# must be done as python3 is not loaded by default. 
+# must be done as python3 is not loaded by default.
 
 module load python &>/dev/null
 
 # Calling the node_search.py script. All arugments will be passed into node_search
 # The following needs to be the absolute path to node_search.py
-/afs/crc.nd.edu/user/c/ckankel/Public/node_search/node_search.py $@ 
+NODE_SEARCH=/afs/crc.nd.edu/user/c/ckankel/Public/node_search/node_search.py
 
+# If a node_search daemon (node_search.py --serve) is running, ask it first. Exit code 26
+# means it could not be reached or its socket does not belong to a trusted user, in which case
+# node_search runs directly as usual. Modes which keep running until interrupted, and the history
+# modes which use the caller's own history file, are never sent to the daemon.
+export NODE_SEARCH_SOCKET=${NODE_SEARCH_SOCKET:-/tmp/node_search.sock}
+direct=0
+for arg in "$@"; do
+    case "$arg" in
+        --watch|--serve|--metrics|--record|--report) direct=1 ;;
+    esac
+done
+if [ $direct -eq 0 ] && [ -S "$NODE_SEARCH_SOCKET" ]; then
+    $NODE_SEARCH --query "$@"
+    status=$?
+    if [ $status -ne 26 ]; then
+        exit $status
+    fi
+fi
+$NODE_SEARCH "$@"